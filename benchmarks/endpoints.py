@@ -0,0 +1,236 @@
+"""
+Times the main v1 API endpoints and catalog views against the configured
+database, which should first be filled with benchmarks.generate:
+
+    python -m benchmarks.endpoints --save benchmarks/baseline.json
+    python -m benchmarks.endpoints --compare benchmarks/baseline.json
+
+Reports latency percentiles, the number of queries per request and the
+number of rows the database returned per second for each benchmark. Requests
+go through Flask's test client, so the figures cover the application and
+database but not a WSGI server.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from sqlalchemy import event
+from benchmarks import report
+from benchmarks.report import percentile
+from impala import create_app, db
+from impala.catalog import models
+
+BENCHMARK_USER = 'benchmark'
+
+
+class Recorder:
+    """Counts the queries run and rows returned while it is listening"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.queries = 0
+        self.rows = 0
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        self.queries += 1
+        if cursor.description is not None and cursor.rowcount > 0:
+            self.rows += cursor.rowcount
+
+    def __enter__(self):
+        event.listen(self.engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
+
+
+def samples(rng, count):
+    """Picks ids, pages and search terms from the data"""
+    def column(query):
+        values = [row[0] for row in db.session.execute(query)]
+        if not values:
+            sys.exit("The database is empty; run benchmarks.generate first")
+        return values
+
+    return {
+        'track_ids': column("SELECT id FROM tracks ORDER BY random() "
+                            "LIMIT {}".format(count)),
+        'holding_ids': column("SELECT id FROM holdings ORDER BY random() "
+                              "LIMIT {}".format(count)),
+        'artists': column("SELECT album_artist FROM holding_groups "
+                          "ORDER BY random() LIMIT {}".format(count)),
+        'titles': column("SELECT album_title FROM holding_groups "
+                         "ORDER BY random() LIMIT {}".format(count)),
+        'groups': models.HoldingGroup.query.count(),
+        'holdings': models.Holding.query.count(),
+    }
+
+
+def benchmarks(data, rng):
+    """
+    Returns (name, method, path iterator, JSON body factory) for each
+    benchmark. Paths cycle through the sampled values so that no single row
+    stays hot in the database's cache.
+    """
+    def cycle(template, values):
+        return (template.format(v) for v in itertools.cycle(values))
+
+    def pages(template, rows, per_page):
+        # Deep pages cost more with OFFSET, so stay within the first 400
+        last = max(1, min(rows // per_page, 400))
+        return (template.format(rng.randint(1, last))
+                for _ in itertools.count())
+
+    def some_tracks():
+        return {'ids': [str(id) for id in
+                        rng.sample(data['track_ids'],
+                                   min(200, len(data['track_ids'])))]}
+
+    def new_tag():
+        return {'tag': 'benchmark',
+                'holding_id': str(rng.choice(data['holding_ids']))}
+
+    return [
+        ('api_list', 'GET', pages('/api/v1/holdings?page={}&limit=50',
+                                  data['holdings'], 50), None),
+        ('api_list_cursor', 'GET',
+         itertools.repeat('/api/v1/holdings?after=&limit=50'), None),
+        ('api_get', 'GET', cycle('/api/v1/tracks/{}', data['track_ids']),
+         None),
+        ('api_batch_get', 'POST', itertools.repeat('/api/v1/tracks/batch_get'),
+         some_tracks),
+        ('api_get_metadata', 'GET',
+         cycle('/api/v1/tracks/{}/metadata', data['track_ids']), None),
+        ('api_get_include', 'GET',
+         cycle('/api/v1/holdings/{}?include=holding_group,tracks,'
+               'holding_tags', data['holding_ids']), None),
+        ('api_put', 'PUT', itertools.repeat('/api/v1/holding_tags'),
+         new_tag),
+        ('holding_search', 'GET',
+         cycle('/api/v1/holdings/search?album_artist={}', data['artists']),
+         None),
+        ('holding_search_q', 'GET',
+         cycle('/api/v1/holdings/search?q={}', data['titles']), None),
+        ('list_holdings', 'GET',
+         pages('/holdings/page/{}', data['groups'], 25), None),
+        ('search', 'GET', cycle('/search?album_artist={}', data['artists']),
+         None),
+    ]
+
+
+def run(client, method, paths, body, requests, warmup):
+    latencies = []
+    queries = 0
+    rows = 0
+    for i in range(warmup + requests):
+        path = next(paths)
+        kwargs = {'json': body()} if body else {}
+        with Recorder(db.engine) as recorder:
+            start = time.perf_counter()
+            resp = client.open(path, method=method, **kwargs)
+            elapsed = time.perf_counter() - start
+        if resp.status_code >= 400:
+            sys.exit("{} {} returned {}".format(method, path,
+                                                resp.status_code))
+        if i >= warmup:
+            latencies.append(elapsed)
+            queries += recorder.queries
+            rows += recorder.rows
+
+    total = sum(latencies)
+    return {
+        'requests': requests,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_request': queries / requests,
+        'rows_per_sec': rows / total if total else 0,
+    }
+
+
+def environment():
+    tables = {row[0]: row[1] for row in db.session.execute(
+        "SELECT relname, reltuples::bigint FROM pg_class "
+        "WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace")}
+    return report.environment(
+        postgres=db.session.execute('SHOW server_version').scalar(),
+        rows={model.__tablename__: tables.get(model.__tablename__)
+              for model in [models.HoldingGroup, models.Holding,
+                            models.Track]})
+
+
+def more_queries(result, old):
+    return result['queries_per_request'] > old['queries_per_request']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', action='append',
+                        help="run just this benchmark (may be repeated)")
+    parser.add_argument('--save', metavar='PATH',
+                        help="write the results to PATH as a baseline")
+    parser.add_argument('--compare', metavar='PATH',
+                        help="compare the results with a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="p50 slowdown counted as a regression "
+                             "(default 0.1)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    app = create_app({'SEARCH_BACKEND': 'sql'}, cli=False)
+    with app.app_context():
+        data = samples(rng, 500)
+        env = environment()
+        db.session.remove()
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = BENCHMARK_USER
+            session['access'] = ['librarian']
+
+        results = {}
+        print("{:<18} {:>8} {:>8} {:>8} {:>9} {:>11}".format(
+            'benchmark', 'p50 ms', 'p90 ms', 'p99 ms', 'queries',
+            'rows/s'))
+        try:
+            for name, method, paths, body in benchmarks(data, rng):
+                if args.only and name not in args.only:
+                    continue
+                result = run(client, method, paths, body, args.requests,
+                             args.warmup)
+                results[name] = result
+                print("{:<18} {:>8.2f} {:>8.2f} {:>8.2f} {:>9.1f} "
+                      "{:>11.0f}".format(
+                          name, result['p50_ms'], result['p90_ms'],
+                          result['p99_ms'], result['queries_per_request'],
+                          result['rows_per_sec']))
+        finally:
+            models.HoldingTag.query.filter_by(
+                added_by=BENCHMARK_USER).delete()
+            db.session.commit()
+
+    if args.save:
+        report.save(args.save, env, results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['environment']['rows'] != env['rows']:
+            print("warning: the baseline was measured on a different "
+                  "catalog size", file=sys.stderr)
+        regressed = report.compare(results, baseline, args.threshold,
+                                   worse=more_queries)
+        if regressed:
+            sys.exit("Regressed: {}".format(', '.join(regressed)))
+
+
+if __name__ == '__main__':
+    main()
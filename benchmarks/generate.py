@@ -0,0 +1,221 @@
+"""
+Fills the configured database with a synthetic catalog for benchmarking.
+The output depends only on --seed and --tracks, so two runs at the same
+scale build the same catalog:
+
+    python -m benchmarks.generate --tracks 100000 --truncate
+
+Rows are written to temporary files in one pass and then loaded with COPY,
+so memory use stays flat up to millions of tracks.
+"""
+import argparse
+import csv
+from datetime import datetime, timedelta
+import json
+import random
+import tempfile
+import time
+import uuid
+from impala import create_app, db
+from impala.catalog import models
+
+# Load order, which follows the foreign keys
+MODELS = [models.Stack, models.Format, models.HoldingGroup, models.Holding,
+          models.RotationRelease, models.HoldingTag, models.HoldingComment,
+          models.Track]
+
+# The columns written for each model after id, added_by and added_at, in the
+# order Generator passes them; any others get their database default
+COLUMNS = {
+    models.Stack: ['name', 'description'],
+    models.Format: ['name', 'description', 'physical'],
+    models.HoldingGroup: ['album_title', 'album_artist', 'releasegroup_mbid',
+                          'description', 'active', 'stack_id'],
+    models.Holding: ['label', 'release_mbid', 'description', 'source_url',
+                     'source_desc', 'torrent_hash', 'active',
+                     'holding_group_id', 'format_id'],
+    models.RotationRelease: ['start', 'stop', 'bin', 'holding_id'],
+    models.HoldingTag: ['owner', 'tag', 'holding_id'],
+    models.HoldingComment: ['comment_text', 'reviewer_username',
+                            'reviewer_fullname', 'rating', 'review_date',
+                            'type', 'holding_id'],
+    models.Track: ['title', 'artist', 'file_path', 'track_num', 'disc_num',
+                   'track_mbid', 'recording_mbid', 'has_fcc', 'holding_id',
+                   'metadata'],
+}
+
+WORDS = ('black white red blue night day sun moon river city dream fire '
+         'glass heart ghost shadow electric golden silver wild quiet lost '
+         'summer winter young old love machine ocean paper stone signal '
+         'velvet broken secret empty northern southern last first radio '
+         'tiger wolf crystal neon honey thunder rain static echo garden '
+         'mirror street highway island diamond ').split()
+GENRES = ['rock', 'pop', 'jazz', 'electronic', 'hip hop', 'folk', 'metal',
+          'punk', 'classical', 'country', 'soul', 'ambient', 'experimental',
+          'indie', 'blues', 'reggae']
+FORMATS = [('FLAC', False), ('MP3 V0', False), ('MP3 320', False),
+           ('CD', True), ('Vinyl', True), ('Cassette', True)]
+STACKS = ['New Music', 'Library', 'Rotation', 'Specialty', 'Archive']
+BINS = ['H', 'M', 'L', 'N']
+METADATA_KEYS = ['genre', 'bpm', 'isrc', 'composer']
+
+# Average number of children per parent row
+HOLDINGS_PER_GROUP = 1.3
+TRACKS_PER_HOLDING = 11
+TAGS_PER_HOLDING = 1.5
+COMMENTS_PER_HOLDING = 0.3
+ROTATIONS_PER_HOLDING = 0.2
+METADATA_PER_TRACK = 2
+
+
+class Generator:
+    def __init__(self, seed, tracks, years=20):
+        self.rng = random.Random(seed)
+        self.tracks = tracks
+        self.now = datetime(2026, 1, 1)
+        self.span = timedelta(days=365 * years).total_seconds()
+        self.files = {model: tempfile.TemporaryFile('w+', newline='')
+                      for model in MODELS}
+        self.writers = {model: csv.writer(f)
+                        for model, f in self.files.items()}
+        self.counts = {model: 0 for model in MODELS}
+        self.artists = [self.phrase(1, 3).title()
+                        for _ in range(max(10, tracks // 60))]
+        self.labels = [self.phrase(1, 2).title() + ' Records'
+                       for _ in range(max(5, tracks // 400))]
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def phrase(self, low, high):
+        return ' '.join(self.rng.choice(WORDS)
+                        for _ in range(self.rng.randint(low, high)))
+
+    def count(self, mean):
+        """A Poisson-ish number of children averaging `mean`"""
+        whole = int(mean)
+        return whole + (1 if self.rng.random() < mean - whole else 0)
+
+    def popular(self, items):
+        """Picks from `items` with a long tail, like real artists and labels"""
+        return items[min(int(self.rng.paretovariate(1.2)) - 1,
+                         len(items) - 1)]
+
+    def write(self, model, row):
+        self.writers[model].writerow(
+            ['\\N' if value is None else value for value in row])
+        self.counts[model] += 1
+
+    def row(self, model, added_at, *values):
+        id = self.uuid()
+        self.write(model, (id, 'generator', added_at.isoformat()) + values)
+        return id
+
+    def generate(self):
+        self.rng.shuffle(self.artists)
+        self.rng.shuffle(self.labels)
+        start = self.now - timedelta(seconds=self.span)
+        stacks = [self.row(models.Stack, start, name, None)
+                  for name in STACKS]
+        formats = [self.row(models.Format, start, name, None, physical)
+                   for name, physical in FORMATS]
+
+        tracks = 0
+        while tracks < self.tracks:
+            added_at = self.now - timedelta(
+                seconds=self.rng.random() * self.span)
+            group = self.row(models.HoldingGroup, added_at,
+                             self.phrase(1, 4).title(),
+                             self.popular(self.artists), self.uuid(),
+                             None, self.rng.random() > 0.02,
+                             self.rng.choice(stacks))
+            for _ in range(max(1, self.count(HOLDINGS_PER_GROUP))):
+                tracks += self.holding(group, added_at, formats)
+
+    def holding(self, group, added_at, formats):
+        digital = self.rng.random() < 0.8
+        holding = self.row(
+            models.Holding, added_at, self.popular(self.labels), self.uuid(),
+            None, None, None,
+            self.uuid().replace('-', '') if digital else None,
+            self.rng.random() > 0.05, group, self.rng.choice(formats))
+
+        for _ in range(self.count(ROTATIONS_PER_HOLDING)):
+            start = added_at + timedelta(days=self.rng.randint(0, 30))
+            stop = start + timedelta(weeks=self.rng.randint(4, 12))
+            self.row(models.RotationRelease, added_at, start.isoformat(),
+                     stop.isoformat(), self.rng.choice(BINS), holding)
+        for _ in range(self.count(TAGS_PER_HOLDING)):
+            self.row(models.HoldingTag, added_at, None,
+                     self.rng.choice(GENRES), holding)
+        for _ in range(self.count(COMMENTS_PER_HOLDING)):
+            comment_type = self.rng.choice(list(models.HoldingCommentType))
+            self.row(models.HoldingComment, added_at, self.phrase(5, 30),
+                     None, self.phrase(2, 2).title(),
+                     self.rng.randint(1, 5), added_at.date().isoformat(),
+                     comment_type.name, holding)
+
+        count = max(1, int(self.rng.gauss(TRACKS_PER_HOLDING, 4)))
+        for num in range(1, count + 1):
+            metadata = {key: [self.phrase(1, 2)] for key in
+                        self.rng.sample(METADATA_KEYS, METADATA_PER_TRACK)}
+            self.row(
+                models.Track, added_at, self.phrase(1, 5).title(),
+                self.popular(self.artists),
+                '/music/{}/{:02}.flac'.format(holding, num) if digital
+                else None, num, 1, self.uuid(), self.uuid(),
+                self.rng.choice(list(models.TrackFccStatus)).name, holding,
+                json.dumps(metadata))
+        return count
+
+    def load(self, connection):
+        cursor = connection.cursor()
+        for model in MODELS:
+            f = self.files[model]
+            f.seek(0)
+            columns = ', '.join(['id', 'added_by', 'added_at'] +
+                                COLUMNS[model])
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+                .format(model.__tablename__, columns), f)
+            f.close()
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--tracks', type=int, default=100000,
+                        help="approximate number of tracks (default 100000)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--truncate', action='store_true',
+                        help="delete every existing row first")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generator = Generator(args.seed, args.tracks)
+    generator.generate()
+    generated = time.perf_counter()
+
+    with create_app(cli=False).app_context():
+        connection = db.engine.raw_connection()
+        try:
+            if args.truncate:
+                connection.cursor().execute('TRUNCATE {}'.format(', '.join(
+                    model.__tablename__ for model in MODELS)))
+            generator.load(connection)
+            connection.commit()
+            connection.cursor().execute('ANALYZE')
+            connection.commit()
+        finally:
+            connection.close()
+    loaded = time.perf_counter()
+
+    for model in MODELS:
+        print("{:<20} {:>10}".format(model.__tablename__,
+                                     generator.counts[model]))
+    print("generated in {:.1f}s, loaded in {:.1f}s".format(
+        generated - start, loaded - generated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Summarizing, saving and comparing benchmark results. Nothing here imports
+impala, so that benchmarks.startup can time that import itself.
+"""
+import json
+import platform
+import subprocess
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def environment(**extra):
+    """What the results depend on besides the code: the revision, the
+    Python version and whatever the benchmark adds in `extra`"""
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        **extra,
+    }
+
+
+def save(path, env, results):
+    with open(path, 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=2,
+                  sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, threshold, width=18, worse=None):
+    """
+    Prints the change from `baseline` and returns the regressed names: those
+    whose p50 grew by more than `threshold`, or for which `worse(result,
+    old)` is true.
+    """
+    regressed = []
+    print("\n{:<{width}} {:>10} {:>10} {:>8}".format(
+        'vs. baseline', 'p50 ms', 'was', 'change', width=width))
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        change = result['p50_ms'] / old['p50_ms'] - 1
+        flag = ''
+        if change > threshold or (worse is not None and worse(result, old)):
+            regressed.append(name)
+            flag = ' !'
+        print("{:<{width}} {:>10.2f} {:>10.2f} {:>+7.0%}{}".format(
+            name, result['p50_ms'], old['p50_ms'], change, flag,
+            width=width))
+    return regressed
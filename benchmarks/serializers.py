@@ -0,0 +1,85 @@
+"""
+Compares the precompiled v1 serializers against the per-row all_fields()
+and Flask JSON encoding they replaced, on in-memory rows so that no
+database is needed:
+
+    python -m benchmarks.serializers --rows 1000
+"""
+import argparse
+from datetime import datetime, timedelta
+from enum import Enum
+import time
+from uuid import uuid4
+from flask import json
+from impala import create_app
+from impala.api.v1 import serializers
+from impala.catalog import models
+
+
+def legacy_all_fields(model, exclude=[]):
+    columns = [c.name for c in model.__table__.columns if c.name not in exclude]
+    d = {}
+
+    for c in columns:
+        value = getattr(model, c)
+        if isinstance(value, Enum):
+            value = value.name
+        d[c] = value
+
+    return d
+
+
+def legacy_response(items):
+    return json.dumps({'results': [legacy_all_fields(i) for i in items]})
+
+
+def compiled_response(items):
+    serialize = serializers.serializer_for(models.Track)
+    return serializers.dumps({'results': [serialize(i) for i in items]})
+
+
+def make_tracks(count):
+    now = datetime.now()
+    return [models.Track(id=str(uuid4()), added_by='bench',
+                         added_at=now - timedelta(seconds=i),
+                         title='Track {}'.format(i), artist='Artist',
+                         file_path='/music/{}.flac'.format(i),
+                         track_num=i % 20 + 1, disc_num=1,
+                         track_mbid=str(uuid4()), recording_mbid=None,
+                         has_fcc=models.TrackFccStatus.UNKNOWN,
+                         holding_id=str(uuid4()))
+            for i in range(count)]
+
+
+def measure(fn, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with create_app(cli=False).app_context():
+        items = make_tracks(args.rows)
+        assert json.loads(legacy_response(items)) == \
+            json.loads(compiled_response(items))
+
+        legacy = measure(legacy_response, items, args.repeat)
+        compiled = measure(compiled_response, items, args.repeat)
+
+    print("encoder:  {}".format('orjson' if serializers.orjson else 'flask'))
+    print("legacy:   {:>10.0f} rows/s".format(legacy))
+    print("compiled: {:>10.0f} rows/s ({:.1f}x)".format(compiled,
+                                                     compiled / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Times how long a process takes to become ready to serve requests against
+the configured database:
+
+    python -m benchmarks.startup --save benchmarks/startup.json
+    python -m benchmarks.startup --compare benchmarks/startup.json
+
+`cold` starts a new interpreter for each run, as uWSGI does for its master
+(and for every worker with --lazy-apps), and reports the time to import
+impala, to build the application and to answer the first requests, along
+with the whole process including interpreter startup. `respawn` forks
+workers from the process impala.wsgi sets up, as uWSGI does when it
+replaces a worker killed by --harakiri, and times each worker's first
+requests, which include opening its own database connections.
+
+impala is only imported inside the runs, so that this script's own imports
+are not counted.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from benchmarks import report
+from benchmarks.report import percentile
+
+BENCHMARK_USER = 'benchmark'
+
+# The first requests a new worker serves: an API list and a catalog page,
+# which between them open a connection and load the templates
+FIRST_REQUESTS = ['/api/v1/formats', '/holdings']
+
+
+def first_requests(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = BENCHMARK_USER
+        session['access'] = ['librarian']
+    for path in FIRST_REQUESTS:
+        resp = client.get(path)
+        if resp.status_code >= 400:
+            sys.exit("GET {} returned {}".format(path, resp.status_code))
+
+
+def cold_child():
+    """One cold start; prints its timings as JSON"""
+    start = time.perf_counter()
+    import impala
+    imported = time.perf_counter()
+    app = impala.create_app(cli=False)
+    created = time.perf_counter()
+    first_requests(app)
+    served = time.perf_counter()
+    print(json.dumps({
+        'import': imported - start,
+        'create_app': created - imported,
+        'first_requests': served - created,
+        'modules': len(sys.modules),
+    }))
+
+
+def cold(runs):
+    timings = {'import': [], 'create_app': [], 'first_requests': [],
+               'process': []}
+    modules = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.startup', '--cold-child'])
+        timings['process'].append(time.perf_counter() - start)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        for name in ('import', 'create_app', 'first_requests'):
+            timings[name].append(result[name])
+        modules = result['modules']
+    return timings, modules
+
+
+def respawn(runs):
+    from impala.wsgi import app
+
+    timings = []
+    for _ in range(runs):
+        read, write = os.pipe()
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read)
+                with app.app_context():
+                    first_requests(app)
+                os.write(write, str(time.perf_counter() - start).encode())
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(write)
+        with os.fdopen(read) as f:
+            elapsed = f.read()
+        _, status = os.waitpid(pid, 0)
+        if status != 0:
+            sys.exit("A forked worker failed")
+        timings.append(float(elapsed))
+    return {'first_requests': timings}
+
+
+def summarize(prefix, timings):
+    return {'{}_{}'.format(prefix, name): {
+        'runs': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p90_ms': percentile(values, 90) * 1000,
+    } for name, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--save', metavar='PATH',
+                        help="write the results to PATH as a baseline")
+    parser.add_argument('--compare', metavar='PATH',
+                        help="compare the results with a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="p50 slowdown counted as a regression "
+                             "(default 0.1)")
+    parser.add_argument('--cold-child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_child:
+        cold_child()
+        return
+
+    timings, modules = cold(args.runs)
+    results = summarize('cold', timings)
+    results.update(summarize('respawn', respawn(args.runs)))
+    env = report.environment(modules=modules)
+
+    print("{:<26} {:>8} {:>8}".format('benchmark', 'p50 ms', 'p90 ms'))
+    for name, result in results.items():
+        print("{:<26} {:>8.2f} {:>8.2f}".format(
+            name, result['p50_ms'], result['p90_ms']))
+    print("modules loaded by a cold start: {}".format(modules))
+
+    if args.save:
+        report.save(args.save, env, results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = report.compare(results, baseline, args.threshold,
+                                   width=26)
+        if regressed:
+            sys.exit("Regressed: {}".format(', '.join(regressed)))
+
+
+if __name__ == '__main__':
+    main()
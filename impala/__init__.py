@@ -1,34 +1,60 @@
 from flask import Flask
-from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
-from impala import defaults
+from impala import defaults, metrics, replicas, workers
 import os
 
-app = Flask(__name__)
-app.config.from_object(defaults)
+db = replicas.RoutingSQLAlchemy()
 
-config_path = os.environ.get('APP_CONFIG_PATH', 'config.py')
-if config_path.endswith('.py'):
-    app.config.from_pyfile(config_path, silent=True)
-else:
-    app.config.from_json(config_path, silent=True)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def create_app(config=None, cli=True):
+    """
+    Builds the application. `config` overrides the defaults and the file
+    named by APP_CONFIG_PATH. With `cli`, the `flask` commands and
+    Flask-Migrate, which pulls in Alembic, are registered too; the WSGI
+    entry point in impala.wsgi leaves them out.
+    """
+    app = Flask(__name__)
+    app.config.from_object(defaults)
 
+    config_path = os.environ.get('APP_CONFIG_PATH', 'config.py')
+    if config_path.endswith('.py'):
+        app.config.from_pyfile(config_path, silent=True)
+    else:
+        app.config.from_json(config_path, silent=True)
+    if config is not None:
+        app.config.update(config)
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-from impala.catalog.models import *
-from impala.api import v1
-from impala.catalog import views
+    metrics.init_app(app)
+    workers.init_app(app)
+    db.init_app(app)
+    replicas.init_app(app)
 
-
-def init_app():
+    from impala.api import v1
+    from impala.catalog import views
     app.register_blueprint(v1.bp, url_prefix='/api/v1')
+    app.register_blueprint(views.bp)
+
+    if cli:
+        init_cli(app)
+    return app
+
+
+def init_cli(app):
+    from flask_migrate import Migrate
+    from impala.api.v1.export import export_command
+    from impala.search.cli import search_cli
+    from impala.dedup.cli import dedup_cli
+    from impala.rollups import rollups_cli
+    from impala.plancheck import check_plans_command
 
+    Migrate(app, db)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(dedup_cli)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(export_command)
+    app.cli.add_command(check_plans_command)
 
-init_app()
 
 if __name__ == "__main__":
-    app.run()
+    create_app().run()
@@ -0,0 +1,67 @@
+from datetime import timezone
+import hashlib
+from flask import Response, request
+from werkzeug.http import http_date, quote_etag
+
+
+def rows_etag(rows, *variant):
+    """
+    Returns a strong ETag for a representation of `rows`, computed from
+    their ids and versions rather than their serialized form. `variant`
+    holds anything else that changes the representation, such as the
+    requested fields or the page.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr(variant).encode('utf-8'))
+    for row in rows:
+        digest.update('\n{}:{}'.format(row.id, row.version).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def item_etag(row, fields=None):
+    return rows_etag([row], sorted(fields) if fields else None)
+
+
+def body_etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def last_modified(rows):
+    times = [row.updated_at for row in rows if row.updated_at is not None]
+    return max(times) if times else None
+
+
+def utc(timestamp):
+    """
+    Returns a stored timestamp, which is naive local time as given by
+    datetime.now(), as an aware UTC datetime
+    """
+    return timestamp.astimezone(timezone.utc)
+
+
+def validator_headers(etag, modified=None):
+    headers = {'ETag': quote_etag(etag)}
+    if modified is not None:
+        headers['Last-Modified'] = http_date(utc(modified))
+    return headers
+
+
+def not_modified(etag, modified=None):
+    """
+    Checks the request's If-None-Match, or failing that its
+    If-Modified-Since, against the current validators. Pass `modified` only
+    where a timestamp alone is enough to tell that nothing changed.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if modified is not None and since is not None:
+        # Werkzeug parses HTTP dates to naive UTC
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return utc(modified).replace(microsecond=0) <= since
+    return False
+
+
+def not_modified_response(headers):
+    return Response(status=304, headers=headers)
@@ -0,0 +1,50 @@
+import click
+from impala.api.v1.pagination import sort_columns
+from impala.api.v1.serializers import dumps, serializer_for
+from impala.catalog import models
+
+BATCH_SIZE = 1000
+
+EXPORT_MODELS = {model.__tablename__: model for model in [
+    models.Stack,
+    models.Format,
+    models.HoldingGroup,
+    models.Holding,
+    models.RotationRelease,
+    models.HoldingTag,
+    models.HoldingComment,
+    models.Track,
+    models.TrackMetadata,
+]}
+
+
+def export_query(model, since=None):
+    query = model.query.order_by(*sort_columns(model))
+    if since is not None:
+        query = query.filter(model.added_at >= since)
+    return query
+
+
+def ndjson_lines(query, model, batch_size=BATCH_SIZE):
+    """
+    Yields one JSON document per row. yield_per() makes psycopg2 use a
+    server-side cursor, so only `batch_size` rows are held in memory at a
+    time no matter how large the table is.
+    """
+    serialize = serializer_for(model)
+    for item in query.yield_per(batch_size):
+        yield dumps(serialize(item)) + b'\n'
+
+
+@click.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORT_MODELS)))
+@click.option('--since', type=click.DateTime(),
+              help="Only export rows added at or after this time.")
+@click.option('--output', '-o', type=click.File('wb'), default='-',
+              help="File to write to (default: stdout).")
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def export_command(table, since, output, batch_size):
+    """Export every row of TABLE as newline-delimited JSON."""
+    model = EXPORT_MODELS[table]
+    for line in ndjson_lines(export_query(model, since), model, batch_size):
+        output.write(line)
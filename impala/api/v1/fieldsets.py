@@ -0,0 +1,124 @@
+from collections import defaultdict
+import sqlalchemy
+from sqlalchemy.orm import load_only
+from impala.api.v1.pagination import sort_columns
+from impala.api.v1.serializers import serializer_for
+
+MAX_INCLUDES = 10
+
+# Always loaded so that rows can be identified, paged by cursor and given
+# validators
+ALWAYS_LOADED = ('id', 'added_at', 'updated_at', 'version')
+
+
+def parse_include(model, spec):
+    """
+    Turns 'holding_group,tracks.track_metadata' into a tree of relationship
+    names, checking each name against the model it is reached from.
+    """
+    tree = {}
+    paths = [p.strip() for p in spec.split(',') if p.strip()]
+    if len(paths) > MAX_INCLUDES:
+        raise ValueError("At most {} include paths are allowed".format(
+            MAX_INCLUDES))
+    for path in paths:
+        node = tree
+        current = model
+        for name in path.split('.'):
+            relationships = sqlalchemy.inspect(current).relationships
+            if name not in relationships:
+                raise ValueError("Unknown relationship '{}' in include".format(
+                    path))
+            current = relationships[name].mapper.class_
+            node = node.setdefault(name, {})
+    return tree
+
+
+def load_related(model, items, dicts, tree):
+    """
+    Embeds the relationships in `tree` into the serialized `dicts` for
+    `items`. Each relationship is fetched with one IN query for all of the
+    parent rows, whatever their number, so an include costs one query per
+    level rather than one per row.
+    """
+    mapper = sqlalchemy.inspect(model)
+    for name, subtree in tree.items():
+        prop = mapper.relationships[name]
+        target = prop.mapper.class_
+        local_column, remote_column = prop.local_remote_pairs[0]
+        local_key = mapper.get_property_by_column(local_column).key
+        remote_key = prop.mapper.get_property_by_column(remote_column).key
+
+        keys = {getattr(item, local_key) for item in items}
+        keys.discard(None)
+        related = []
+        if keys:
+            query = target.query.filter(remote_column.in_(keys))
+            if prop.order_by:
+                query = query.order_by(*prop.order_by)
+            else:
+                query = query.order_by(target.added_at, target.id)
+            related = query.all()
+
+        serialize = serializer_for(target)
+        related_dicts = [serialize(r) for r in related]
+        if subtree:
+            load_related(target, related, related_dicts, subtree)
+
+        by_key = defaultdict(list)
+        for r, d in zip(related, related_dicts):
+            by_key[getattr(r, remote_key)].append(d)
+        for item, d in zip(items, dicts):
+            matches = by_key.get(getattr(item, local_key), [])
+            if prop.uselist:
+                d[name] = matches
+            else:
+                d[name] = matches[0] if matches else None
+
+
+class Fieldset:
+    """
+    The shape of a GET response: which columns of the model to load and
+    return (`fields=`) and which related objects to embed (`include=`).
+    Raises ValueError for unknown fields or relationships.
+    """
+
+    def __init__(self, model, fields=None, include=None):
+        self.model = model
+        self.mapper = sqlalchemy.inspect(model)
+        self.include = parse_include(model, include) if include else {}
+
+        self.fields = None
+        if fields:
+            columns = {c.name: c for c in model.__table__.columns}
+            names = [f.strip() for f in fields.split(',') if f.strip()]
+            unknown = [f for f in names if f not in columns]
+            if unknown:
+                raise ValueError("Unknown fields: {}".format(
+                    ', '.join(unknown)))
+            self.fields = set(names) | {'id'}
+
+    def options(self):
+        if self.fields is None:
+            return []
+        load = set(self.fields) | set(ALWAYS_LOADED) | \
+            {column.name for column in sort_columns(self.model)}
+        # Foreign keys followed by include= have to be loaded as well
+        for name in self.include:
+            local_column = self.mapper.relationships[name]\
+                .local_remote_pairs[0][0]
+            if local_column.table is self.model.__table__:
+                load.add(local_column.name)
+        return [load_only(*(self.mapper.get_property_by_column(
+            self.model.__table__.columns[name]).key for name in load))]
+
+    def serialize(self, items):
+        serializer = serializer_for(self.model)
+        if self.fields is not None:
+            serializer = serializer.excluding(
+                c.name for c in self.model.__table__.columns
+                if c.name not in self.fields)
+        dicts = [serializer(item) for item in items]
+        if self.include:
+            load_related(self.model, items, dicts, self.include)
+        return dicts
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from datetime import datetime
+from uuid import uuid4
+from impala import db
+from impala.api.v1.schemas import ValidationError, schema_for
+from impala.catalog import metadata, models
+
+BATCH_SIZE = 1000
+
+# (document key, model, foreign key to the parent row, children)
+ALBUM_TREE = (None, models.HoldingGroup, None, (
+    ('holdings', models.Holding, 'holding_group_id', (
+        ('tracks', models.Track, 'holding_id', ()),
+        ('holding_tags', models.HoldingTag, 'holding_id', ()),
+        ('holding_comments', models.HoldingComment, 'holding_id', ()),
+        ('rotation_releases', models.RotationRelease, 'holding_id', ()),
+    )),
+))
+
+
+class AlbumDocumentError(Exception):
+    def __init__(self, errors):
+        super().__init__("Invalid album document")
+        self.errors = errors
+
+
+def insertable_columns(model):
+    return [c for c in model.__table__.columns
+            if c.name not in ['added_at', 'added_by', 'updated_at']]
+
+
+def fold_metadata(data, path, row, errors):
+    """
+    Adds a track's `track_metadata` list of {key, value} objects, the form
+    in which metadata used to be sent, to the row's metadata document.
+    """
+    document = row.get('metadata', {})
+    items = data.get('track_metadata', [])
+    if not isinstance(items, list):
+        errors['{}.track_metadata'.format(path)] = "Expected a list"
+        items = []
+    for i, item in enumerate(items):
+        item_path = '{}.track_metadata[{}]'.format(path, i)
+        if not isinstance(item, dict):
+            errors[item_path] = "Expected an object"
+            continue
+        try:
+            entry = schema_for(models.TrackMetadata).parse(
+                item, skip=['id', 'track_id'])
+        except ValidationError as e:
+            for name, message in e.errors.items():
+                errors['{}.{}'.format(item_path, name)] = message
+            continue
+        document = metadata.add_value(document, entry['key'],
+                                      entry['value']) or document
+    row['metadata'] = document
+
+
+def walk(node, data, path, parent_id, rows, errors):
+    key, model, parent_key, children = node
+    if not isinstance(data, dict):
+        errors[path] = "Expected an object"
+        return
+
+    try:
+        row = schema_for(model).parse(data, skip=[parent_key])
+    except ValidationError as e:
+        for name, message in e.errors.items():
+            errors['{}.{}'.format(path, name)] = message
+        row = {}
+    row.setdefault('id', str(uuid4()))
+    if model is models.Track:
+        fold_metadata(data, path, row, errors)
+    if parent_key is not None:
+        row[parent_key] = parent_id
+    rows[model].append(row)
+
+    for child in children:
+        child_key = child[0]
+        items = data.get(child_key, [])
+        if not isinstance(items, list):
+            errors['{}.{}'.format(path, child_key)] = "Expected a list"
+            continue
+        for i, item in enumerate(items):
+            walk(child, item, '{}.{}[{}]'.format(path, child_key, i),
+                 row['id'], rows, errors)
+
+
+def parse_album(document):
+    """
+    Validates a nested album document and returns the rows to insert for
+    each model, in foreign key order. Raises AlbumDocumentError with a
+    mapping of document paths to messages if any row is invalid.
+    """
+    rows = OrderedDict()
+
+    def collect(node):
+        rows[node[1]] = []
+        for child in node[3]:
+            collect(child)
+    collect(ALBUM_TREE)
+
+    errors = {}
+    walk(ALBUM_TREE, document, 'holding_group', None, rows, errors)
+    if errors:
+        raise AlbumDocumentError(errors)
+    return rows
+
+
+def normalize(model, rows, added_by, added_at):
+    """
+    Fills in every insertable column so that a whole batch can be sent as a
+    single multi-row VALUES statement, which requires identical keys.
+    """
+    defaults = {}
+    for c in insertable_columns(model):
+        if c.default is not None and c.default.is_scalar:
+            defaults[c.name] = c.default.arg
+        else:
+            defaults[c.name] = None
+    return [{**defaults, **row, 'added_by': added_by, 'added_at': added_at,
+             'updated_at': added_at} for row in rows]
+
+
+def insert_album(rows, added_by):
+    """Inserts the rows from parse_album() without committing"""
+    added_at = datetime.now()
+    for model, model_rows in rows.items():
+        model_rows = normalize(model, model_rows, added_by, added_at)
+        for start in range(0, len(model_rows), BATCH_SIZE):
+            db.session.execute(model.__table__.insert().values(
+                model_rows[start:start + BATCH_SIZE]))
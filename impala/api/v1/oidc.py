@@ -0,0 +1,154 @@
+import threading
+import time
+import urllib.parse
+from flask import current_app, json
+
+
+class KeySetUnavailable(Exception):
+    """Raised when no key set has ever been fetched from the issuer"""
+    pass
+
+
+class OIDCKeyCache:
+    """
+    Caches the issuer's discovery document and JWKS, and the parsed key
+    objects by `kid`, for every request handled by this process.
+
+    - Both documents are refetched once their TTL has passed.
+    - A token signed with an unknown `kid` triggers an early JWKS refresh
+      (the issuer may have rotated keys), at most once per
+      `refresh_interval` seconds so that bogus tokens cannot be used to
+      hammer the issuer.
+    - If the issuer cannot be reached the previous documents are kept and
+      used until it comes back.
+
+    Fetches happen under a lock, so concurrent logins that find the cache
+    cold wait for a single request to the issuer instead of each making
+    their own.
+    """
+
+    def __init__(self, issuer, discovery_ttl, jwks_ttl, refresh_interval,
+                 timeout, static_keys=None):
+        import requests
+
+        self.issuer = issuer
+        self.discovery_ttl = discovery_ttl
+        self.jwks_ttl = jwks_ttl
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+
+        self.discovery = None
+        self.discovery_expires = 0
+        self.jwks = None
+        self.jwks_expires = 0
+        self.last_attempt = None
+        self.parsed = {}
+
+        self.static = static_keys is not None
+        if self.static:
+            self._set_jwks(static_keys)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('OIDC_ISSUER'),
+                   config['OIDC_DISCOVERY_TTL'],
+                   config['OIDC_JWKS_TTL'],
+                   config['OIDC_JWKS_REFRESH_INTERVAL'],
+                   config['OIDC_HTTP_TIMEOUT'],
+                   config.get('OIDC_KEYS'))
+
+    def _get_json(self, url):
+        r = self.session.get(url, headers={'Accept': "application/json"},
+                             timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _discover(self):
+        import requests
+
+        if self.discovery is not None and time.time() < self.discovery_expires:
+            return self.discovery
+
+        issuer_url = urllib.parse.urlparse(self.issuer)
+        try:
+            self.discovery = self._get_json(
+                '{scheme}://{netloc}/.well-known/openid-configuration'.format(
+                    scheme=issuer_url.scheme, netloc=issuer_url.netloc))
+            self.discovery_expires = time.time() + self.discovery_ttl
+        except (requests.RequestException, ValueError):
+            if self.discovery is None:
+                raise
+            current_app.logger.warning(
+                "OIDC discovery failed; using cached document", exc_info=True)
+        return self.discovery
+
+    def _set_jwks(self, keys):
+        # Keep parsed keys whose JWK has not changed
+        old = {jwk.get('kid'): jwk for jwk in self.jwks or []}
+        new = {jwk.get('kid'): jwk for jwk in keys}
+        self.parsed = {kid: key for kid, key in self.parsed.items()
+                       if kid in new and new[kid] == old.get(kid)}
+        self.jwks = keys
+
+    def _refresh(self, force=False):
+        import requests
+
+        if self.static:
+            return
+        now = time.time()
+        if not force and self.jwks is not None and now < self.jwks_expires:
+            return
+        if self.last_attempt is not None and \
+                now - self.last_attempt < self.refresh_interval:
+            return
+        self.last_attempt = now
+
+        try:
+            keys = self._get_json(self._discover()['jwks_uri'])['keys']
+        except (requests.RequestException, ValueError, KeyError):
+            if self.jwks is None:
+                raise KeySetUnavailable()
+            current_app.logger.warning(
+                "JWKS refresh failed; using cached key set", exc_info=True)
+            return
+        self._set_jwks(keys)
+        self.jwks_expires = now + self.jwks_ttl
+
+    def _find(self, kid):
+        for jwk in self.jwks or []:
+            if kid is None or jwk.get('kid') == kid:
+                return jwk
+        return None
+
+    def get_key(self, kid=None):
+        """
+        Returns the public key for `kid` (or the first key when the token
+        has no `kid`), or None if the issuer does not publish it.
+        """
+        with self.lock:
+            self._refresh()
+            if self.jwks is None:
+                raise KeySetUnavailable()
+            jwk = self._find(kid)
+            if jwk is None and kid is not None:
+                self._refresh(force=True)
+                jwk = self._find(kid)
+            if jwk is None:
+                return None
+
+            key = self.parsed.get(kid)
+            if key is None:
+                import jwt
+                key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+                self.parsed[kid] = key
+            return key
+
+
+def get_key_cache():
+    cache = current_app.extensions.get('oidc_key_cache')
+    if cache is None:
+        cache = OIDCKeyCache.from_config(current_app.config)
+        current_app.extensions['oidc_key_cache'] = cache
+    return cache
@@ -0,0 +1,62 @@
+import base64
+import binascii
+from datetime import datetime
+from uuid import UUID
+from flask import json
+import sqlalchemy
+from impala.catalog.models import TrackMetadata
+
+
+def sort_columns(model):
+    """
+    The columns that pages and exports of `model` are ordered on. The ids
+    of the track_metadata view are computed, so ordering on them alone
+    sorts every value; ordering on the track first lets an index on the
+    tracks do most of it.
+    """
+    if model is TrackMetadata:
+        return [model.added_at, model.track_id, model.id]
+    return [model.added_at, model.id]
+
+
+def encode_cursor(item, columns):
+    values = [getattr(item, column.key) for column in columns]
+    raw = json.dumps([values[0].isoformat()] + [str(v) for v in values[1:]])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')\
+        .rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("Invalid cursor")
+        return [datetime.fromisoformat(values[0])] + \
+            [str(UUID(value)) for value in values[1:]]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def keyset_page(query, model, after, limit):
+    """
+    Returns one page of `query` in sort_columns() order starting after the
+    opaque cursor `after`, along with the cursor for the next page (or None
+    when this is the last page). Unlike paginate() this never issues a COUNT
+    and the cost of a page does not grow with its position in the table.
+    """
+    columns = sort_columns(model)
+    query = query.order_by(*columns)
+    if after:
+        values = decode_cursor(after, columns)
+        query = query.filter(sqlalchemy.tuple_(*columns) > tuple(values))
+        if len(columns) > 2:
+            # Implied by the above, but usable by the index on the leading
+            # columns where the last one is computed
+            query = query.filter(sqlalchemy.tuple_(*columns[:-1]) >=
+                                 tuple(values[:-1]))
+
+    items = query.limit(limit + 1).all()
+    if len(items) > limit:
+        return items[:limit], encode_cursor(items[limit - 1], columns)
+    return items, None
@@ -0,0 +1,187 @@
+from datetime import date, datetime
+import uuid
+from flask_restful import inputs
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from impala.catalog import metadata
+
+TRUE_STRINGS = frozenset(['true', 't', 'yes', 'y', 'on', '1'])
+FALSE_STRINGS = frozenset(['false', 'f', 'no', 'n', 'off', '0'])
+
+_schemas = {}
+
+# Set by the server rather than the client
+SERVER_COLUMNS = frozenset(['added_at', 'added_by', 'updated_at', 'version'])
+
+
+class ValidationError(Exception):
+    def __init__(self, errors):
+        super().__init__("Invalid input")
+        self.errors = errors
+
+
+def _uuid(value):
+    return str(uuid.UUID(str(value)))
+
+
+def _integer(value):
+    if isinstance(value, bool):
+        raise ValueError("Expected an integer")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("Expected an integer")
+        return int(value)
+    return int(value)
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_STRINGS:
+        return True
+    if text in FALSE_STRINGS:
+        return False
+    raise ValueError("Expected a boolean")
+
+
+def _datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return inputs.datetime_from_iso8601(str(value))
+
+
+def _date(value):
+    if isinstance(value, date):
+        return value
+    return inputs.date(str(value)).date()
+
+
+def _string(value):
+    if isinstance(value, (dict, list)):
+        raise ValueError("Expected a string")
+    return str(value)
+
+
+def _enum(enum_class):
+    by_value = {member.value: member for member in enum_class}
+
+    def coerce(value):
+        if isinstance(value, enum_class):
+            return value
+        if value in enum_class.__members__:
+            return enum_class[value]
+        if value in by_value:
+            return by_value[value]
+        raise ValueError("Expected one of {}".format(
+            ', '.join(enum_class.__members__)))
+    return coerce
+
+
+def coercer_for(column_type):
+    if isinstance(column_type, UUID):
+        return _uuid
+    # The only JSONB column is the track metadata document
+    if isinstance(column_type, JSONB):
+        return metadata.normalize
+    if isinstance(column_type, sqlalchemy.Enum) and \
+            column_type.enum_class is not None:
+        return _enum(column_type.enum_class)
+    if isinstance(column_type, sqlalchemy.Boolean):
+        return _boolean
+    if isinstance(column_type, sqlalchemy.Integer):
+        return _integer
+    if isinstance(column_type, sqlalchemy.DateTime):
+        return _datetime
+    if isinstance(column_type, sqlalchemy.Date):
+        return _date
+    return _string
+
+
+class Schema:
+    """
+    Validates and coerces input for one model. The field list is built once
+    from the model's columns; `id` and the SERVER_COLUMNS are always set by
+    the server rather than the client, except that clients may choose the
+    id of a new row. Missing values are None or empty strings, so 0 and false
+    are kept.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        mapper = sqlalchemy.inspect(model)
+        self.keys = {c.name: mapper.get_property_by_column(c).key
+                     for c in model.__table__.columns}
+        self.fields = []
+        for c in model.__table__.columns:
+            if c.name in SERVER_COLUMNS:
+                continue
+            required = c.name != 'id' and not c.nullable and c.default is None
+            self.fields.append((c.name, coercer_for(c.type), required))
+        self.fields = tuple(self.fields)
+
+    def parse(self, data, partial=False, skip=()):
+        """
+        Returns the coerced values present in `data`. Raises ValidationError
+        listing every bad field. With `partial` (for PATCH) no field is
+        required and `id` is not accepted. Fields named in `skip` are
+        ignored, e.g. foreign keys that the caller fills in itself.
+        """
+        values = {}
+        errors = {}
+        for name, coerce, required in self.fields:
+            if name in skip or (partial and name == 'id'):
+                continue
+            value = data.get(name)
+            if value is None or value == '':
+                if required and not partial:
+                    errors[name] = "Missing required parameter"
+                continue
+            try:
+                values[name] = coerce(value)
+            except (TypeError, ValueError) as e:
+                errors[name] = str(e) or "Invalid value"
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    def attributes(self, values):
+        """
+        Rekeys parsed `values` from column names to the model's attribute
+        names, for the constructor or Query.update(); they differ where a
+        column name is reserved, as Track's metadata is.
+        """
+        return {self.keys.get(name, name): value
+                for name, value in values.items()}
+
+    def parse_many(self, records, partial=False, skip=()):
+        """
+        Parses a list of records in one pass. Returns the parsed rows, or
+        raises ValidationError with errors keyed by record index.
+        """
+        rows = []
+        errors = {}
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                errors[str(i)] = "Expected an object"
+                continue
+            try:
+                rows.append(self.parse(record, partial, skip))
+            except ValidationError as e:
+                errors[str(i)] = e.errors
+        if errors:
+            raise ValidationError(errors)
+        return rows
+
+
+def schema_for(model):
+    schema = _schemas.get(model)
+    if schema is None:
+        schema = Schema(model)
+        _schemas[model] = schema
+    return schema
+
+
+def compile_schemas(models):
+    for model in models:
+        schema_for(model)
@@ -0,0 +1,122 @@
+from datetime import date, datetime
+from operator import attrgetter
+import uuid
+from flask import json
+import sqlalchemy
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_serializers = {}
+_default = json.JSONEncoder().default
+
+
+def _datetime(value):
+    return http_date(value.utctimetuple())
+
+
+def _date(value):
+    return http_date(value.timetuple())
+
+
+def _enum(value):
+    return value.name
+
+
+def converter_for(column_type):
+    """
+    Returns the function that turns a value of `column_type` into what
+    Flask's JSON encoder would have produced for it, or None if the value can
+    be used as is.
+    """
+    if isinstance(column_type, sqlalchemy.Enum):
+        return _enum if column_type.enum_class is not None else None
+    python_type = None
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        pass
+    if python_type is datetime:
+        return _datetime
+    if python_type is date:
+        return _date
+    if python_type is uuid.UUID:
+        return str
+    return None
+
+
+class Serializer:
+    """
+    Turns instances (or result rows with the same attribute names) of one
+    model into dicts. The column list, attribute getters and per-column
+    converters are worked out once when the serializer is built rather than
+    for every row.
+    """
+
+    def __init__(self, model, exclude=()):
+        self.model = model
+        self.plain = []
+        self.converted = []
+        for attr in sqlalchemy.inspect(model).column_attrs:
+            column = attr.columns[0]
+            if column.name in exclude:
+                continue
+            converter = converter_for(column.type)
+            if converter is None:
+                self.plain.append((column.name, attrgetter(attr.key)))
+            else:
+                self.converted.append((column.name, attrgetter(attr.key),
+                                       converter))
+        self.plain = tuple(self.plain)
+        self.converted = tuple(self.converted)
+        self._excluding = {}
+
+    def __call__(self, item):
+        d = {name: get(item) for name, get in self.plain}
+        for name, get, convert in self.converted:
+            value = get(item)
+            d[name] = None if value is None else convert(value)
+        return d
+
+    def excluding(self, exclude):
+        key = frozenset(exclude)
+        serializer = self._excluding.get(key)
+        if serializer is None:
+            serializer = Serializer(self.model, key)
+            self._excluding[key] = serializer
+        return serializer
+
+
+def serializer_for(model):
+    serializer = _serializers.get(model)
+    if serializer is None:
+        serializer = Serializer(model)
+        _serializers[model] = serializer
+    return serializer
+
+
+def compile_serializers(models):
+    for model in models:
+        serializer_for(model)
+
+
+def all_fields(item, exclude=()):
+    serializer = serializer_for(type(item))
+    if exclude:
+        serializer = serializer.excluding(exclude)
+    return serializer(item)
+
+
+def dumps(data):
+    """
+    Encodes `data` as JSON bytes, using orjson when it is installed and
+    Flask's encoder otherwise. Keys are sorted either way to match Flask's
+    default output.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default,
+                            option=orjson.OPT_SORT_KEYS)
+    return json.dumps(data).encode('utf-8')
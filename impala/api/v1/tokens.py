@@ -0,0 +1,83 @@
+import time
+from flask import current_app, g, request, session
+from impala import defaults
+
+ALGORITHM = 'HS256'
+AUDIENCE = 'impala-api'
+
+
+class InvalidApiToken(Exception):
+    pass
+
+
+class NoTokenSecret(Exception):
+    """
+    Raised when neither API_TOKEN_SECRET nor SECRET_KEY has been changed
+    from its default, which anyone could sign tokens with
+    """
+    pass
+
+
+def _secret():
+    secret = current_app.config.get('API_TOKEN_SECRET') or \
+        current_app.config['SECRET_KEY']
+    if secret == defaults.SECRET_KEY:
+        raise NoTokenSecret()
+    return secret
+
+
+def issue_token(username, access):
+    """
+    Returns a bearer token for `username` carrying its access roles and the
+    number of seconds until it expires. The token is signed with HMAC, so
+    checking it later needs neither the password hash nor any stored state.
+    Raises NoTokenSecret if no secret has been configured.
+    """
+    import jwt
+
+    ttl = current_app.config['API_TOKEN_TTL']
+    now = int(time.time())
+    token = jwt.encode({
+        'sub': username,
+        'access': list(access),
+        'aud': AUDIENCE,
+        'iat': now,
+        'exp': now + ttl,
+    }, _secret(), algorithm=ALGORITHM)
+    if isinstance(token, bytes):
+        token = token.decode('ascii')
+    return token, ttl
+
+
+def verify_token(raw_token):
+    """Returns (username, access) for a token from issue_token()"""
+    import jwt
+
+    try:
+        claims = jwt.decode(raw_token, _secret(), algorithms=[ALGORITHM],
+                            audience=AUDIENCE,
+                            leeway=current_app.config['API_TOKEN_LEEWAY'])
+    except (jwt.InvalidTokenError, NoTokenSecret):
+        raise InvalidApiToken()
+    if 'sub' not in claims or not isinstance(claims.get('access'), list):
+        raise InvalidApiToken()
+    return claims['sub'], claims['access']
+
+
+def _identity():
+    auth = request.headers.get('Authorization', '')
+    scheme, _, credentials = auth.partition(' ')
+    if scheme.lower() == 'bearer':
+        return verify_token(credentials.strip())
+    return session.get('username'), session.get('access', [])
+
+
+def current_identity():
+    """
+    Returns (username, access) for the request, from a bearer token if one
+    was sent and from the session otherwise. username is None for anonymous
+    requests. Raises InvalidApiToken for a bad or expired bearer token.
+    """
+    if 'api_identity' not in g:
+        g.api_identity = _identity()
+    return g.api_identity
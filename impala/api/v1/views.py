@@ -1,38 +1,104 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
-from enum import Enum
-from impala.catalog import models
-from impala import db
-from impala.api.v1 import bp
-import jwt
-from flask_restful import Api, Resource, abort, reqparse
+from math import ceil
+from impala.catalog import metadata, models, rotation
+from impala import counting, db, dedup, rollups, search
+from impala.dbutil import any_of
+from impala.replicas import reads
+from impala.api.v1 import bp, conditional, export, ingest, oidc, tokens
+from impala.api.v1.fieldsets import Fieldset
+from impala.api.v1.pagination import keyset_page
+from impala.api.v1.schemas import ValidationError, compile_schemas, \
+    schema_for
+from impala.api.v1.serializers import all_fields, compile_serializers, \
+    converter_for, dumps
+from flask_restful import Api, Resource, abort, inputs, reqparse
 from flask import make_response, json, current_app, request, session, redirect
-from passlib.hash import pbkdf2_sha256
-import requests
+from flask import Response, stream_with_context
 import sqlalchemy
 from sqlalchemy.orm import joinedload
-import urllib.parse
-from uuid import uuid4
+from uuid import UUID, uuid4
 
 
-class ApiVersionInfo(Resource):
-    # No auth required for this endpoint
-    def get(self):
-        return {'stable': True}
+def request_data():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return data
+    return request.values
 
 
-def all_fields(model, exclude=[]):
-    columns = [c.name for c in model.__table__.columns if c.name not in exclude]
-    d = {}
+def identity():
+    """
+    Returns (username, access) for the request from its bearer token or
+    session; see tokens.current_identity().
+    """
+    try:
+        return tokens.current_identity()
+    except tokens.InvalidApiToken:
+        abort(401, success=False, message="Invalid or expired token")
 
-    for c in columns:
-        value = getattr(model, c)
-        if isinstance(value, Enum):
-            value = value.name
-        d[c] = value
 
-    return d
+def page_info(pagination):
+    """
+    The paging fields of a list response. `total` and `pages` are None when
+    the client asked for count=none, and are approximate for estimate.
+    """
+    total = pagination.total
+    return {'page': pagination.page, 'has_more': pagination.has_more,
+            'total': total, 'count': pagination.count_mode,
+            'pages': pagination.pages if total is not None else None}
+
+
+def batch_items(query, model, ids):
+    """
+    Returns the items of `query` with `ids`, in the order asked for and
+    without repeats, along with the ids that were not found. All of them
+    are fetched with a single `id = ANY(...)` query; track_metadata rows
+    are found through their tracks, as their ids are computed.
+    """
+    if len(ids) > current_app.config['BATCH_GET_MAX_IDS']:
+        abort(400, success=False, message="At most {} ids may be requested "
+              "at once".format(current_app.config['BATCH_GET_MAX_IDS']))
+    wanted = []
+    invalid = []
+    for id in ids:
+        try:
+            wanted.append(str(UUID(str(id))))
+        except ValueError:
+            invalid.append(id)
+    if invalid:
+        abort(400, success=False, message="Invalid ids", ids=invalid)
+
+    wanted = list(dict.fromkeys(wanted))
+    found = {}
+    if wanted:
+        if model is models.TrackMetadata:
+            criteria = metadata.entries_criteria(wanted)
+        else:
+            criteria = [any_of(model.id, wanted)]
+        found = {item.id: item for item in query.filter(*criteria)}
+    return [found[id] for id in wanted if id in found], \
+        [id for id in wanted if id not in found]
+
+
+def current_user():
+    return identity()[0]
+
+
+def current_access():
+    return identity()[1]
+
+
+def check_password(password, password_hash):
+    from passlib.hash import pbkdf2_sha256
+    return pbkdf2_sha256.verify(password, password_hash)
+
+
+class ApiVersionInfo(Resource):
+    # No auth required for this endpoint
+    def get(self):
+        return {'stable': True}
 
 
 class LoginResource(Resource):
@@ -43,7 +109,7 @@ class LoginResource(Resource):
             password_hash = user.get('password_hash', None)
 
             if password_hash is not None and \
-                    pbkdf2_sha256.verify(auth.password, password_hash):
+                    check_password(auth.password, password_hash):
                 session['username'] = auth.username
                 session['access'] = user.get('access', [])
                 if 'next' in request.args:
@@ -63,6 +129,8 @@ class LoginResource(Resource):
         if not current_app.config['ENABLE_OIDC']:
             abort(405)
 
+        import jwt
+
         # -----BEGIN SCARY CODE-----
 
         # https://openid.net/specs/openid-connect-core-1_0.html#IDTokenValidation
@@ -85,40 +153,18 @@ class LoginResource(Resource):
         # fixed at some point :)
 
         raw_token = request.form['token']
-        unverified_header = jwt.get_unverified_header(raw_token)
+        try:
+            unverified_header = jwt.get_unverified_header(raw_token)
+        except jwt.DecodeError:
+            abort(401, message="Invalid token")
 
-        if 'OIDC_KEYS' in current_app.config:
-            jwks = current_app.config['OIDC_KEYS']
-        else:
-            discovery_url = urllib.parse.urlparse(
-                current_app.config['OIDC_ISSUER'])
-            r = requests.get(
-                '{scheme}://{netloc}/.well-known/openid-configuration'.format(
-                    scheme=discovery_url.scheme,
-                    netloc=discovery_url.netloc),
-                headers={'Accept': "application/json"})
-            r.raise_for_status()
-            discovery_result = r.json()
-
-            r = requests.get(discovery_result['jwks_uri'])
-            r.raise_for_status()
-            jwks = r.json()['keys']
-
-        if 'kid' in unverified_header:
-            token_key = None
-
-            for jwk in jwks:
-                if 'kid' in unverified_header and 'kid' in jwk and \
-                        unverified_header['kid'] == jwk['kid']:
-                    token_key = jwt.algorithms.RSAAlgorithm.from_jwk(
-                        json.dumps(jwk))
-                    break
-
-            if token_key is None:
-                abort(401, message="Token is signed with unknown key")
-        else:
-            token_key = jwt.algorithms.RSAAlgorithm.from_jwk(
-                json.dumps(current_app.config['OIDC_KEYS'][0]))
+        try:
+            token_key = oidc.get_key_cache().get_key(
+                unverified_header.get('kid'))
+        except oidc.KeySetUnavailable:
+            abort(503, message="Identity provider is unavailable")
+        if token_key is None:
+            abort(401, message="Token is signed with unknown key")
 
         try:
             token = jwt.decode(raw_token, token_key,
@@ -149,6 +195,33 @@ class LoginResource(Resource):
         return {'message': "Logged in"}, 200
 
 
+class TokenResource(Resource):
+    def post(self):
+        """
+        Exchanges M2M_USERS credentials sent with HTTP Basic for a
+        short-lived bearer token, so clients that do not keep cookies only
+        pay for the password check once per token rather than per request.
+        """
+        auth = request.authorization
+        if not auth:
+            return {'message': "Authentication required"}, 401, \
+                    {'WWW-Authenticate': 'Basic realm="impala"'}
+
+        user = current_app.config['M2M_USERS'].get(auth.username, {})
+        password_hash = user.get('password_hash', None)
+        if password_hash is None or \
+                not check_password(auth.password, password_hash):
+            abort(401, message="Invalid username or password")
+
+        try:
+            token, expires_in = tokens.issue_token(auth.username,
+                                                   user.get('access', []))
+        except tokens.NoTokenSecret:
+            abort(503, message="API_TOKEN_SECRET is not configured")
+        return {'access_token': token, 'token_type': "Bearer",
+                'expires_in': expires_in}, 200, {'Cache-Control': "no-store"}
+
+
 class LogoutResource(Resource):
     def get(self):
         session.pop('username', None)
@@ -165,58 +238,108 @@ class LogoutResource(Resource):
 
 
 class ImpalaResource(Resource):
-    def get(self, model, id=None):
+    @reads
+    def get(self, model, id=None, criteria=()):
         parser = reqparse.RequestParser()
         parser.add_argument('page', type=int, default=1)
         parser.add_argument('limit', type=int, default=20)
+        parser.add_argument('after', required=False)
+        parser.add_argument('fields', required=False)
+        parser.add_argument('include', required=False)
+        parser.add_argument('ids', required=False)
+        parser.add_argument('count', choices=counting.COUNT_MODES,
+                            default=current_app.config['COUNT_MODE'])
         args = parser.parse_args()
 
+        try:
+            fieldset = Fieldset(model, args['fields'], args['include'])
+        except ValueError as e:
+            abort(400, success=False, message=str(e))
+        query = model.query.options(*fieldset.options()).filter(*criteria)
+
         if id:
-            item = model.query.get(id)
+            item = query.get(id) if not criteria else query.first()
             if not item:
                 abort(404, success=False, message="Item not found")
-            return all_fields(item)
+            return self.conditional_response(
+                fieldset, [item], lambda items: fieldset.serialize(items)[0],
+                item_etag=conditional.item_etag(item, fieldset.fields))
+        elif args['ids'] is not None:
+            ids = [id for id in args['ids'].split(',') if id]
+            items, missing = batch_items(query, model, ids)
+            return self.conditional_response(
+                fieldset, items, lambda items: {
+                    'results': fieldset.serialize(items), 'missing': missing},
+                variant=('ids', tuple(ids)))
+        elif args['after'] is not None:
+            if args['limit'] < 1:
+                abort(400, success=False, message="Invalid limit")
+            try:
+                items, next = keyset_page(query, model, args['after'],
+                                          args['limit'])
+            except ValueError:
+                abort(400, success=False, message="Invalid cursor")
+            return self.conditional_response(
+                fieldset, items, lambda items: {
+                    'results': fieldset.serialize(items), 'next': next},
+                variant=(args['after'], args['limit'], next))
         else:
-            query = model.query.order_by(model.added_at.desc())
-            pagination = query.paginate(page=args['page'],
-                                        per_page=args['limit'])
-            return {'results': [all_fields(item) for item in pagination.items],
-                    'pages': pagination.pages, 'page': pagination.page}
+            query = query.order_by(model.added_at.desc())
+            pagination = counting.paginate(query, args['page'], args['limit'],
+                                           args['count'])
+            return self.conditional_response(
+                fieldset, pagination.items, lambda items: {
+                    'results': fieldset.serialize(items),
+                    **page_info(pagination)},
+                variant=(pagination.page, args['limit'], pagination.total,
+                         pagination.has_more))
+
+    def conditional_response(self, fieldset, items, render, item_etag=None,
+                             variant=()):
+        """
+        Returns the response body built by `render(items)` with ETag and
+        Last-Modified headers, or a 304 if the client's copy is current.
+        The ETag comes from the rows' versions, so a 304 is answered
+        without serializing anything. Included relationships have versions
+        of their own, so with include= the ETag is a hash of the body.
+
+        Only single items honor If-Modified-Since; a list page can change
+        when rows move between pages, which its newest timestamp would not
+        show.
+        """
+        modified = conditional.last_modified(items)
+        if fieldset.include:
+            data = render(items)
+            etag = conditional.body_etag(dumps(data))
+        else:
+            data = None
+            etag = item_etag or conditional.rows_etag(
+                items, sorted(fieldset.fields or ()), *variant)
+
+        headers = conditional.validator_headers(etag, modified)
+        if conditional.not_modified(etag,
+                                    modified if item_etag else None):
+            return conditional.not_modified_response(headers)
+        if data is None:
+            data = render(items)
+        return data, 200, headers
 
     def put(self, model, added_by="Unknown"):
-        post_parser = reqparse.RequestParser()
-
-        for c in model.__table__.columns:
-            name = c.name
-            required = not c.nullable
-            if name not in ['id', 'added_at', 'added_by']:
-                if str(c.type) == 'INTEGER':
-                    post_parser.add_argument(name, dest=name, type=int,
-                                             required=required)
-                else:
-                    post_parser.add_argument(name, dest=name,
-                                             required=required)
-            else:
-                post_parser.add_argument(name, dest=name, required=False)
-
-        args = post_parser.parse_args()
-        if not args['id']:
-            args['id'] = uuid4().__str__()
+        try:
+            args = schema_for(model).parse(request_data())
+        except ValidationError as e:
+            abort(400, message=e.errors)
 
+        args.setdefault('id', str(uuid4()))
         args['added_by'] = added_by
         args['added_at'] = datetime.now()
+        args['updated_at'] = args['added_at']
 
-        del_list = []
-        for k, v in args.items():
-            if not v:
-                del_list.append(k)
-        for k in del_list:
-            args.pop(k)
-
-        item = model(**args)
+        item = model(**schema_for(model).attributes(args))
         try:
             db.session.add(item)
             db.session.commit()
+            search.update_index(model, args['id'])
             return {'message': "Item added", 'id': args['id']}, 201
 
         except sqlalchemy.exc.IntegrityError:
@@ -230,29 +353,34 @@ class ImpalaResource(Resource):
             abort(500, success=False, message="Something broke during the query")
 
     def patch(self, model, id):
-        post_parser = reqparse.RequestParser()
-
-        for c in model.__table__.columns:
-            name = c.name
-            if name not in ['id', 'added_at', 'added_by']:
-                if str(c.type) == 'INTEGER':
-                    post_parser.add_argument(name, dest=name, type=int,
-                                             required=False)
-                else:
-                    post_parser.add_argument(name, dest=name, required=False)
-
-        args = post_parser.parse_args()
-
-        del_list = []
-        for k, v in args.items():
-            if not v:
-                del_list.append(k)
-        for k in del_list:
-            args.pop(k)
+        try:
+            args = schema_for(model).parse(request_data(), partial=True)
+        except ValidationError as e:
+            abort(400, message=e.errors)
+
+        # With If-Match the update only applies to the version the client
+        # has, so a concurrent change between the check and the update is
+        # caught as well
+        query = model.query.filter_by(id=id)
+        if request.if_match:
+            current = query.with_entities(model.id, model.version).first()
+            if current is None:
+                abort(404, success=False, message="Item not found")
+            if not request.if_match.contains(conditional.item_etag(current)):
+                abort(412, success=False, message="Item has been modified")
+            query = query.filter(model.version == current.version)
 
+        args['updated_at'] = datetime.now()
+        args['version'] = model.version + 1
         try:
-            model.query.filter_by(id=id).update(args)
+            updated = query.update(schema_for(model).attributes(args),
+                                   synchronize_session=False)
+            if not updated and request.if_match:
+                db.session.rollback()
+                return {'success': False,
+                        'message': "Item has been modified"}, 412
             db.session.commit()
+            search.update_index(model, id)
             return {'message': "Item updated", 'id': id}, 200
 
         except sqlalchemy.exc.IntegrityError:
@@ -271,20 +399,20 @@ class LibrarianResource(ImpalaResource):
     Any authenticated user may do a GET. Only users with the "librarian" role
     may perform PATCH or PUT operations.
     """
-    def get(self, model, id=None):
-        if 'username' in session:
-            return super().get(model, id)
+    def get(self, model, id=None, criteria=()):
+        if current_user() is not None:
+            return super().get(model, id, criteria)
         else:
             abort(403, success=False, message="Unauthorized")
 
     def patch(self, model, id=None):
-        if 'librarian' in session.get('access', []):
+        if 'librarian' in current_access():
             return super().patch(model, id)
         else:
             abort(403, success=False, message="Unauthorized")
 
     def put(self, model):
-        if 'librarian' in session.get('access', []):
+        if 'librarian' in current_access():
             return super().put(model)
         else:
             abort(403, success=False, message="Unauthorized")
@@ -297,23 +425,27 @@ class UserResource(ImpalaResource):
     operations. All users may perform PATCH operations on resources where the
     "added_by" field corresponds to their username.
     """
-    def get(self, model, id=None):
-        if 'username' in session:
-            return super().get(model, id)
+    def get(self, model, id=None, criteria=()):
+        if current_user() is not None:
+            return super().get(model, id, criteria)
         else:
             abort(403, success=False, message="Unauthorized")
 
     def patch(self, model, id=None):
-        data = super().get(model, id)
-        if 'librarian' in session.get('access', []) or \
-                data['added_by'] == session['username']:
+        if current_user() is None:
+            abort(403, success=False, message="Unauthorized")
+        item = model.query.get(id)
+        if item is None:
+            abort(404, success=False, message="Item not found")
+        if 'librarian' in current_access() or \
+                item.added_by == current_user():
             return super().patch(model, id)
         else:
             abort(403, success=False, message="Unauthorized")
 
     def put(self, model):
-        if 'username' in session:
-            return super().put(model, session['username'])
+        if current_user() is not None:
+            return super().put(model, current_user())
         else:
             abort(403, success=False, message="Unauthorized")
 
@@ -440,80 +572,568 @@ class Track(LibrarianResource):
 
 class TrackList(LibrarianResource):
     def get(self):
-        return super().get(models.Track)
+        parser = reqparse.RequestParser()
+        parser.add_argument('metadata_key', required=False)
+        parser.add_argument('metadata_value', required=False)
+        args = parser.parse_args()
+
+        criteria = []
+        if args['metadata_value'] is not None:
+            if not args['metadata_key']:
+                abort(400, success=False,
+                      message="metadata_value requires metadata_key")
+            criteria.append(metadata.has_value(args['metadata_key'],
+                                               args['metadata_value']))
+        elif args['metadata_key']:
+            criteria.append(metadata.has_key(args['metadata_key']))
+        return super().get(models.Track, criteria=criteria)
 
     def put(self):
         return super().put(models.Track)
 
 
+class TrackMetadataDocument(Resource):
+    """
+    Any authenticated user may GET a track's metadata, optionally only some
+    of its keys. Only users with the "librarian" role may PATCH it. A PATCH
+    is a merge patch: each key given replaces the stored one, and a key
+    that is null is removed.
+    """
+    def get(self, id):
+        if current_user() is None:
+            abort(403, success=False, message="Unauthorized")
+
+        parser = reqparse.RequestParser()
+        parser.add_argument('keys', required=False)
+        args = parser.parse_args()
+
+        track = models.Track.query.with_entities(
+            models.Track.id, models.Track.version, models.Track.updated_at,
+            models.Track.metadata_).filter_by(id=id).first()
+        if track is None:
+            abort(404, success=False, message="Item not found")
+
+        document = track.metadata_
+        keys = None
+        if args['keys']:
+            keys = [key for key in args['keys'].split(',') if key]
+            document = {key: document[key] for key in keys
+                        if key in document}
+        etag = conditional.item_etag(track, keys)
+        headers = conditional.validator_headers(etag, track.updated_at)
+        if conditional.not_modified(etag, track.updated_at):
+            return conditional.not_modified_response(headers)
+        return {'id': track.id, 'metadata': document}, 200, headers
+
+    def patch(self, id):
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+
+        try:
+            patch = metadata.normalize(request.get_json(silent=True),
+                                       partial=True)
+        except ValueError as e:
+            abort(400, success=False, message=str(e))
+
+        # The row lock makes concurrent patches apply one after the other
+        # rather than one overwriting the other
+        track = models.Track.query.filter_by(id=id).with_for_update().first()
+        if track is None:
+            db.session.rollback()
+            abort(404, success=False, message="Item not found")
+        if request.if_match and \
+                not request.if_match.contains(conditional.item_etag(track)):
+            db.session.rollback()
+            abort(412, success=False, message="Item has been modified")
+
+        document = metadata.merge(track.metadata_, patch)
+        metadata.save(track, document)
+        db.session.commit()
+        return {'message': "Item updated", 'id': id, 'metadata': document}, \
+            200
+
+
+def lock_tracks(ids):
+    """
+    Loads and locks the tracks with `ids`, in id order so that two requests
+    locking the same tracks cannot deadlock. Returns {id: track}.
+    """
+    query = models.Track.query.filter(any_of(models.Track.id, ids))\
+        .order_by(models.Track.id).with_for_update()
+    return {track.id: track for track in query}
+
+
 class TrackMetadata(LibrarianResource):
+    """
+    A compatibility view of a single metadata value as a row of its own,
+    from before metadata was kept on the track. A PATCH moves the value,
+    which gives it a new id; the response carries the new one.
+    """
     def get(self, id):
-        return super().get(models.TrackMetadata, id)
+        return super().get(models.TrackMetadata, id,
+                           metadata.entry_criteria(id))
 
     def patch(self, id):
-        return super().patch(models.Track, id)
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+        try:
+            args = schema_for(models.TrackMetadata).parse(request_data(),
+                                                          partial=True)
+        except ValidationError as e:
+            abort(400, message=e.errors)
+
+        entry = models.TrackMetadata.query.filter(
+            *metadata.entry_criteria(id)).first()
+        if entry is None:
+            abort(404, success=False, message="Item not found")
+
+        key = args.get('key', entry.key)
+        value = args.get('value', entry.value)
+        track_id = args.get('track_id', entry.track_id)
+        tracks = lock_tracks({entry.track_id, track_id})
+        if track_id not in tracks:
+            db.session.rollback()
+            abort(409, success=False, message="Invalid change")
+        # The value may have gone, or its track changed, since it was read
+        old = tracks[entry.track_id]
+        document = metadata.remove_value(old.metadata_, entry.key,
+                                         entry.value)
+        if document is None or request.if_match and (
+                old.version != entry.version or
+                not request.if_match.contains(conditional.item_etag(entry))):
+            db.session.rollback()
+            abort(412, success=False, message="Item has been modified")
+
+        new = tracks[track_id]
+        if new is not old:
+            metadata.save(old, document)
+            document = new.metadata_
+        document = metadata.add_value(document, key, value)
+        if document is None:
+            db.session.rollback()
+            abort(409, success=False, message="Invalid change")
+        metadata.save(new, document)
+        db.session.commit()
+        return {'message': "Item updated",
+                'id': metadata.entry_id(track_id, key, value)}, 200
 
 
 class TrackMetadataList(LibrarianResource):
+    """
+    Lists every metadata value as a row of its own, and adds a value to a
+    track's metadata with a PUT of {track_id, key, value}.
+    """
     def get(self):
         return super().get(models.TrackMetadata)
 
     def put(self):
-        return super().put(models.TrackMetadata)
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+        try:
+            args = schema_for(models.TrackMetadata).parse(request_data(),
+                                                          skip=['id'])
+        except ValidationError as e:
+            abort(400, message=e.errors)
+
+        track = models.Track.query.filter_by(id=args['track_id'])\
+            .with_for_update().first()
+        document = None
+        if track is not None:
+            document = metadata.add_value(track.metadata_, args['key'],
+                                          args['value'])
+        if document is None:
+            db.session.rollback()
+            abort(409, success=False, message="Item already exists or "
+                  "foreign key constraint not met")
+        metadata.save(track, document)
+        db.session.commit()
+        return {'message': "Item added",
+                'id': metadata.entry_id(args['track_id'], args['key'],
+                                        args['value'])}, 201
+
+
+class Export(Resource):
+    """
+    Any authenticated user may do a GET. Streams every row of the model as
+    newline-delimited JSON, oldest first.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    @reads
+    def get(self):
+        if current_user() is None:
+            abort(403, success=False, message="Unauthorized")
+
+        parser = reqparse.RequestParser()
+        parser.add_argument('since', type=inputs.datetime_from_iso8601)
+        parser.add_argument('batch_size', type=int, default=export.BATCH_SIZE)
+        args = parser.parse_args()
+        if args['batch_size'] < 1:
+            abort(400, success=False, message="Invalid batch_size")
+
+        query = export.export_query(self.model, args['since'])
+        lines = export.ndjson_lines(query, self.model, args['batch_size'])
+        return Response(stream_with_context(lines),
+                        mimetype='application/x-ndjson')
+
+
+def name_list(value):
+    """Accepts fields or include in a JSON body as a list or a string"""
+    if isinstance(value, list):
+        return ','.join(str(name) for name in value)
+    if value is None or isinstance(value, str):
+        return value
+    raise ValueError("Expected a list of names")
+
+
+class BatchGet(Resource):
+    """
+    Any authenticated user may POST. The same as a GET with ?ids= for id
+    lists too long for a URL: takes {"ids": [...]} along with the optional
+    "fields" and "include".
+    """
+    def __init__(self, model):
+        self.model = model
+
+    @reads
+    def post(self):
+        if current_user() is None:
+            abort(403, success=False, message="Unauthorized")
+
+        document = request.get_json(silent=True)
+        if not isinstance(document, dict) or \
+                not isinstance(document.get('ids'), list):
+            abort(400, success=False, message="Expected a list of ids")
+
+        try:
+            fieldset = Fieldset(self.model,
+                                name_list(document.get('fields')),
+                                name_list(document.get('include')))
+        except ValueError as e:
+            abort(400, success=False, message=str(e))
+        items, missing = batch_items(
+            self.model.query.options(*fieldset.options()), self.model,
+            document['ids'])
+        return {'results': fieldset.serialize(items), 'missing': missing}
+
+
+class Validate(Resource):
+    """
+    Any authenticated user may POST. Checks a list of records against the
+    model's input schema without writing anything, so batch clients can find
+    every bad record in one request.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    def post(self):
+        if current_user() is None:
+            abort(403, success=False, message="Unauthorized")
+
+        document = request.get_json(silent=True)
+        if not isinstance(document, dict) or \
+                not isinstance(document.get('records'), list):
+            abort(400, success=False, message="Expected a list of records")
+
+        try:
+            rows = schema_for(self.model).parse_many(
+                document['records'], partial=document.get('partial', False))
+        except ValidationError as e:
+            abort(400, success=False, message="Invalid records",
+                  errors=e.errors)
+        return {'success': True, 'valid': len(rows)}, 200
+
+
+class AlbumIngest(Resource):
+    """
+    Only users with the "librarian" role may PUT. Inserts a holding group
+    together with its nested holdings, tracks, track metadata, tags, comments
+    and rotation releases in a single transaction.
+    """
+    def put(self):
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+
+        document = request.get_json(silent=True)
+        if document is None:
+            abort(400, success=False, message="Expected a JSON album document")
+
+        try:
+            rows = ingest.parse_album(document)
+        except ingest.AlbumDocumentError as e:
+            abort(400, success=False, message=str(e), errors=e.errors)
+
+        try:
+            ingest.insert_album(rows, current_user())
+            db.session.commit()
+        except sqlalchemy.exc.IntegrityError as e:
+            db.session.rollback()
+            diag = getattr(e.orig, 'diag', None)
+            abort(409, success=False,
+                  message="Item already exists or foreign key constraint not met",
+                  table=getattr(diag, 'table_name', None),
+                  detail=getattr(diag, 'message_detail', None))
+        except sqlalchemy.exc.StatementError:
+            db.session.rollback()
+            abort(400, success=False, message="Invalid parameter syntax")
+        except:
+            db.session.rollback()
+            abort(500, success=False, message="Something broke during the query")
+
+        group_id = rows[models.HoldingGroup][0]['id']
+        search.update_index(models.HoldingGroup, group_id)
+        ids = {model.__tablename__: [row['id'] for row in model_rows]
+               for model, model_rows in rows.items()}
+        # Metadata is stored on the tracks now; these are its view's ids
+        ids['track_metadata'] = [
+            metadata.entry_id(row['id'], key, value)
+            for row in rows[models.Track]
+            for key, values in row['metadata'].items() for value in values]
+        return {'message': "Album added", 'id': group_id, 'ids': ids}, 201
 
 
 class HoldingSearchList(ImpalaResource):
+    @reads
     def get(self):
-        if 'username' in session:
+        if current_user() is not None:
             parser = reqparse.RequestParser()
             parser.add_argument('album_artist', required=False)
             parser.add_argument('album_title', required=False)
             parser.add_argument('label', required=False)
             parser.add_argument('torrent_hash', required=False)
             parser.add_argument('any', required=False)
+            parser.add_argument('q', required=False)
             parser.add_argument('page', type=int, default=1)
             parser.add_argument('limit', type=int, default=20)
+            parser.add_argument('count', choices=counting.COUNT_MODES,
+                                default=current_app.config['COUNT_MODE'])
             args = parser.parse_args()
 
-            query = models.Holding.query.options(joinedload('holding_group'))
-            query = query.join(models.HoldingGroup,
-                               models.Holding.holding_group)
-
-            if args['any']:
-                ilike = '%' + args['any'] + '%'
-                query = query.filter(models.HoldingGroup.album_artist.ilike(ilike) |
-                                     models.HoldingGroup.album_title.ilike(ilike) |
-                                     models.Holding.label.ilike(ilike) |
-                                     models.Holding.torrent_hash.ilike(args['any']))
-            if args['album_artist']:
-                ilike = '%' + args['album_artist'] + '%'
-                query = query.filter(models.HoldingGroup.album_artist.ilike(ilike))
-            if args['album_title']:
-                ilike = '%' + args['album_title'] + '%'
-                query = query.filter(models.HoldingGroup.album_title.ilike(ilike))
-            if args['label']:
-                ilike = '%' + args['label'] + '%'
-                query = query.filter(models.Holding.label.ilike(ilike))
-            if args['torrent_hash']:
-                query = query.filter(models.Holding.torrent_hash.ilike(args['torrent_hash']))
-
-            query = query.order_by(models.HoldingGroup.added_at.desc())
-            pagination = query.paginate(page=args['page'],
-                                        per_page=args['limit'])
+            if args['page'] < 1 or args['limit'] < 1:
+                abort(404)
+            ids, total = search.get_backend().search(
+                args, args['page'], args['limit'], args['count'])
+            if not ids and args['page'] != 1:
+                abort(404)
+            has_more = len(ids) > args['limit']
+            ids = ids[:args['limit']]
+
+            holdings = {}
+            if ids:
+                query = models.Holding.query.options(
+                    joinedload(models.Holding.holding_group))
+                holdings = {h.id: h for h in
+                            query.filter(models.Holding.id.in_(ids))}
+            items = [holdings[id] for id in ids if id in holdings]
 
             results = [{**all_fields(item),
                         **all_fields(item.holding_group,
-                                     exclude=['holdings', 'id'])} for item in pagination.items]
-            return {'results': results, 'pages': pagination.pages,
-                    'page': pagination.page}
+                                     exclude=['holdings', 'id'])} for item in items]
+            return {'results': results, 'page': args['page'],
+                    'has_more': has_more, 'total': total,
+                    'count': args['count'],
+                    'pages': ceil(total / args['limit'])
+                    if total is not None else None}
 
         else:
             abort(403, success=False, message="Unauthorized")
 
 
+class CurrentRotation(Resource):
+    """
+    Any authenticated user may GET. Lists the active holdings in rotation
+    now, optionally in one bin, with their holding groups.
+    """
+    def get(self):
+        if current_user() is None:
+            abort(403, success=False, message="Unauthorized")
+
+        parser = reqparse.RequestParser()
+        parser.add_argument('bin', required=False)
+        args = parser.parse_args()
+
+        results = []
+        holdings = {}
+        for release, holding, group in rotation.current_rotation(
+                datetime.now(), args['bin']):
+            item = holdings.get(holding.id)
+            if item is None:
+                item = {**all_fields(holding),
+                        'holding_group': all_fields(group),
+                        'rotation_releases': []}
+                holdings[holding.id] = item
+                results.append(item)
+            item['rotation_releases'].append(all_fields(release))
+        return {'results': results}
+
+
+class Report(Resource):
+    """
+    Only users with the "librarian" role may GET. Reads one of the rollup
+    tables kept up to date by `flask rollups refresh`, summed over the
+    dimensions left out of group_by.
+    """
+    def __init__(self, rollup):
+        self.rollup = rollup
+
+    def get(self):
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+
+        rollup = self.rollup
+        model = rollup.model
+        parser = reqparse.RequestParser()
+        parser.add_argument('group_by', required=False)
+        if 'month' in rollup.dimensions:
+            parser.add_argument('since', type=inputs.date)
+            parser.add_argument('until', type=inputs.date)
+        args = parser.parse_args()
+
+        group_by = args['group_by'].split(',') if args['group_by'] else \
+            rollup.dimensions
+        if not set(group_by) <= set(rollup.dimensions):
+            abort(400, success=False, message="Can only group by {}".format(
+                ', '.join(rollup.dimensions)))
+
+        columns = [getattr(model, name) for name in group_by]
+        query = db.session.query(*columns, *[
+            sqlalchemy.func.sum(getattr(model, name)).label(name)
+            for name in rollup.measures]).group_by(*columns).order_by(*columns)
+        if args.get('since'):
+            query = query.filter(model.month >= args['since'])
+        if args.get('until'):
+            query = query.filter(model.month <= args['until'])
+
+        converters = [converter_for(column.type) for column in columns]
+        results = []
+        for row in query:
+            result = {name: value if value is None or convert is None
+                      else convert(value) for name, value, convert in
+                      zip(group_by, row, converters)}
+            result.update((name, int(row[len(group_by) + i]))
+                          for i, name in enumerate(rollup.measures))
+            result.update((name, derive(result))
+                          for name, derive in rollup.derived.items())
+            results.append(result)
+
+        watermark = models.RollupWatermark.query.get(rollup.name)
+        convert = converter_for(db.DateTime())
+        return {'results': results,
+                'includes_rows_added_until': convert(watermark.added_at)
+                if watermark else None,
+                'refreshed_at': convert(watermark.updated_at)
+                if watermark else None}
+
+
+def suggestion_fields(suggestion, subjects):
+    fields = all_fields(suggestion)
+    for name in ('keep', 'duplicate'):
+        subject = subjects.get((suggestion.kind,
+                                getattr(suggestion, name + '_id')))
+        fields[name] = all_fields(subject) if subject is not None else None
+    return fields
+
+
+class MergeSuggestion(Resource):
+    """
+    Only users with the "librarian" role may GET or PATCH. A PATCH records
+    the librarian's review of a suggestion; merging is left to them.
+    """
+    def get(self, id):
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+
+        item = models.MergeSuggestion.query.get(id)
+        if item is None:
+            abort(404, success=False, message="Item not found")
+        etag = conditional.item_etag(item)
+        headers = conditional.validator_headers(etag, item.updated_at)
+        if conditional.not_modified(etag, item.updated_at):
+            return conditional.not_modified_response(headers)
+        return suggestion_fields(item, dedup.load_subjects([item])), 200, \
+            headers
+
+    def patch(self, id):
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+
+        status = request_data().get('status')
+        try:
+            status = models.MergeSuggestionStatus[str(status).upper()]
+        except KeyError:
+            abort(400, success=False, message="Invalid status")
+
+        # As in ImpalaResource.patch, the version checked is part of the
+        # update
+        model = models.MergeSuggestion
+        query = model.query.filter_by(id=id)
+        current = query.with_entities(model.id, model.version).first()
+        if current is None:
+            abort(404, success=False, message="Item not found")
+        if request.if_match:
+            if not request.if_match.contains(conditional.item_etag(current)):
+                abort(412, success=False, message="Item has been modified")
+            query = query.filter(model.version == current.version)
+
+        now = datetime.now()
+        updated = query.update({
+            'status': status,
+            'reviewed_by': current_user(),
+            'reviewed_at': now,
+            'updated_at': now,
+            'version': model.version + 1,
+        }, synchronize_session=False)
+        if not updated:
+            db.session.rollback()
+            return {'success': False,
+                    'message': "Item has been modified"}, 412
+        db.session.commit()
+        return {'message': "Item updated", 'id': id}, 200
+
+
+class MergeSuggestionList(Resource):
+    """
+    Only users with the "librarian" role may GET. Lists merge suggestions,
+    pending ones by default, best first.
+    """
+    def get(self):
+        if 'librarian' not in current_access():
+            abort(403, success=False, message="Unauthorized")
+
+        parser = reqparse.RequestParser()
+        parser.add_argument('status', default='pending',
+                            choices=[status.name.lower() for status in
+                                     models.MergeSuggestionStatus])
+        parser.add_argument('kind', required=False,
+                            choices=[kind.name.lower() for kind in
+                                     models.DedupKind])
+        parser.add_argument('page', type=int, default=1)
+        parser.add_argument('limit', type=int, default=20)
+        parser.add_argument('count', choices=counting.COUNT_MODES,
+                            default=current_app.config['COUNT_MODE'])
+        args = parser.parse_args()
+
+        model = models.MergeSuggestion
+        query = model.query.filter(
+            model.status == models.MergeSuggestionStatus[
+                args['status'].upper()])
+        if args['kind']:
+            query = query.filter(
+                model.kind == models.DedupKind[args['kind'].upper()])
+        query = query.order_by(model.score.desc(), model.id)
+        pagination = counting.paginate(query, args['page'], args['limit'],
+                                       args['count'])
+        subjects = dedup.load_subjects(pagination.items)
+        return {'results': [suggestion_fields(item, subjects)
+                            for item in pagination.items],
+                **page_info(pagination)}
+
+
 api = Api(bp)
 api.add_resource(ApiVersionInfo, '/')
 api.add_resource(LoginResource, '/login')
+api.add_resource(TokenResource, '/token')
 api.add_resource(LogoutResource, '/logout')
 
 api.add_resource(Stack, '/stacks/<string:id>')
@@ -532,14 +1152,40 @@ api.add_resource(HoldingComment, '/holding_comments/<string:id>')
 api.add_resource(HoldingCommentList, '/holding_comments')
 api.add_resource(Track, '/tracks/<string:id>')
 api.add_resource(TrackList, '/tracks')
+api.add_resource(TrackMetadataDocument, '/tracks/<string:id>/metadata')
 api.add_resource(TrackMetadata, '/track_metadata/<string:id>')
 api.add_resource(TrackMetadataList, '/track_metadata')
 
 api.add_resource(HoldingSearchList, '/holdings/search')
+api.add_resource(AlbumIngest, '/albums')
+api.add_resource(CurrentRotation, '/rotation/current')
+api.add_resource(MergeSuggestion, '/merge_suggestions/<string:id>')
+api.add_resource(MergeSuggestionList, '/merge_suggestions')
+
+for name, model in export.EXPORT_MODELS.items():
+    api.add_resource(Export, '/{}/export'.format(name),
+                     endpoint='{}_export'.format(name),
+                     resource_class_kwargs={'model': model})
+    api.add_resource(BatchGet, '/{}/batch_get'.format(name),
+                     endpoint='{}_batch_get'.format(name),
+                     resource_class_kwargs={'model': model})
+    api.add_resource(Validate, '/{}/validate'.format(name),
+                     endpoint='{}_validate'.format(name),
+                     resource_class_kwargs={'model': model})
+
+
+for name, rollup in rollups.ROLLUPS.items():
+    api.add_resource(Report, '/reports/{}'.format(name),
+                     endpoint='{}_report'.format(name),
+                     resource_class_kwargs={'rollup': rollup})
+
+
+compile_serializers(export.EXPORT_MODELS.values())
+compile_schemas(export.EXPORT_MODELS.values())
 
 
 @api.representation('application/json')
 def output_json(data, code, headers=None):
-    resp = make_response(json.dumps(data), code)
+    resp = make_response(dumps(data), code)
     resp.headers.extend(headers or {})
     return resp
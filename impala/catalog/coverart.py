@@ -0,0 +1,245 @@
+from contextlib import contextmanager
+from datetime import datetime
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+
+
+class CoverArtMissing(Exception):
+    pass
+
+
+class CoverArtError(Exception):
+    """The archive answered with something other than a listing"""
+
+
+def select_image_url(listing, size):
+    for image in listing.get('images', []):
+        if not image.get('front'):
+            continue
+        if size == 250:
+            return image['thumbnails']['small']
+        elif size == 500:
+            return image['thumbnails']['large']
+        else:
+            return image['image']
+    raise CoverArtMissing()
+
+
+class CoverArtCache:
+    """
+    On-disk cache of Cover Art Archive images shared by every worker on the
+    host. Entries are keyed by a hash of (type, mbid, size) and the body is
+    stored alongside a small JSON sidecar holding its content type and
+    digest. Misses for the same key are collapsed with an flock() so only one
+    worker goes upstream; the rest wait and then read its result. Least
+    recently used entries are evicted once the directory exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes, negative_ttl, timeout, base_url):
+        import requests
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.written_since_evict = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['COVERART_CACHE_DIR'],
+                   config['COVERART_CACHE_MAX_BYTES'],
+                   config['COVERART_NEGATIVE_TTL'],
+                   config['COVERART_TIMEOUT'],
+                   config['COVERART_BASE_URL'])
+
+    def _path(self, type, mbid, size):
+        key = hashlib.sha256('{}/{}/{}'.format(type, mbid, size)
+                             .encode('utf-8')).hexdigest()
+        shard = os.path.join(self.directory, key[:2])
+        os.makedirs(shard, exist_ok=True)
+        return os.path.join(shard, key)
+
+    @contextmanager
+    def _locked(self, path, blocking=True):
+        with open(path, 'a') as f:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _lookup(self, path):
+        """Returns the entry's metadata, False for a known miss or None"""
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            os.utime(path)
+            return meta
+        except (OSError, ValueError):
+            pass
+
+        try:
+            if time.time() - os.path.getmtime(path + '.missing') < \
+                    self.negative_ttl:
+                return False
+        except OSError:
+            pass
+        return None
+
+    def _write_atomic(self, path, chunks):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _fetch(self, type, mbid, size, path):
+        r = self.session.get('{}/{}/{}/'.format(self.base_url, type, mbid),
+                             timeout=self.timeout)
+        if r.status_code == 404:
+            raise CoverArtMissing()
+        r.raise_for_status()
+        try:
+            url = select_image_url(r.json(), size)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # Not cached as a miss, since the next request may get a
+            # proper listing
+            raise CoverArtError("Malformed listing for {} {}".format(
+                type, mbid)) from e
+
+        r = self.session.get(url, timeout=self.timeout, stream=True)
+        if r.status_code == 404:
+            raise CoverArtMissing()
+        r.raise_for_status()
+
+        digest = hashlib.sha256()
+        length = 0
+
+        def chunks():
+            nonlocal length
+            for chunk in r.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                length += len(chunk)
+                yield chunk
+
+        self._write_atomic(path, chunks())
+        meta = {
+            'content_type': r.headers.get('Content-Type',
+                                          'application/octet-stream'),
+            'etag': digest.hexdigest(),
+            'fetched_at': time.time(),
+        }
+        self._write_atomic(path + '.json',
+                           [json.dumps(meta).encode('utf-8')])
+        self.written_since_evict += length
+        return meta
+
+    def get(self, type, mbid, size):
+        """
+        Returns (open file, metadata) for the cached image, fetching it first
+        if needed. Raises CoverArtMissing if the archive has no such image.
+        """
+        path = self._path(type, mbid, size)
+        meta = self._lookup(path)
+        if meta is None:
+            with self._locked(path + '.lock'):
+                # Another worker may have filled the entry while we waited
+                meta = self._lookup(path)
+                if meta is None:
+                    try:
+                        meta = self._fetch(type, mbid, size, path)
+                    except CoverArtMissing:
+                        self._write_atomic(path + '.missing', [])
+                        raise
+            if meta is not None and meta is not False:
+                self.maybe_evict()
+
+        if meta is False:
+            raise CoverArtMissing()
+        meta['last_modified'] = datetime.utcfromtimestamp(meta['fetched_at'])
+        try:
+            return open(path, 'rb'), meta
+        except FileNotFoundError:
+            # Evicted between the lookup and now
+            self._unlink(path + '.json')
+            return self.get(type, mbid, size)
+
+    def maybe_evict(self):
+        # Scanning the whole directory is only worth it once a meaningful
+        # fraction of the budget has been written since the last scan
+        if self.written_since_evict < self.max_bytes // 20:
+            return
+        with self._locked(os.path.join(self.directory, 'evict.lock'),
+                          blocking=False) as acquired:
+            if acquired:
+                self.written_since_evict = 0
+                self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                name = entry.name
+                if name.endswith('.missing'):
+                    if now - entry.stat().st_mtime >= self.negative_ttl:
+                        self._unlink(entry.path)
+                    continue
+                if '.' in name:
+                    continue
+                stat = entry.stat()
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        target = self.max_bytes * 9 // 10
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            # The lock file stays: another worker may hold or be waiting on
+            # it, and a new one would let two fetches of the key run at once
+            self._unlink(path + '.json')
+            self._unlink(path)
+            total -= size
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_cache():
+    cache = current_app.extensions.get('coverart_cache')
+    if cache is None:
+        cache = CoverArtCache.from_config(current_app.config)
+        current_app.extensions['coverart_cache'] = cache
+    return cache
@@ -0,0 +1,174 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+from flask import current_app
+from markupsafe import Markup
+from sqlalchemy import distinct, func
+from impala.catalog import models
+from impala.catalog.loader import load_holding_group_cards
+from impala.catalog.rotation import current_bins
+
+CARD_TEMPLATE = 'catalog/holding_group_card.html'
+
+
+class RedisBackend:
+    """Shares rendered fragments between processes"""
+
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get_fragments(self, keys):
+        return self.client.mget(['impala:card:' + key for key in keys])
+
+    def set_fragments(self, fragments):
+        pipe = self.client.pipeline(transaction=False)
+        for key, html in fragments.items():
+            pipe.setex('impala:card:' + key, self.ttl, html)
+        pipe.execute()
+
+
+class FragmentCache:
+    """
+    Caches the rendered holding group cards of the catalog pages.
+
+    A card is keyed by the group id, its row version, a version of the rest
+    of its content (see content_versions()), the viewer's access level and
+    the rotation badges it shows. All of these come from the database, so a
+    write by any process changes the key of every card it affects, and
+    nothing needs to be invalidated. Rendered cards live in a bounded
+    in-process LRU and, with FRAGMENT_CACHE_REDIS_URL, in Redis as well, and
+    expire after FRAGMENT_CACHE_TTL seconds.
+    """
+
+    def __init__(self, max_entries, ttl, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config):
+        shared = None
+        if config.get('FRAGMENT_CACHE_REDIS_URL'):
+            shared = RedisBackend(config['FRAGMENT_CACHE_REDIS_URL'],
+                                  config['FRAGMENT_CACHE_TTL'])
+        return cls(config['FRAGMENT_CACHE_SIZE'],
+                   config['FRAGMENT_CACHE_TTL'], shared)
+
+    def keys(self, groups, access_level, rotation):
+        versions = content_versions([group.id for group in groups])
+        return ['{}:{}.{}:{}:{}'.format(
+                    group.id, group.version, versions.get(group.id, ''),
+                    access_level, rotation_key(rotation.get(group.id, {})))
+                for group in groups]
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(key)
+                    found[key] = entry[1]
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.shared is not None:
+            shared = {key: html.decode('utf-8') for key, html in
+                      zip(missing, self.shared.get_fragments(missing))
+                      if html is not None}
+            self.put_local(shared)
+            found.update(shared)
+        return found
+
+    def put_local(self, fragments):
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for key, html in fragments.items():
+                self.entries[key] = (expires, html)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def put_many(self, fragments):
+        self.put_local(fragments)
+        if self.shared is not None and fragments:
+            self.shared.set_fragments(fragments)
+
+
+def get_cache():
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        cache = FragmentCache.from_config(current_app.config)
+        current_app.extensions['fragment_cache'] = cache
+    return cache
+
+
+def content_versions(group_ids):
+    """
+    Returns a short digest for each group with holdings of what its card
+    shows besides the group row: the number of holdings and tags and the
+    newest change to them and to their formats. Every write through the API
+    moves updated_at, and removing a row changes a count. One aggregate
+    query covers the whole page.
+    """
+    rows = models.Holding.query.with_entities(
+        models.Holding.holding_group_id,
+        func.count(distinct(models.Holding.id)),
+        func.max(models.Holding.updated_at),
+        func.max(models.Format.updated_at),
+        func.count(models.HoldingTag.id),
+        func.max(models.HoldingTag.updated_at),
+    ).outerjoin(models.Holding.format).outerjoin(
+        models.Holding.holding_tags).filter(
+        models.Holding.holding_group_id.in_(group_ids)).group_by(
+        models.Holding.holding_group_id)
+    return {row[0]: hashlib.sha1(repr(tuple(row[1:])).encode('utf-8'))
+            .hexdigest()[:12] for row in rows}
+
+
+def rotation_key(bins):
+    """A short digest of a card's rotation badges, or '' if it has none"""
+    if not bins:
+        return ''
+    return hashlib.sha1(repr(sorted(bins.items())).encode('utf-8'))\
+        .hexdigest()[:12]
+
+
+def render_cards(groups, access, now):
+    """
+    Returns the rendered card for each of `groups`. The rotation badges of
+    the whole page come from one query; only the groups whose cards are not
+    cached have their holdings, formats and tags loaded, with one batched
+    query per relationship.
+    """
+    if not groups:
+        return []
+    rotation = current_bins([group.id for group in groups], now)
+    cache = None
+    found = {}
+    keys = [group.id for group in groups]
+    if current_app.config['FRAGMENT_CACHE_ENABLED']:
+        access_level = 'librarian' if 'librarian' in access else 'user'
+        cache = get_cache()
+        keys = cache.keys(groups, access_level, rotation)
+        found = cache.get_many(keys)
+
+    missed = [group for group, key in zip(groups, keys) if key not in found]
+    if missed:
+        load_holding_group_cards(missed)
+        template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+        rendered = {}
+        for group, key in zip(groups, keys):
+            if key not in found:
+                rendered[key] = template.render(
+                    hg=group, access=access, now=now,
+                    rotation=rotation.get(group.id, {}))
+        found.update(rendered)
+        if cache is not None:
+            cache.put_many(rendered)
+    return [Markup(found[key]) for key in keys]
@@ -0,0 +1,22 @@
+from collections import defaultdict
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from impala.catalog.models import Holding
+
+
+def load_holding_group_cards(groups):
+    """
+    Loads everything the cards of the already loaded `groups` render. Each
+    relationship is fetched with a single batched IN query for all of the
+    groups, so the number of queries does not depend on how many holdings
+    or tags they have. Rotation badges come from
+    impala.catalog.rotation.current_bins() instead.
+    """
+    holdings = defaultdict(list)
+    query = Holding.query.options(selectinload(Holding.format),
+                                  selectinload(Holding.holding_tags))
+    for holding in query.filter(
+            Holding.holding_group_id.in_([g.id for g in groups])):
+        holdings[holding.holding_group_id].append(holding)
+    for group in groups:
+        set_committed_value(group, 'holdings', holdings[group.id])
@@ -0,0 +1,138 @@
+from datetime import datetime
+import hashlib
+import uuid
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from impala import db
+from impala.dbutil import array_of
+from impala.catalog.models import Track, TrackMetadata
+
+
+def _values(value):
+    if value is None:
+        raise ValueError("Expected a string or a list of strings")
+    values = value if isinstance(value, list) else [value]
+    result = []
+    for v in values:
+        if v is None or isinstance(v, (dict, list)):
+            raise ValueError("Expected a string or a list of strings")
+        v = str(v)
+        if v not in result:
+            result.append(v)
+    return result
+
+
+def normalize(document, partial=False):
+    """
+    Returns `document` in the stored form, which maps each key to the list
+    of its values: {"genre": ["Rock", "Pop"]}. A lone string stands for a
+    list of one, and values are not repeated, so a value is named by its
+    track, key and value alone. With `partial` (for a merge patch) a key
+    may be None, which removes it. Raises ValueError if the document cannot
+    be stored.
+    """
+    if not isinstance(document, dict):
+        raise ValueError("Expected an object")
+    result = {}
+    for key, value in document.items():
+        if not key:
+            raise ValueError("Keys must not be empty")
+        if partial and value is None:
+            result[key] = None
+            continue
+        try:
+            result[key] = _values(value)
+        except ValueError as e:
+            raise ValueError("{}: {}".format(key, e))
+    return result
+
+
+def merge(document, patch):
+    """
+    Applies a normalized merge patch to `document` and returns the result:
+    each key in `patch` replaces the key in `document`, and keys that are
+    None or empty are removed.
+    """
+    result = dict(document)
+    for key, values in patch.items():
+        if values:
+            result[key] = values
+        else:
+            result.pop(key, None)
+    return result
+
+
+def add_value(document, key, value):
+    """Returns `document` with `value` added to `key`, or None if present"""
+    values = document.get(key, [])
+    if value in values:
+        return None
+    return {**document, key: values + [value]}
+
+
+def remove_value(document, key, value):
+    """Returns `document` without `value` under `key`, or None if absent"""
+    values = document.get(key, [])
+    if value not in values:
+        return None
+    return merge(document, {key: [v for v in values if v != value]})
+
+
+def entry_id(track_id, key, value):
+    """
+    The id of a value in the track_metadata view. It must match the
+    track_metadata_id() SQL function; the length of the key keeps
+    ('ab', 'c') and ('a', 'bc') apart.
+    """
+    text = '{}/{}/{}{}'.format(track_id, len(key), key, value)
+    return str(uuid.UUID(hashlib.md5(text.encode('utf-8')).hexdigest()))
+
+
+def entry_ids():
+    """
+    The ids of every value of a track. The expression must match the GIN
+    index ix_tracks_metadata_ids.
+    """
+    return db.func.track_metadata_ids(Track.id, Track.metadata_,
+                                      type_=ARRAY(UUID))
+
+
+def entry_criteria(id):
+    """
+    Criteria for the track_metadata row with `id`. The view cannot be
+    searched by id without hashing every value, so this finds the track
+    through ix_tracks_metadata_ids first.
+    """
+    return entries_criteria([id])
+
+
+def entries_criteria(ids):
+    """Criteria for the track_metadata rows with any of `ids`"""
+    ids = array_of(UUID(), ids)
+    track_ids = db.session.query(Track.id).filter(entry_ids().overlap(ids))
+    # ANY(ARRAY(...)) rather than IN (...), which is planned as a join
+    # against every track. No LIMIT either: the planner guesses that many
+    # tracks match and would scan them all in the hope of stopping early.
+    return [TrackMetadata.track_id == sqlalchemy.any_(db.func.array(
+                track_ids.as_scalar(), type_=ARRAY(UUID))),
+            TrackMetadata.id == sqlalchemy.any_(ids)]
+
+
+def has_key(key):
+    """Criterion for tracks with any value for `key`"""
+    return Track.metadata_.has_key(key)
+
+
+def has_value(key, value):
+    """Criterion for tracks with `value` among the values of `key`"""
+    return Track.metadata_.contains({key: [value]})
+
+
+def save(track, document):
+    """
+    Stores a new document for `track`, which should have been loaded with
+    with_for_update(), and moves its version on. Does not commit.
+    """
+    track.metadata_ = document
+    track.version = track.version + 1
+    track.updated_at = datetime.now()
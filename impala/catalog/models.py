@@ -1,14 +1,25 @@
 from impala import db
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID
 import enum
 
+# Views are created by the migrations; keeping them out of db.metadata stops
+# autogenerate from mistaking them for tables
+views = db.MetaData()
+
 
 class Stack(db.Model):
     __tablename__ = 'stacks'
+    __table_args__ = (
+        db.Index('ix_stacks_added_at_id', 'added_at', 'id'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     name = db.Column(db.String(), nullable=False)
     description = db.Column(db.Text())
@@ -19,10 +30,17 @@ class Stack(db.Model):
 
 class Format(db.Model):
     __tablename__ = 'formats'
+    __table_args__ = (
+        db.Index('ix_formats_added_at_id', 'added_at', 'id'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     name = db.Column(db.String(), nullable=False)
     description = db.Column(db.Text())
@@ -33,10 +51,23 @@ class Format(db.Model):
 
 class HoldingGroup(db.Model):
     __tablename__ = 'holding_groups'
+    __table_args__ = (
+        db.Index('ix_holding_groups_album_artist_trgm', 'album_artist',
+                 postgresql_using='gin',
+                 postgresql_ops={'album_artist': 'gin_trgm_ops'}),
+        db.Index('ix_holding_groups_album_title_trgm', 'album_title',
+                 postgresql_using='gin',
+                 postgresql_ops={'album_title': 'gin_trgm_ops'}),
+        db.Index('ix_holding_groups_added_at_id', 'added_at', 'id'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     album_title = db.Column(db.String(), nullable=False)
     album_artist = db.Column(db.String(), nullable=False)
@@ -44,9 +75,10 @@ class HoldingGroup(db.Model):
     description = db.Column(db.Text())
     active = db.Column(db.Boolean(), nullable=False, default=True)
 
-    stack_id = db.Column(UUID, db.ForeignKey('stacks.id'), nullable=False)
+    stack_id = db.Column(UUID, db.ForeignKey('stacks.id'), nullable=False,
+                         index=True)
     holdings = db.relationship("Holding", backref="holding_group",
-                               lazy="dynamic")
+                               lazy="select")
 
     def __repr__(self):
         return "{} by {} <{}>".format(self.album_title, self.album_artist,
@@ -55,10 +87,22 @@ class HoldingGroup(db.Model):
 
 class Holding(db.Model):
     __tablename__ = 'holdings'
+    __table_args__ = (
+        db.Index('ix_holdings_label_trgm', 'label', postgresql_using='gin',
+                 postgresql_ops={'label': 'gin_trgm_ops'}),
+        db.Index('ix_holdings_added_at_id', 'added_at', 'id'),
+        # Serves the catalog's check for groups with an active holding
+        db.Index('ix_holdings_active_holding_group_id', 'holding_group_id',
+                 postgresql_where=db.text('active')),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     label = db.Column(db.String())
     release_mbid = db.Column(UUID)
@@ -69,15 +113,17 @@ class Holding(db.Model):
     active = db.Column(db.Boolean(), nullable=False, default=True)
 
     holding_group_id = db.Column(UUID, db.ForeignKey('holding_groups.id'),
-                                 nullable=False)
-    format_id = db.Column(UUID, db.ForeignKey('formats.id'), nullable=False)
+                                 nullable=False, index=True)
+    format_id = db.Column(UUID, db.ForeignKey('formats.id'), nullable=False,
+                          index=True)
     rotation_releases = db.relationship("RotationRelease", backref="holding",
-                                        lazy="dynamic")
+                                        lazy="select")
     holding_tags = db.relationship("HoldingTag", backref="holding",
-                                   lazy="dynamic")
+                                   lazy="select")
     holding_comments = db.relationship("HoldingComment", backref="holding",
                                        lazy="dynamic")
-    tracks = db.relationship("Track", backref="holding", lazy="dynamic")
+    tracks = db.relationship("Track", backref="holding", lazy="dynamic",
+                             order_by="(Track.disc_num, Track.track_num)")
 
     def __repr__(self):
         return "{} by {} on {} ({}) <{}>".format(self.holding_group.album_title,
@@ -88,29 +134,49 @@ class Holding(db.Model):
 
 class RotationRelease(db.Model):
     __tablename__ = 'rotation_releases'
+    __table_args__ = (
+        db.Index('ix_rotation_releases_added_at_id', 'added_at', 'id'),
+        # tsrange(start, stop), which is GiST-indexed for the current
+        # rotation, cannot be built from an inverted period
+        db.CheckConstraint('stop IS NULL OR stop >= start',
+                           name='ck_rotation_releases_period'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     start = db.Column(db.DateTime(), nullable=False)
     stop = db.Column(db.DateTime())
     bin = db.Column(db.String())
 
-    holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False)
+    holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False,
+                           index=True)
 
 
 class HoldingTag(db.Model):
     __tablename__ = 'holding_tags'
+    __table_args__ = (
+        db.Index('ix_holding_tags_added_at_id', 'added_at', 'id'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     owner = db.Column(db.String())
     tag = db.Column(db.String(), nullable=False)
 
-    holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False)
+    holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False,
+                           index=True)
 
 
 class HoldingCommentType(enum.Enum):
@@ -122,10 +188,17 @@ class HoldingCommentType(enum.Enum):
 
 class HoldingComment(db.Model):
     __tablename__ = 'holding_comments'
+    __table_args__ = (
+        db.Index('ix_holding_comments_added_at_id', 'added_at', 'id'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     comment_text = db.Column(db.Text())
     reviewer_username = db.Column(db.String())
@@ -135,7 +208,8 @@ class HoldingComment(db.Model):
     type = db.Column(db.Enum(HoldingCommentType),
                      default=HoldingCommentType.OTHER, nullable=False)
 
-    holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False)
+    holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False,
+                           index=True)
 
 
 class TrackFccStatus(enum.Enum):
@@ -146,10 +220,22 @@ class TrackFccStatus(enum.Enum):
 
 class Track(db.Model):
     __tablename__ = "tracks"
+    __table_args__ = (
+        db.Index('ix_tracks_added_at_id', 'added_at', 'id'),
+        # Serves Holding.tracks, which is ordered by disc and track number
+        db.Index('ix_tracks_holding_id', 'holding_id', 'disc_num',
+                 'track_num'),
+        # Serves key and value lookups, with ? and @>
+        db.Index('ix_tracks_metadata', 'metadata', postgresql_using='gin'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
 
     title = db.Column(db.String(), nullable=False)
     artist = db.Column(db.String(), nullable=False)
@@ -162,18 +248,146 @@ class Track(db.Model):
                         default=TrackFccStatus.UNKNOWN)
 
     holding_id = db.Column(UUID, db.ForeignKey('holdings.id'), nullable=False)
-    track_metadata = db.relationship("TrackMetadata", backref="track",
-                                     lazy="dynamic")
+    # {key: [values]}; see impala.catalog.metadata. `metadata` itself is
+    # taken by the declarative base.
+    metadata_ = db.Column('metadata', JSONB, nullable=False, default=dict,
+                          server_default='{}')
+    track_metadata = db.relationship(
+        "TrackMetadata",
+        primaryjoin="Track.id == foreign(TrackMetadata.track_id)",
+        order_by="[TrackMetadata.key, TrackMetadata.value]", viewonly=True)
 
 
 class TrackMetadata(db.Model):
-    __tablename__ = "track_metadata"
+    """
+    One value of a track's metadata, as a row of the track_metadata view
+    over Track.metadata_. Rows are read-only; the id is derived from the
+    track, key and value (see impala.catalog.metadata.entry_id), and the
+    other server columns are the track's.
+    """
+    __table__ = db.Table(
+        'track_metadata', views,
+        db.Column('id', UUID, primary_key=True),
+        db.Column('added_by', db.String(), nullable=False),
+        db.Column('added_at', db.DateTime(), nullable=False),
+        db.Column('updated_at', db.DateTime(), nullable=False),
+        db.Column('version', db.Integer(), nullable=False),
+        db.Column('key', db.String(), nullable=False),
+        db.Column('value', db.Text(), nullable=False),
+        db.Column('track_id', UUID, nullable=False),
+    )
+
+    track = db.relationship(
+        "Track", primaryjoin="foreign(TrackMetadata.track_id) == Track.id",
+        viewonly=True)
+
+
+class DedupKind(enum.Enum):
+    HOLDING_GROUP = "Holding group"
+    HOLDING = "Holding"
+
+
+class MergeSuggestionStatus(enum.Enum):
+    PENDING = "Pending"
+    ACCEPTED = "Accepted"
+    REJECTED = "Rejected"
+
+
+class MergeSuggestion(db.Model):
+    """
+    A pair of holding groups or holdings that the deduplicator believes to
+    be the same, for a librarian to review. `keep_id` is the older of the
+    two rows.
+    """
+    __tablename__ = "merge_suggestions"
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'keep_id', 'duplicate_id'),
+        # Serves the review queue, which lists suggestions by score
+        db.Index('ix_merge_suggestions_status_score', 'status', 'score'),
+        db.Index('ix_merge_suggestions_added_at_id', 'added_at', 'id'),
+    )
 
     id = db.Column(UUID, primary_key=True)
     added_by = db.Column(db.String(), nullable=False)
     added_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False,
+                           server_default=db.func.now())
+    version = db.Column(db.Integer(), nullable=False, default=1,
+                        server_default='1')
+
+    kind = db.Column(db.Enum(DedupKind), nullable=False)
+    keep_id = db.Column(UUID, nullable=False)
+    duplicate_id = db.Column(UUID, nullable=False)
+    score = db.Column(db.Float(), nullable=False)
+    reasons = db.Column(ARRAY(db.String()), nullable=False)
+    status = db.Column(db.Enum(MergeSuggestionStatus), nullable=False,
+                       default=MergeSuggestionStatus.PENDING)
+    reviewed_by = db.Column(db.String())
+    reviewed_at = db.Column(db.DateTime())
+
+
+class DedupKey(db.Model):
+    """A blocking key of a row; rows sharing a key are compared"""
+    __tablename__ = "dedup_keys"
+
+    kind = db.Column(db.Enum(DedupKind), primary_key=True)
+    key = db.Column(db.String(), primary_key=True)
+    row_id = db.Column(UUID, primary_key=True)
+
+
+class DedupWatermark(db.Model):
+    """The (added_at, id) of the last row the deduplicator has seen"""
+    __tablename__ = "dedup_watermarks"
+
+    kind = db.Column(db.Enum(DedupKind), primary_key=True)
+    added_at = db.Column(db.DateTime(), nullable=False)
+    row_id = db.Column(UUID, nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False)
+
 
-    key = db.Column(db.String(), nullable=False)
-    value = db.Column(db.Text(), nullable=False)
+class HoldingRollup(db.Model):
+    """Holdings added per month, format and stack"""
+    __tablename__ = "holding_rollups"
 
-    track_id = db.Column(UUID, db.ForeignKey('tracks.id'), nullable=False)
+    month = db.Column(db.Date(), primary_key=True)
+    format_id = db.Column(UUID, primary_key=True)
+    stack_id = db.Column(UUID, primary_key=True)
+    holdings = db.Column(db.Integer(), nullable=False)
+
+
+class TagRollup(db.Model):
+    """Times each tag has been applied"""
+    __tablename__ = "tag_rollups"
+
+    tag = db.Column(db.String(), primary_key=True)
+    holdings = db.Column(db.Integer(), nullable=False)
+
+
+class RotationRollup(db.Model):
+    """Rotation releases starting per month and bin"""
+    __tablename__ = "rotation_rollups"
+
+    month = db.Column(db.Date(), primary_key=True)
+    bin = db.Column(db.String(), primary_key=True)
+    releases = db.Column(db.Integer(), nullable=False)
+
+
+class ReviewRollup(db.Model):
+    """Holding comments and their ratings added per month and type"""
+    __tablename__ = "review_rollups"
+
+    month = db.Column(db.Date(), primary_key=True)
+    type = db.Column(db.Enum(HoldingCommentType), primary_key=True)
+    comments = db.Column(db.Integer(), nullable=False)
+    ratings = db.Column(db.Integer(), nullable=False)
+    rating_sum = db.Column(db.BigInteger(), nullable=False)
+
+
+class RollupWatermark(db.Model):
+    """The (added_at, id) of the last source row folded into the rollups"""
+    __tablename__ = "rollup_watermarks"
+
+    source = db.Column(db.String(), primary_key=True)
+    added_at = db.Column(db.DateTime(), nullable=False)
+    row_id = db.Column(UUID, nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False)
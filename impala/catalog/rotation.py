@@ -0,0 +1,54 @@
+from collections import defaultdict
+import sqlalchemy
+from impala import db
+from impala.catalog.models import Holding, HoldingGroup, RotationRelease
+from impala.dbutil import any_of
+
+
+def period():
+    """
+    The release's time in rotation as a half-open range; a missing stop
+    leaves it open-ended. The expression must match the GiST index
+    ix_rotation_releases_period.
+    """
+    return db.func.tsrange(RotationRelease.start, RotationRelease.stop)
+
+
+def in_rotation(at):
+    return period().op('@>')(sqlalchemy.cast(at, db.DateTime()))
+
+
+def current_rotation(at, bin=None):
+    """
+    Returns (rotation release, holding, holding group) for every active
+    holding in rotation at `at`, optionally in one bin only, with a single
+    query.
+    """
+    query = db.session.query(RotationRelease, Holding, HoldingGroup)\
+        .join(Holding, RotationRelease.holding_id == Holding.id)\
+        .join(HoldingGroup, Holding.holding_group_id == HoldingGroup.id)\
+        .filter(in_rotation(at), Holding.active == True)
+    if bin is not None:
+        query = query.filter(RotationRelease.bin == bin)
+    return query.order_by(RotationRelease.bin, HoldingGroup.album_artist,
+                          HoldingGroup.album_title, Holding.id)
+
+
+def current_bins(group_ids, at):
+    """
+    Returns {group id: {holding id: [bins]}} for the holdings of
+    `group_ids` in rotation at `at`, with a single query for all of the
+    groups.
+    """
+    if not group_ids:
+        return {}
+    query = db.session.query(Holding.holding_group_id, Holding.id,
+                             RotationRelease.bin)\
+        .join(RotationRelease, RotationRelease.holding_id == Holding.id)\
+        .filter(any_of(Holding.holding_group_id, group_ids),
+                in_rotation(at))\
+        .order_by(RotationRelease.bin)
+    bins = defaultdict(lambda: defaultdict(list))
+    for group_id, holding_id, bin in query:
+        bins[group_id][holding_id].append(bin)
+    return bins
@@ -0,0 +1,114 @@
+from sqlalchemy import func, or_
+from impala import db
+from impala.catalog.models import Holding, HoldingGroup
+
+# Must match the expressions indexed in migration 3c9d4b1f27a8, otherwise
+# PostgreSQL cannot use the full-text indexes.
+TS_CONFIG = 'simple'
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def contains(column, term):
+    return column.ilike('%' + escape_like(term) + '%', escape='\\')
+
+
+def group_document():
+    return func.to_tsvector(TS_CONFIG, HoldingGroup.album_artist + ' ' +
+                            HoldingGroup.album_title)
+
+
+def label_document():
+    return func.to_tsvector(TS_CONFIG, func.coalesce(Holding.label, ''))
+
+
+def text_query(q):
+    return func.plainto_tsquery(TS_CONFIG, q)
+
+
+def holding_ids_matching(term):
+    """
+    Ids of holdings whose group artist/title, label or torrent hash match
+    `term`. Each arm of the union is answered from its own index; a single OR
+    spanning both sides of the holdings/holding_groups join cannot be.
+    """
+    by_group = db.session.query(Holding.id).join(Holding.holding_group).filter(
+        or_(contains(HoldingGroup.album_artist, term),
+            contains(HoldingGroup.album_title, term)))
+    by_label = db.session.query(Holding.id).filter(
+        contains(Holding.label, term))
+    by_hash = db.session.query(Holding.id).filter(
+        func.lower(Holding.torrent_hash) == term.lower())
+    return by_group.union(by_label, by_hash)
+
+
+def holding_ids_matching_text(q):
+    tsquery = text_query(q)
+    by_group = db.session.query(Holding.id).join(Holding.holding_group).filter(
+        group_document().op('@@')(tsquery))
+    by_label = db.session.query(Holding.id).filter(
+        label_document().op('@@')(tsquery))
+    return by_group.union(by_label)
+
+
+def search_holdings(args):
+    """
+    Builds a Holding query (joined to its HoldingGroup) for the search
+    arguments accepted by the v1 API. When `q` is given the results are
+    ranked by full-text relevance, otherwise the newest groups come first.
+    """
+    query = Holding.query.join(HoldingGroup, Holding.holding_group)
+
+    if args.get('any'):
+        query = query.filter(Holding.id.in_(
+            holding_ids_matching(args['any']).subquery()))
+    if args.get('album_artist'):
+        query = query.filter(contains(HoldingGroup.album_artist,
+                                      args['album_artist']))
+    if args.get('album_title'):
+        query = query.filter(contains(HoldingGroup.album_title,
+                                      args['album_title']))
+    if args.get('label'):
+        query = query.filter(contains(Holding.label, args['label']))
+    if args.get('torrent_hash'):
+        query = query.filter(func.lower(Holding.torrent_hash) ==
+                             args['torrent_hash'].lower())
+
+    if args.get('q'):
+        tsquery = text_query(args['q'])
+        query = query.filter(Holding.id.in_(
+            holding_ids_matching_text(args['q']).subquery()))
+        rank = func.ts_rank(group_document(), tsquery) + \
+            func.ts_rank(label_document(), tsquery)
+        query = query.order_by(rank.desc())
+
+    return query.order_by(HoldingGroup.added_at.desc(), Holding.id)
+
+
+def search_holding_groups(args):
+    """
+    Builds a HoldingGroup query for the catalog search page, restricted to
+    groups that have at least one holding.
+    """
+    query = HoldingGroup.query.filter(HoldingGroup.holdings.any())
+
+    if args.get('any'):
+        query = query.filter(or_(contains(HoldingGroup.album_title,
+                                          args['any']),
+                                 contains(HoldingGroup.album_artist,
+                                          args['any'])))
+    if args.get('album_artist'):
+        query = query.filter(contains(HoldingGroup.album_artist,
+                                      args['album_artist']))
+    if args.get('album_title'):
+        query = query.filter(contains(HoldingGroup.album_title,
+                                      args['album_title']))
+
+    if args.get('q'):
+        tsquery = text_query(args['q'])
+        query = query.filter(group_document().op('@@')(tsquery))
+        query = query.order_by(func.ts_rank(group_document(), tsquery).desc())
+
+    return query.order_by(HoldingGroup.added_at.desc(), HoldingGroup.id.desc())
@@ -1,12 +1,15 @@
 import datetime
-from pprint import pprint
 from flask import render_template, make_response, redirect, url_for, request, session
+from flask import Blueprint, abort, current_app, send_file
 from flask import copy_current_request_context
-import requests
-from sqlalchemy import or_
-from impala import app
+from impala import counting
+from impala.replicas import reads
 from impala.api.v1.views import HoldingSearchList
-from impala.catalog.models import Holding, HoldingGroup, Format
+from impala.catalog import coverart, fragments
+from impala.catalog.models import Holding, HoldingGroup
+from impala.catalog.search import search_holding_groups
+
+bp = Blueprint('catalog', __name__)
 
 RESULTS_PER_PAGE = 25
 
@@ -18,15 +21,23 @@ TOP_NAV = [('/holdings', 'Browse Holdings', None),
            ('/reports', 'Reports', 'librarian'),
            ('/help', 'Help', None)]
 
-@app.route('/')
+@bp.route('/')
 def index():
-    return redirect(url_for('list_holdings'))
+    return redirect(url_for('.list_holdings'))
+
 
+def count_mode():
+    mode = request.args.get('count',
+                            current_app.config['CATALOG_COUNT_MODE'])
+    if mode not in counting.COUNT_MODES:
+        abort(400)
+    return mode
 
-@app.route('/holdings', defaults={'page': 1})
-@app.route('/holdings/page/<int:page>')
+
+@bp.route('/holdings', defaults={'page': 1})
+@bp.route('/holdings/page/<int:page>')
+@reads
 def list_holdings(page):
-    # TODO sort by newest
     if 'username' in session:
         user = session['username']
         access = session['access']
@@ -34,82 +45,68 @@ def list_holdings(page):
         user = None
         access = []
 
-    pagination = HoldingGroup.query.join(Holding).join(Format).filter(Holding.active == True).paginate(page, per_page=RESULTS_PER_PAGE)
-
+    query = HoldingGroup.query.filter(
+        HoldingGroup.holdings.any(Holding.active == True)).order_by(
+            HoldingGroup.added_at.desc(), HoldingGroup.id.desc())
+    pagination = counting.paginate(query, page, RESULTS_PER_PAGE,
+                                   count_mode())
     holding_groups = pagination.items
 
-    for hg in holding_groups:
-        print(str(hg))
-        for h in hg.holdings:
-            print(str(h))
-
     now = datetime.datetime.now()
+    cards = fragments.render_cards(holding_groups, access, now)
     return render_template("catalog/holding_list.html",
                            now=now, pagination=pagination,
-                           holding_groups=holding_groups,
-                           user=user, endpoint="list_holdings",
+                           holding_groups=holding_groups, cards=cards,
+                           user=user, endpoint="catalog.list_holdings",
                            top_nav=TOP_NAV, curpage="Browse Holdings",
                            access=access)
 
 
-@app.route('/search', defaults={'page': 1})
-@app.route('/search/page/<int:page>')
+@bp.route('/search', defaults={'page': 1})
+@bp.route('/search/page/<int:page>')
+@reads
 def search(page):
-    # TODO a lot of this is duplicated from the API and can be factored into a
-    # helper function
     if 'username' in session:
         user = session['username']
         access = session['access']
     else:
         user = None
         access = []
-    # TODO sort by newest
-    query = HoldingGroup.query.join(Holding)
-    if 'any' in request.args:
-        ilike = "%{}%".format(request.args['any'])
-        query = query.filter(or_(HoldingGroup.album_title.ilike(ilike),
-                                 HoldingGroup.album_artist.ilike(ilike)))
-    if 'album_artist' in request.args:
-        ilike = "%{}%".format(request.args['album_artist'])
-        query = query.filter(HoldingGroup.album_artist.ilike(ilike))
-    if 'album_title' in request.args:
-        ilike = "%{}%".format(request.args['album_title'])
-        query = query.filter(HoldingGroup.album_title.ilike(ilike))
-
-    pagination = query.paginate(page, per_page=RESULTS_PER_PAGE)
+    query = search_holding_groups(request.args)
+    pagination = counting.paginate(query, page, RESULTS_PER_PAGE,
+                                   count_mode())
     holding_groups = pagination.items
     now = datetime.datetime.now()
+    cards = fragments.render_cards(holding_groups, access, now)
 
     return render_template("catalog/holding_list.html",
                            now=now, pagination=pagination,
-                           holding_groups=holding_groups,
-                           user=user, endpoint="search",
+                           holding_groups=holding_groups, cards=cards,
+                           user=user, endpoint="catalog.search",
                            top_nav=TOP_NAV, curpage=None,
                            access=access)
 
 
-@app.route('/coverartarchive/<type>/<mbid>', defaults={'size': 0})
-@app.route('/coverartarchive/<type>/<mbid>/<int:size>')
+@bp.route('/coverartarchive/<type>/<mbid>', defaults={'size': 0})
+@bp.route('/coverartarchive/<type>/<mbid>/<int:size>')
 def mb_cover_art(type, mbid, size):
-    # TODO cache this at the load balancer level
+    import requests
+
     if type not in ['release-group', 'release']:
-        return None
+        abort(404)
+
     try:
-        r = requests.get('https://coverartarchive.org/{}/{}/'.format(type, mbid))
-        dict = r.json()
-        for i in dict['images']:
-            if not i['front']:
-                continue
-            if size == 250:
-                url = i['thumbnails']['small']
-            elif size == 500:
-                url = i['thumbnails']['large']
-            else:
-                url = i['image']
-#        return redirect(url)
-        r = requests.get(url)
-        resp = make_response(r.content)
-        resp.headers['Content-Type'] = r.headers['Content-Type']
-        return resp
-    except:
-        return None
+        f, meta = coverart.get_cache().get(type, mbid, size)
+    except coverart.CoverArtMissing:
+        abort(404)
+    except (requests.RequestException, coverart.CoverArtError):
+        current_app.logger.warning("Cover art lookup failed for %s %s",
+                                   type, mbid, exc_info=True)
+        abort(502)
+
+    resp = send_file(f, mimetype=meta['content_type'], add_etags=False,
+                     last_modified=meta['last_modified'],
+                     cache_timeout=current_app.config['COVERART_MAX_AGE'])
+    resp.cache_control.public = True
+    resp.set_etag(meta['etag'])
+    return resp.make_conditional(request)
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+from math import ceil
+import threading
+import time
+from flask import abort, current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import Table
+from impala import db
+
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+
+
+class CountCache:
+    """A bounded LRU of query totals that expire after `ttl` seconds"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, total):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, total)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def get_count_cache():
+    cache = current_app.extensions.get('count_cache')
+    if cache is None:
+        cache = CountCache(current_app.config['COUNT_CACHE_SIZE'],
+                           current_app.config['COUNT_CACHE_TTL'])
+        current_app.extensions['count_cache'] = cache
+    return cache
+
+
+def _compiled(query):
+    return query.order_by(None).statement.compile(dialect=db.engine.dialect)
+
+
+def exact_count(query):
+    return query.order_by(None).count()
+
+
+def cached_count(query):
+    """
+    Returns the exact total, reusing one computed for the same SQL and
+    parameters within the last COUNT_CACHE_TTL seconds.
+    """
+    compiled = _compiled(query)
+    key = (str(compiled), tuple(sorted(
+        (name, repr(value)) for name, value in compiled.params.items())))
+    cache = get_count_cache()
+    total = cache.get(key)
+    if total is None:
+        total = exact_count(query)
+        cache.set(key, total)
+    return total
+
+
+def estimated_count(query):
+    """
+    Returns the planner's estimate of the number of rows: the table's row
+    estimate from pg_class for an unfiltered query on one table, and the
+    top row estimate from EXPLAIN otherwise.
+    """
+    froms = query.statement.froms
+    if query.whereclause is None and len(froms) == 1 and \
+            isinstance(froms[0], Table):
+        estimate = db.session.execute(
+            "SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)",
+            {'name': froms[0].name}).scalar()
+        # Tables that have never been analyzed have no estimate
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+
+    # A plain string is passed to the driver as is, with the compiled
+    # statement's own parameter style, so the parameters have to go
+    # through their types' bind processors here (an Enum's member becomes
+    # its name, for one)
+    compiled = _compiled(query)
+    dialect = db.engine.dialect
+    params = {}
+    for name, value in compiled.params.items():
+        process = compiled.binds[name].type.dialect_impl(dialect)\
+            .bind_processor(dialect)
+        params[name] = process(value) if process else value
+    plan = db.session.connection().execute(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_total(query, mode, page, per_page, fetched):
+    """
+    Returns the total number of rows of `query` under count `mode`, or None
+    for 'none'. `fetched` is the number of rows read for `page`, which
+    should be up to per_page + 1 so that the last page can be recognized:
+    there the total is known without counting, whatever the mode.
+    """
+    offset = (page - 1) * per_page
+    if 0 < fetched <= per_page or (fetched == 0 and page == 1):
+        return offset + fetched
+    if mode == 'none':
+        return None
+    if mode == 'cached':
+        return cached_count(query)
+    if mode == 'estimate':
+        return max(estimated_count(query), offset + fetched)
+    return exact_count(query)
+
+
+class CountedPagination(Pagination):
+    """
+    A Pagination whose total may be cached, estimated or unknown (None).
+    has_next comes from reading one row past the page rather than from the
+    total, so it is exact in every mode.
+    """
+
+    def __init__(self, query, page, per_page, total, items, has_more, mode):
+        super().__init__(query, page, per_page, total, items)
+        self.has_more = has_more
+        self.count_mode = mode
+
+    @property
+    def pages(self):
+        known = self.page + (1 if self.has_more else 0)
+        if self.total is None or self.per_page == 0:
+            return known
+        return max(int(ceil(self.total / float(self.per_page))),
+                   known if self.items else 0)
+
+    @property
+    def has_next(self):
+        return self.has_more
+
+
+def paginate(query, page, per_page, mode='exact'):
+    """
+    Like query.paginate(), counting the total according to `mode`: one of
+    'exact', 'cached' (exact, reused for COUNT_CACHE_TTL seconds),
+    'estimate' (from the planner) or 'none'.
+    """
+    if page < 1 or per_page < 0:
+        abort(404)
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    if not rows and page != 1:
+        abort(404)
+    total = count_total(query, mode, page, per_page, len(rows))
+    return CountedPagination(query, page, per_page, total, rows[:per_page],
+                             len(rows) > per_page, mode)
@@ -0,0 +1,22 @@
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+
+
+def array_of(type_, values):
+    """`values` as a single parameter, an array of `type_`"""
+    if isinstance(type_, UUID):
+        # psycopg2 sends a list of strings as text[]
+        return sqlalchemy.cast(sqlalchemy.bindparam(
+            None, list(values), type_=ARRAY(sqlalchemy.String())),
+            ARRAY(type_))
+    return sqlalchemy.bindparam(None, list(values), type_=ARRAY(type_))
+
+
+def any_of(column, values):
+    """
+    `column = ANY(:values)`, with the values sent as a single array
+    parameter. Unlike IN this compiles to the same statement however many
+    values there are, so it costs nothing extra to build for thousands of
+    them and PostgreSQL can reuse its plan.
+    """
+    return column == sqlalchemy.any_(array_of(column.type, values))
@@ -0,0 +1,289 @@
+from collections import defaultdict
+from datetime import datetime
+from difflib import SequenceMatcher
+import re
+import unicodedata
+from uuid import uuid4
+from flask import current_app
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert
+from impala import db
+from impala.catalog.models import DedupKey, DedupKind, DedupWatermark, \
+    Holding, HoldingGroup, MergeSuggestion, MergeSuggestionStatus
+from impala.dbutil import any_of
+from impala.dedup.minhash import MinHasher, shingles
+
+ADDED_BY = 'dedup'
+CHUNK_SIZE = 1000
+HASHER = MinHasher()
+
+EDITION = re.compile(r'[(\[][^)\]]*\b(edition|remaster(ed)?|deluxe|expanded|'
+                     r'anniversary|bonus)\b[^)\]]*[)\]]', re.IGNORECASE)
+NON_WORD = re.compile(r'[\W_]+')
+# Numbers and the small Roman numerals that number volumes and sequels
+NUMBER = re.compile(r'\b(\d+|x{0,3}(ix|iv|v?i{1,3}|v)|x{1,3})\b')
+
+
+def normalize(text):
+    """
+    Folds case, accents, punctuation and edition qualifiers such as
+    "(Deluxe Edition)" out of a name, along with a leading "the".
+    """
+    text = EDITION.sub(' ', text or '')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = NON_WORD.sub(' ', text.casefold().replace('&', ' and '))
+    words = text.split()
+    if words and words[0] == 'the':
+        words = words[1:]
+    return ' '.join(words)
+
+
+def numbers(text):
+    return [match.group(0) for match in NUMBER.finditer(text)]
+
+
+def similarity(a, b):
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class GroupMatcher:
+    """Finds holding groups with the same or nearly the same name"""
+    kind = DedupKind.HOLDING_GROUP
+    model = HoldingGroup
+    columns = (HoldingGroup.id, HoldingGroup.added_at,
+               HoldingGroup.album_artist, HoldingGroup.album_title,
+               HoldingGroup.releasegroup_mbid)
+
+    def keys(self, row):
+        artist = normalize(row.album_artist)
+        title = normalize(row.album_title)
+        if row.releasegroup_mbid:
+            yield 'mbid:{}'.format(row.releasegroup_mbid)
+        yield 'name:{}|{}'.format(artist, title)
+        signature = HASHER.signature(shingles('{} | {}'.format(artist,
+                                                               title)))
+        if signature is not None:
+            for key in HASHER.band_keys(signature):
+                yield 'lsh:' + key
+
+    def score(self, a, b):
+        if a.releasegroup_mbid and b.releasegroup_mbid:
+            if a.releasegroup_mbid == b.releasegroup_mbid:
+                return 1.0, ['releasegroup_mbid']
+            return 0.0, []
+
+        title_a, title_b = normalize(a.album_title), normalize(b.album_title)
+        # "Vol. 1" and "Vol. 2" are different albums however alike they look
+        if numbers(title_a) != numbers(title_b):
+            return 0.0, []
+        artist = similarity(normalize(a.album_artist),
+                            normalize(b.album_artist))
+        title = similarity(title_a, title_b)
+        reasons = []
+        reasons.append('album_artist' if artist == 1 else 'similar_artist')
+        reasons.append('album_title' if title == 1 else 'similar_title')
+        return 0.4 * artist + 0.6 * title, reasons
+
+
+class HoldingMatcher:
+    """
+    Finds holdings of the same release in the same format, or of the same
+    group in the same format from the same label
+    """
+    kind = DedupKind.HOLDING
+    model = Holding
+    columns = (Holding.id, Holding.added_at, Holding.holding_group_id,
+               Holding.format_id, Holding.label, Holding.release_mbid)
+
+    def keys(self, row):
+        if row.release_mbid:
+            yield 'release:{}:{}'.format(row.release_mbid, row.format_id)
+        if row.label:
+            yield 'label:{}:{}:{}'.format(row.holding_group_id,
+                                          row.format_id, normalize(row.label))
+
+    def score(self, a, b):
+        if a.format_id != b.format_id:
+            return 0.0, []
+        if a.release_mbid and b.release_mbid:
+            if a.release_mbid == b.release_mbid:
+                return 1.0, ['release_mbid', 'format']
+            return 0.0, []
+        if a.holding_group_id == b.holding_group_id and a.label and \
+                b.label and normalize(a.label) == normalize(b.label):
+            return 0.9, ['holding_group', 'format', 'label']
+        return 0.0, []
+
+
+MATCHERS = {matcher.kind: matcher for matcher in (GroupMatcher,
+                                                  HoldingMatcher)}
+
+
+def chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Deduplicator:
+    """
+    Suggests merges for the rows of one kind added since the last run.
+
+    Comparing every pair of rows does not scale, so each row is reduced to
+    blocking keys (exact identifiers, its normalized name and the LSH bands
+    of its MinHash signature) that are stored in dedup_keys. A new row is
+    only scored against the rows sharing one of its keys, and keys shared
+    by more than `max_bucket` rows are ignored as too common to tell
+    anything. Pairs scoring at least `min_score` are stored as pending
+    merge suggestions; a pair that has been suggested before, whatever its
+    review status, is never suggested again.
+    """
+
+    def __init__(self, kind, batch_size, min_score, max_bucket):
+        self.matcher = MATCHERS[kind]()
+        self.kind = kind
+        self.batch_size = batch_size
+        self.min_score = min_score
+        self.max_bucket = max_bucket
+
+    @classmethod
+    def from_config(cls, kind, config):
+        return cls(kind, config['DEDUP_BATCH_SIZE'],
+                   config['DEDUP_MIN_SCORE'], config['DEDUP_MAX_BUCKET'])
+
+    def reset(self):
+        """Forgets the keys and watermark, keeping existing suggestions"""
+        DedupKey.query.filter_by(kind=self.kind).delete()
+        DedupWatermark.query.filter_by(kind=self.kind).delete()
+        db.session.commit()
+
+    def pending_rows(self, watermark):
+        model = self.matcher.model
+        query = db.session.query(*self.matcher.columns)\
+            .order_by(model.added_at, model.id)
+        if watermark is not None:
+            query = query.filter(
+                sqlalchemy.tuple_(model.added_at, model.id) >
+                (watermark.added_at, watermark.row_id))
+        return query.limit(self.batch_size).all()
+
+    def run(self):
+        """Returns the number of rows examined and of suggestions made"""
+        watermark = DedupWatermark.query.get(self.kind)
+        examined = suggested = 0
+        while True:
+            rows = self.pending_rows(watermark)
+            if not rows:
+                break
+            suggested += self.process(rows)
+            examined += len(rows)
+
+            if watermark is None:
+                watermark = DedupWatermark(kind=self.kind)
+                db.session.add(watermark)
+            watermark.added_at = rows[-1].added_at
+            watermark.row_id = rows[-1].id
+            watermark.updated_at = datetime.now()
+            db.session.commit()
+        return examined, suggested
+
+    def process(self, rows):
+        keys = {row.id: set(self.matcher.keys(row)) for row in rows}
+        key_rows = [(key, id) for id, row_keys in keys.items()
+                    for key in row_keys]
+        if key_rows:
+            db.session.execute(
+                "INSERT INTO dedup_keys (kind, key, row_id) "
+                "SELECT CAST(:kind AS dedupkind), unnest(CAST(:keys AS "
+                "varchar[])), unnest(CAST(:ids AS uuid[])) "
+                "ON CONFLICT DO NOTHING",
+                {'kind': self.kind.name,
+                 'keys': [key for key, _ in key_rows],
+                 'ids': [id for _, id in key_rows]})
+
+        # Oversized buckets are left out on the database side, as common
+        # keys can have thousands of rows
+        members = db.session.query(
+            DedupKey.key, DedupKey.row_id,
+            sqlalchemy.func.count().over(partition_by=DedupKey.key)
+            .label('size')).filter(
+            DedupKey.kind == self.kind,
+            any_of(DedupKey.key, set().union(*keys.values())))\
+            .subquery()
+        buckets = defaultdict(list)
+        for key, row_id in db.session.query(members.c.key, members.c.row_id)\
+                .filter(members.c.size <= self.max_bucket):
+            buckets[key].append(row_id)
+
+        pairs = set()
+        for id, row_keys in keys.items():
+            for key in row_keys:
+                pairs.update(tuple(sorted((id, other)))
+                             for other in buckets.get(key, ()) if other != id)
+        if not pairs:
+            return 0
+
+        known = {row.id: row for row in rows}
+        model = self.matcher.model
+        missing = {id for pair in pairs for id in pair} - set(known)
+        if missing:
+            for row in db.session.query(*self.matcher.columns).filter(
+                    any_of(model.id, missing)):
+                known[row.id] = row
+
+        now = datetime.now()
+        suggestions = []
+        for a, b in pairs:
+            # Rows deleted since they were keyed are skipped
+            if a not in known or b not in known:
+                continue
+            keep, duplicate = sorted((known[a], known[b]),
+                                     key=lambda row: (row.added_at, row.id))
+            score, reasons = self.matcher.score(keep, duplicate)
+            if score >= self.min_score:
+                suggestions.append({
+                    'id': str(uuid4()), 'added_by': ADDED_BY,
+                    'added_at': now, 'updated_at': now, 'version': 1,
+                    'kind': self.kind, 'keep_id': keep.id,
+                    'duplicate_id': duplicate.id, 'score': round(score, 4),
+                    'reasons': reasons,
+                    'status': MergeSuggestionStatus.PENDING})
+        table = MergeSuggestion.__table__
+        added = 0
+        for chunk in chunks(suggestions):
+            added += len(db.session.execute(
+                insert(table).values(chunk).on_conflict_do_nothing(
+                    index_elements=['kind', 'keep_id', 'duplicate_id'])
+                .returning(table.c.id)).fetchall())
+        return added
+
+
+def run(kinds=None, rebuild=False):
+    """Runs the deduplicator over `kinds` (all of them by default)"""
+    results = {}
+    for kind in kinds or list(DedupKind):
+        deduplicator = Deduplicator.from_config(kind, current_app.config)
+        if rebuild:
+            deduplicator.reset()
+        results[kind] = deduplicator.run()
+    return results
+
+
+def load_subjects(suggestions):
+    """
+    Returns the rows that `suggestions` refer to, keyed by (kind, id), with
+    one query per kind.
+    """
+    ids = defaultdict(set)
+    for suggestion in suggestions:
+        ids[suggestion.kind].update((suggestion.keep_id,
+                                     suggestion.duplicate_id))
+    subjects = {}
+    for kind, kind_ids in ids.items():
+        model = MATCHERS[kind].model
+        for row in model.query.filter(model.id.in_(kind_ids)):
+            subjects[kind, row.id] = row
+    return subjects
@@ -0,0 +1,31 @@
+import time
+import click
+from flask.cli import AppGroup
+from impala.catalog.models import DedupKind
+from impala.dedup import run
+
+dedup_cli = AppGroup('dedup', help="Find duplicate holding groups and "
+                                   "holdings.")
+
+KINDS = {kind.name.lower(): kind for kind in DedupKind}
+
+
+@dedup_cli.command('run')
+@click.option('--kind', 'kinds', multiple=True, type=click.Choice(KINDS),
+              help="Only look for duplicates of this kind (repeatable).")
+@click.option('--rebuild', is_flag=True,
+              help="Forget the blocking keys and start over from the first "
+                   "row. Suggestions already made are kept.")
+@click.option('--watch', type=float, metavar='SECONDS',
+              help="Keep running, looking for new rows every SECONDS.")
+def run_command(kinds, rebuild, watch):
+    """Suggest merges for the rows added since the last run."""
+    kinds = [KINDS[kind] for kind in kinds] or None
+    while True:
+        for kind, (examined, suggested) in run(kinds, rebuild).items():
+            click.echo("{}: examined {} new rows, made {} suggestions".format(
+                kind.name.lower(), examined, suggested))
+        if watch is None:
+            break
+        rebuild = False
+        time.sleep(watch)
@@ -0,0 +1,50 @@
+import hashlib
+import random
+import zlib
+
+# Keys derived from the signatures are stored, so changing any of these
+# requires `flask dedup run --rebuild`
+PERMUTATIONS = 64
+BANDS = 16
+SEED = 20171016
+PRIME = (1 << 61) - 1
+
+
+def shingles(text, size=3):
+    """Returns the set of character `size`-grams of `text`"""
+    text = ' {} '.format(text)
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+class MinHasher:
+    """
+    Estimates the Jaccard similarity of shingle sets with MinHash and
+    buckets signatures with locality-sensitive hashing: two sets share a
+    band key with probability 1 - (1 - s^r)^b, where s is their similarity
+    and r = permutations / bands. With 64 permutations in 16 bands, pairs
+    above about 0.5 similar almost always share a key and pairs below 0.2
+    almost never do.
+    """
+
+    def __init__(self, permutations=PERMUTATIONS, bands=BANDS, seed=SEED):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME))
+                       for _ in range(permutations)]
+        self.bands = bands
+        self.rows = permutations // bands
+
+    def signature(self, tokens):
+        hashes = [zlib.crc32(token.encode('utf-8')) for token in tokens]
+        if not hashes:
+            return None
+        return [min((a * h + b) % PRIME for h in hashes)
+                for a, b in self.params]
+
+    def band_keys(self, signature):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(repr(chunk).encode('ascii'),
+                                     digest_size=8).hexdigest()
+            yield '{}:{}'.format(band, digest)
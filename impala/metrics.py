@@ -0,0 +1,253 @@
+import atexit
+import glob
+import ipaddress
+import os
+import time
+import weakref
+from flask import Response, abort, current_app, g, has_request_context, \
+    request
+from jinja2 import Template
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, \
+    Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+# Where each process keeps its metrics for the others to read, under a
+# preforking server; read by prometheus_client before any metric is made
+SHARED_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REGISTRY = CollectorRegistry()
+
+REQUESTS = Counter('impala_http_requests_total', "Requests handled",
+                   ('endpoint', 'method', 'status'), registry=REGISTRY)
+REQUEST_SECONDS = Histogram('impala_http_request_duration_seconds',
+                            "Time to handle a request",
+                            ('endpoint', 'method'), registry=REGISTRY,
+                            buckets=LATENCY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('impala_http_request_db_seconds',
+                               "Time a request spent running SQL",
+                               ('endpoint', 'method'), registry=REGISTRY,
+                               buckets=LATENCY_BUCKETS)
+REQUEST_RENDER_SECONDS = Histogram('impala_http_request_render_seconds',
+                                   "Time a request spent rendering templates",
+                                   ('endpoint', 'method'), registry=REGISTRY,
+                                   buckets=LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('impala_http_request_queries',
+                            "SQL statements run by a request",
+                            ('endpoint', 'method'), registry=REGISTRY,
+                            buckets=QUERY_BUCKETS)
+POOL_WAIT_SECONDS = Histogram('impala_db_pool_checkout_wait_seconds',
+                              "Time spent waiting for a pooled connection",
+                              registry=REGISTRY, buckets=WAIT_BUCKETS)
+POOL_CONNECTIONS = Gauge('impala_db_pool_connections',
+                         "Connections in the pools by state", ('state',),
+                         registry=REGISTRY, multiprocess_mode='livesum')
+ROUTED_READS = Counter('impala_db_routed_reads_total',
+                       "Read-only requests by the database that served them",
+                       ('database',), registry=REGISTRY)
+
+
+def clear_shared():
+    """
+    Removes the metrics left in SHARED_DIR by an earlier run. Only the
+    uWSGI master does so, before it forks the workers, as they would
+    otherwise remove each other's.
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return
+    if SHARED_DIR is None or uwsgi.worker_id() != 0:
+        return
+    for path in glob.glob(os.path.join(SHARED_DIR, '*.db')):
+        os.remove(path)
+
+
+def _exit():
+    # The pool gauges of a worker that has gone are no longer summed
+    if SHARED_DIR is not None:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+atexit.register(_exit)
+
+
+class RequestStats:
+    def __init__(self, max_statements):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.rendering = False
+        self.max_statements = max_statements
+        self.statements = []
+
+
+def _stats():
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long each checkout waits, including the
+    time to open a new connection when the pool has none idle, and keeps
+    POOL_CONNECTIONS up to date for the pools of the process
+    """
+    pools = weakref.WeakSet()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Pools inherited by a forked worker are not its own to count
+        self.pid = os.getpid()
+        self.pools.add(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+            self.count_connections()
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        self.count_connections()
+
+    def count_connections(self):
+        pools = [pool for pool in self.pools if pool.pid == os.getpid()]
+        for state, count in [
+                ('checked_out', sum(p.checkedout() for p in pools)),
+                ('idle', sum(p.checkedin() for p in pools)),
+                ('overflow', sum(max(0, p.overflow()) for p in pools))]:
+            POOL_CONNECTIONS.labels(state).set(count)
+
+
+class TimedTemplate(Template):
+    """
+    Adds the time spent rendering to the request's stats. Only top-level
+    renders are counted; included templates and templates rendered from
+    within another are part of their parent.
+    Lazy loads triggered from a template count as both rendering and SQL.
+    """
+
+    def render(self, *args, **kwargs):
+        stats = _stats()
+        if stats is None or stats.rendering:
+            return super().render(*args, **kwargs)
+        stats.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            stats.rendering = False
+            stats.render_time += time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if context is not None and _stats() is not None:
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    stats = _stats()
+    start = getattr(context, 'metrics_start', None)
+    if stats is None or start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats.queries += 1
+    stats.db_time += elapsed
+    if cursor.description is not None and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+    if len(stats.statements) < stats.max_statements:
+        stats.statements.append((elapsed, statement))
+
+
+def start_request():
+    if current_app.config['METRICS_ENABLED']:
+        g.request_stats = RequestStats(
+            current_app.config['SLOW_REQUEST_MAX_STATEMENTS'])
+
+
+def finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.start
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method
+
+    response.headers.add('Server-Timing', ', '.join([
+        'db;dur={:.1f};desc="{} queries, {} rows"'.format(
+            stats.db_time * 1000, stats.queries, stats.rows),
+        'render;dur={:.1f}'.format(stats.render_time * 1000),
+        'total;dur={:.1f}'.format(elapsed * 1000),
+    ]))
+
+    REQUESTS.labels(endpoint, method, response.status_code).inc()
+    REQUEST_SECONDS.labels(endpoint, method).observe(elapsed)
+    REQUEST_DB_SECONDS.labels(endpoint, method).observe(stats.db_time)
+    REQUEST_RENDER_SECONDS.labels(endpoint, method).observe(
+        stats.render_time)
+    REQUEST_QUERIES.labels(endpoint, method).observe(stats.queries)
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold is not None and elapsed >= threshold:
+        current_app.logger.warning(
+            "Slow request: %s %s took %.0fms (%d queries, %.0fms in SQL, "
+            "%.0fms rendering)\n%s", method, request.full_path.rstrip('?'),
+            elapsed * 1000, stats.queries, stats.db_time * 1000,
+            stats.render_time * 1000, '\n'.join(
+                '  {:8.1f}ms {}'.format(duration * 1000,
+                                        ' '.join(statement.split()))
+                for duration, statement in stats.statements))
+    return response
+
+
+def metrics_view():
+    address = ipaddress.ip_address(request.remote_addr)
+    if not any(address in network for network in
+               current_app.extensions['metrics_networks']):
+        abort(403)
+    registry = REGISTRY
+    if SHARED_DIR is not None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, SHARED_DIR)
+    return Response(generate_latest(registry),
+                    content_type=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """
+    Records per-request SQL, rendering and total time, adds them to every
+    response as a Server-Timing header and serves the aggregates at
+    /metrics in the Prometheus text format to METRICS_ALLOWED_NETWORKS.
+    Under a preforking server the aggregates cover every worker when
+    PROMETHEUS_MULTIPROC_DIR names a directory they share.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    options.setdefault('poolclass', TimedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    app.extensions['metrics_networks'] = [
+        ipaddress.ip_network(network)
+        for network in app.config['METRICS_ALLOWED_NETWORKS']]
+
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,189 @@
+from urllib.parse import urlencode
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from impala import db
+from impala.api.v1.export import EXPORT_MODELS
+from impala.catalog.models import HoldingGroup
+
+SCAN_NODES = ('Seq Scan', 'Parallel Seq Scan')
+
+
+def sample_requests():
+    """
+    Returns the paths to request: each API list, page and item endpoint,
+    the includes, the searches and the catalog pages. Search terms and ids
+    are taken from the data so that the planner sees realistic values.
+    """
+    paths = []
+    for name, model in EXPORT_MODELS.items():
+        paths.append('/api/v1/{}'.format(name))
+        paths.append('/api/v1/{}?after='.format(name))
+        item = model.query.order_by(model.added_at.desc()).first()
+        if item is not None:
+            paths.append('/api/v1/{}/{}'.format(name, item.id))
+
+    paths += [
+        '/api/v1/holdings?include=holding_group,format,tracks.track_metadata,'
+        'holding_tags,holding_comments,rotation_releases',
+        '/api/v1/holding_groups?include=holdings,stack&after=',
+        '/api/v1/rotation/current',
+        '/holdings',
+        '/holdings/page/2',
+    ]
+
+    group = HoldingGroup.query.order_by(HoldingGroup.added_at.desc()).first()
+    if group is not None:
+        artist = group.album_artist
+        title = group.album_title
+        paths += [
+            '/api/v1/holdings/search?' + urlencode({'album_artist': artist}),
+            '/api/v1/holdings/search?' + urlencode({'album_title': title}),
+            '/api/v1/holdings/search?' + urlencode({'any': artist}),
+            '/api/v1/holdings/search?' + urlencode({'q': artist}),
+            '/search?' + urlencode({'album_artist': artist}),
+            '/search?' + urlencode({'q': title}),
+        ]
+    return paths
+
+
+def large_tables(min_rows):
+    rows = db.session.execute(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' "
+        "AND relnamespace = 'public'::regnamespace AND reltuples >= :min_rows",
+        {'min_rows': min_rows})
+    return {row[0] for row in rows}
+
+
+def seq_scans(plan):
+    """Yields the relation of every sequential scan node in a JSON plan"""
+    if plan.get('Node Type') in SCAN_NODES:
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+def is_count(statement):
+    return statement.lstrip().startswith('SELECT count(*)')
+
+
+def capture_statements(paths, username, access):
+    """
+    Requests each path as `username` and returns the SELECT statements run
+    for it, as a list of (path, statement, parameters).
+    """
+    captured = []
+    current = [None]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((current[0], statement, parameters))
+
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = username
+        session['access'] = access
+
+    # Listening on every engine catches the reads sent to replicas too
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for path in paths:
+            current[0] = path
+            resp = client.get(path)
+            if resp.status_code != 200:
+                click.echo("GET {} returned {}".format(path, resp.status_code),
+                           err=True)
+            # Follow cursors so that the keyset predicate is planned too
+            if path.endswith('after=') and resp.is_json and \
+                    resp.get_json().get('next'):
+                current[0] = path + resp.get_json()['next']
+                client.get(current[0])
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+    return captured
+
+
+def explain(statement, parameters, seqscan=True):
+    """
+    Returns the plan of `statement`. Without `seqscan` the planner reads a
+    table sequentially only when no index can serve the query, so that the
+    plan does not depend on how many rows the tables hold.
+    """
+    raw = db.engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if not seqscan:
+            # Undone when the connection goes back to the pool and the
+            # transaction is rolled back
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        plan = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        raw.close()
+    return plan[0]['Plan']
+
+
+@click.command('check-plans')
+@click.option('--min-rows', default=10000, show_default=True,
+              help="Tables with at least this many rows must not be "
+                   "scanned sequentially.")
+@click.option('--analyze/--no-analyze', default=True, show_default=True,
+              help="Update planner statistics before checking.")
+@click.option('--seqscan/--no-seqscan', default=True, show_default=True,
+              help="Let the planner choose sequential scans; without, only "
+                   "queries no index can serve scan, whatever the size of "
+                   "the tables.")
+@click.option('-v', '--verbose', is_flag=True,
+              help="Print every statement that was checked.")
+@with_appcontext
+def check_plans_command(min_rows, analyze, seqscan, verbose):
+    """
+    Check the query plans of the API and catalog views.
+
+    Issues the queries behind each endpoint against the configured database
+    and runs EXPLAIN on them. Exits with status 1 if any plan reads a large
+    table with a sequential scan. Run it against a database seeded with
+    production-sized data, such as one made by the benchmark generator.
+    """
+    if analyze:
+        db.session.execute('ANALYZE')
+        db.session.commit()
+
+    tables = large_tables(min_rows)
+    if not tables:
+        click.echo("No table has {} rows; seed the database first".format(
+            min_rows), err=True)
+
+    paths = sample_requests()
+    db.session.remove()
+    failures = 0
+    counts = 0
+    checked = 0
+    for path, statement, parameters in capture_statements(
+            paths, 'check-plans', ['librarian']):
+        checked += 1
+        scanned = sorted(set(seq_scans(explain(statement, parameters,
+                                                 seqscan))) & tables)
+        if scanned and is_count(statement):
+            # Numbered pages need the total, which means reading every
+            # matching row; cursor paging avoids this
+            counts += 1
+            status = "warning: count scans {}".format(', '.join(scanned))
+        elif scanned:
+            failures += 1
+            status = "sequential scan on {}".format(', '.join(scanned))
+        elif verbose:
+            status = "ok"
+        else:
+            continue
+        click.echo("GET {}: {}\n    {}".format(
+            path, status, ' '.join(statement.split())))
+
+    click.echo("{} statements checked, {} with sequential scans on large "
+               "tables, {} counts".format(checked, failures, counts))
+    if failures:
+        raise SystemExit(1)
@@ -0,0 +1,199 @@
+from functools import wraps
+import random
+import threading
+import time
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+import sqlalchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+from impala import metrics
+
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# Seconds behind the primary. A replica that is streaming from the primary
+# and has replayed everything it has received is caught up, however long ago
+# the last write was. One that has lost the primary has replayed all it has
+# received too, so it is as far behind as its last replayed transaction (or
+# unusable if there is none). Roles without pg_read_all_stats cannot see the
+# receiver's status, and go by whether a receiver is running at all. A
+# database that is not a replica at all is never behind.
+LAG = """
+SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() AND
+                 EXISTS (SELECT 1 FROM pg_stat_wal_receiver
+                         WHERE coalesce(status, 'streaming') = 'streaming')
+            THEN 0
+            ELSE coalesce(extract(epoch FROM
+                                  now() - pg_last_xact_replay_timestamp())
+                          ::float8,
+                          'Infinity')
+       END
+"""
+
+
+class Replica:
+    """
+    One read replica, named by its key in SQLALCHEMY_BINDS, with the result
+    of its last health check.
+    """
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.available = False
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def usable(self, max_lag, interval):
+        """
+        Whether reads may go to the replica, checking it again first if the
+        last check is more than `interval` seconds old. Only one thread
+        checks at a time; the others go by the previous result.
+        """
+        if self.checked_at is None or \
+                time.monotonic() - self.checked_at >= interval:
+            if self.lock.acquire(blocking=False):
+                try:
+                    self.check(max_lag)
+                finally:
+                    self.lock.release()
+        return self.available
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as connection:
+                lag = float(connection.execute(LAG).scalar())
+        except sqlalchemy.exc.DBAPIError:
+            self.mark_down()
+            return
+        if lag > max_lag:
+            if self.available:
+                current_app.logger.warning(
+                    "Replica %s is %.1fs behind; reading from the primary",
+                    self.name, lag)
+            self.set_available(False)
+        else:
+            if not self.available and self.checked_at is not None:
+                current_app.logger.info("Replica %s is usable again",
+                                        self.name)
+            self.set_available(True)
+
+    def mark_down(self):
+        if self.available:
+            current_app.logger.warning(
+                "Replica %s is unavailable; reading from the primary",
+                self.name)
+        self.set_available(False)
+
+    def set_available(self, available):
+        self.available = available
+        self.checked_at = time.monotonic()
+
+
+def get_replicas():
+    from impala import db
+    replicas = current_app.extensions.get('replicas')
+    if replicas is None:
+        # Flask-SQLAlchemy keeps the app it is given with the engine, so it
+        # must not be the proxy, which only works in an application context
+        app = current_app._get_current_object()
+        replicas = [Replica(name, db.get_engine(app, bind=name))
+                    for name in app.config['REPLICA_BINDS']]
+        current_app.extensions['replicas'] = replicas
+    return replicas
+
+
+def sticky_seconds():
+    """
+    How long a session stays on the primary after a write. A replica that
+    was at most REPLICA_MAX_LAG behind when last checked, at most
+    REPLICA_CHECK_INTERVAL ago, has every write older than both together.
+    """
+    config = current_app.config
+    return config['REPLICA_MAX_LAG'] + config['REPLICA_CHECK_INTERVAL']
+
+
+def use_replica():
+    """
+    Sends the request's remaining reads to a replica that is up and close
+    enough to the primary, unless the session wrote recently. The
+    connection is opened here, so that a replica which has gone down since
+    its last check is noticed while the primary can still take over.
+    """
+    if g.get('reads') or not current_app.config['REPLICA_BINDS']:
+        return
+    from impala import db
+    g.reads = True
+    if session.get('primary_until', 0) > time.time():
+        metrics.ROUTED_READS.labels('primary').inc()
+        return
+
+    config = current_app.config
+    replicas = [replica for replica in get_replicas() if replica.usable(
+        config['REPLICA_MAX_LAG'], config['REPLICA_CHECK_INTERVAL'])]
+    while replicas:
+        replica = replicas.pop(random.randrange(len(replicas)))
+        try:
+            db.session.connection(bind=replica.engine)
+        except sqlalchemy.exc.DBAPIError:
+            db.session.rollback()
+            replica.mark_down()
+            continue
+        g.read_engine = replica.engine
+        metrics.ROUTED_READS.labels(replica.name).inc()
+        return
+    metrics.ROUTED_READS.labels('primary').inc()
+
+
+def reads(f):
+    """Marks a view or resource method as read-only; see use_replica()"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        use_replica()
+        return f(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    """
+    Sends statements to the replica chosen by use_replica(), if any, except
+    for flushes and INSERT, UPDATE and DELETE statements.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        engine = g.get('read_engine') if has_app_context() else None
+        if engine is not None and not self._flushing and \
+                not isinstance(clause, UpdateBase):
+            return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def start_request():
+    g.reads = False
+    g.read_engine = None
+
+
+def finish_request(response):
+    # A write keeps the session's reads on the primary until the replicas
+    # have caught up with it
+    if request.method not in SAFE_METHODS and not g.get('reads') and \
+            response.status_code < 400:
+        session['primary_until'] = time.time() + sticky_seconds()
+    return response
+
+
+def init_app(app):
+    """
+    Routes the reads of views marked with @reads to the replicas named in
+    REPLICA_BINDS, if there are any.
+    """
+    if not app.config['REPLICA_BINDS']:
+        return
+    app.before_request(start_request)
+    app.after_request(finish_request)
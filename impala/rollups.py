@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+import sqlalchemy
+from impala import db
+from impala.catalog import models
+
+rollups_cli = AppGroup('rollups', help="Maintain the report rollup tables.")
+
+WINDOW = ("(CAST(:after_at AS timestamp) IS NULL OR "
+          "(s.added_at, s.id) > (CAST(:after_at AS timestamp), "
+          "CAST(:after_id AS uuid))) AND "
+          "(s.added_at, s.id) <= (CAST(:until_at AS timestamp), "
+          "CAST(:until_id AS uuid))")
+
+
+class Rollup:
+    """
+    Counts and sums over one source table, grouped by `dimensions`, kept in
+    `model`'s table. Every measure is additive, so rows added since the
+    last refresh are aggregated on their own and added to the stored
+    totals. `derived` maps the names of values that are not additive,
+    such as averages, to functions computing them from a row of totals.
+    """
+
+    def __init__(self, name, model, source, dimensions, measures, select,
+                 derived=None):
+        self.name = name
+        self.model = model
+        self.source = source
+        self.dimensions = dimensions
+        self.measures = measures
+        self.select = select
+        self.derived = derived or {}
+
+    def upsert(self):
+        table = self.model.__tablename__
+        return ("INSERT INTO {table} ({columns}) {select} "
+                "ON CONFLICT ({keys}) DO UPDATE SET {updates}").format(
+            table=table,
+            columns=', '.join(self.dimensions + self.measures),
+            select=self.select.format(window=WINDOW),
+            keys=', '.join(self.dimensions),
+            updates=', '.join('{0} = {1}.{0} + excluded.{0}'.format(
+                measure, table) for measure in self.measures))
+
+
+def average_rating(row):
+    if not row['ratings']:
+        return None
+    return round(row['rating_sum'] / row['ratings'], 2)
+
+
+ROLLUPS = {rollup.name: rollup for rollup in [
+    Rollup('holdings', models.HoldingRollup, models.Holding,
+           ['month', 'format_id', 'stack_id'], ['holdings'],
+           "SELECT CAST(date_trunc('month', s.added_at) AS date), "
+           "s.format_id, g.stack_id, count(*) FROM holdings s "
+           "JOIN holding_groups g ON g.id = s.holding_group_id "
+           "WHERE {window} GROUP BY 1, 2, 3"),
+    Rollup('tags', models.TagRollup, models.HoldingTag,
+           ['tag'], ['holdings'],
+           "SELECT s.tag, count(*) FROM holding_tags s "
+           "WHERE {window} GROUP BY 1"),
+    Rollup('rotation', models.RotationRollup, models.RotationRelease,
+           ['month', 'bin'], ['releases'],
+           "SELECT CAST(date_trunc('month', s.start) AS date), "
+           "coalesce(s.bin, ''), count(*) FROM rotation_releases s "
+           "WHERE {window} GROUP BY 1, 2"),
+    Rollup('reviews', models.ReviewRollup, models.HoldingComment,
+           ['month', 'type'], ['comments', 'ratings', 'rating_sum'],
+           "SELECT CAST(date_trunc('month', s.added_at) AS date), s.type, "
+           "count(*), count(s.rating), coalesce(sum(s.rating), 0) "
+           "FROM holding_comments s WHERE {window} GROUP BY 1, 2",
+           derived={'average_rating': average_rating}),
+]}
+
+
+def refresh(rollup, settle, rebuild=False):
+    """
+    Folds the source rows added since the rollup's watermark into it and
+    moves the watermark, in one transaction. Rows added in the last
+    `settle` seconds are left for the next run, so that a transaction that
+    committed late with an older added_at is not skipped. With `rebuild`
+    the totals are recomputed from every row instead, in the same
+    transaction, so readers never see them empty. Returns the new
+    watermark, or None if there was nothing to do.
+    """
+    source = rollup.source
+    # Two refreshes running at once would both add the same rows
+    db.session.execute('SELECT pg_advisory_xact_lock(hashtext(:name))',
+                       {'name': 'rollup:' + rollup.name})
+    if rebuild:
+        db.session.execute('DELETE FROM {}'.format(
+            rollup.model.__tablename__))
+        models.RollupWatermark.query.filter_by(source=rollup.name).delete()
+    watermark = models.RollupWatermark.query.get(rollup.name)
+    query = db.session.query(source.added_at, source.id)\
+        .filter(source.added_at <= datetime.now() - timedelta(seconds=settle))
+    if watermark is not None:
+        query = query.filter(
+            sqlalchemy.tuple_(source.added_at, source.id) >
+            (watermark.added_at, watermark.row_id))
+    until = query.order_by(source.added_at.desc(), source.id.desc()).first()
+    if until is None:
+        db.session.commit()
+        return None
+
+    db.session.execute(rollup.upsert(), {
+        'after_at': watermark.added_at if watermark else None,
+        'after_id': watermark.row_id if watermark else None,
+        'until_at': until.added_at, 'until_id': until.id})
+    if watermark is None:
+        watermark = models.RollupWatermark(source=rollup.name)
+        db.session.add(watermark)
+    watermark.added_at = until.added_at
+    watermark.row_id = until.id
+    watermark.updated_at = datetime.now()
+    db.session.commit()
+    return watermark
+
+
+@rollups_cli.command('refresh')
+@click.argument('names', nargs=-1, type=click.Choice(sorted(ROLLUPS)))
+@click.option('--rebuild', is_flag=True,
+              help="Recompute from every row rather than only new ones, "
+                   "picking up edits and deletions.")
+def refresh_command(names, rebuild):
+    """Bring the rollups (all of them by default) up to date."""
+    settle = current_app.config['ROLLUP_SETTLE_SECONDS']
+    for name in names or sorted(ROLLUPS):
+        watermark = refresh(ROLLUPS[name], settle, rebuild)
+        if watermark is None:
+            click.echo("{}: up to date".format(name))
+        else:
+            click.echo("{}: now includes rows added up to {}".format(
+                name, watermark.added_at.isoformat()))
@@ -0,0 +1,99 @@
+from abc import ABC, abstractmethod
+from importlib import import_module
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from impala.catalog.models import Holding, HoldingGroup
+
+BACKENDS = {
+    'sql': 'impala.search.sql:SqlSearchBackend',
+    'memory': 'impala.search.memory:MemorySearchBackend',
+    'elasticsearch': 'impala.search.elasticsearch:ElasticsearchBackend',
+}
+
+SEARCH_FIELDS = ('album_artist', 'album_title', 'label')
+
+
+class SearchBackend(ABC):
+    """
+    Answers holding searches for HoldingSearchList. `args` may contain any of
+    `any`, `album_artist`, `album_title`, `label`, `torrent_hash` and `q`,
+    with the same meaning as in impala.catalog.search.search_holdings.
+    """
+    # Backends that keep their own copy of the catalog set this so that
+    # writes through the API are forwarded to them
+    external = False
+
+    def __init__(self, app):
+        self.app = app
+
+    @abstractmethod
+    def search(self, args, page, per_page, count='exact'):
+        """
+        Returns (holding ids in display order, total hits). Up to
+        per_page + 1 ids are returned, so that the caller can tell whether
+        there is a next page. `count` is one of impala.counting.COUNT_MODES;
+        backends that know the total cheaply may ignore it, and total is
+        None for 'none'.
+        """
+
+    def index_holdings(self, holdings):
+        pass
+
+    def remove_holdings(self, ids):
+        pass
+
+    def rebuild(self, holdings):
+        """Replaces the whole index with documents for `holdings`"""
+        pass
+
+
+def holding_document(holding):
+    group = holding.holding_group
+    return {
+        'id': holding.id,
+        'holding_group_id': group.id,
+        'album_artist': group.album_artist,
+        'album_title': group.album_title,
+        'label': holding.label,
+        'torrent_hash': holding.torrent_hash,
+        'added_at': group.added_at.isoformat(),
+    }
+
+
+def get_backend():
+    backend = current_app.extensions.get('search_backend')
+    if backend is None:
+        module_name, class_name = BACKENDS[
+            current_app.config['SEARCH_BACKEND']].split(':')
+        backend_class = getattr(import_module(module_name), class_name)
+        backend = backend_class(current_app._get_current_object())
+        current_app.extensions['search_backend'] = backend
+    return backend
+
+
+def indexed_holdings():
+    return Holding.query.options(joinedload(Holding.holding_group))
+
+
+def update_index(model, id):
+    """
+    Pushes the holdings affected by a write to `model` row `id` to the search
+    backend. The database stays the source of truth, so a failing index only
+    logs an error; `flask search rebuild` repairs it.
+    """
+    backend = get_backend()
+    if not backend.external:
+        return
+
+    if model is Holding:
+        query = indexed_holdings().filter(Holding.id == id)
+    elif model is HoldingGroup:
+        query = indexed_holdings().filter(Holding.holding_group_id == id)
+    else:
+        return
+
+    try:
+        backend.index_holdings(query.all())
+    except Exception:
+        current_app.logger.exception("Failed to update search index for %s %s",
+                                     model.__tablename__, id)
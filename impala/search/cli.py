@@ -0,0 +1,20 @@
+import click
+from flask.cli import AppGroup
+from impala.search import get_backend, indexed_holdings
+
+search_cli = AppGroup('search', help="Manage the holding search index.")
+
+
+@search_cli.command('rebuild')
+@click.option('--batch-size', default=1000, show_default=True,
+              help="Number of holdings read from the database at a time.")
+def rebuild(batch_size):
+    """Rebuild the search index from the database."""
+    backend = get_backend()
+    if not backend.external:
+        click.echo("The {} backend searches the database directly; there is "
+                   "nothing to rebuild.".format(type(backend).__name__))
+        return
+
+    backend.rebuild(indexed_holdings().order_by(None).yield_per(batch_size))
+    click.echo("Search index rebuilt")
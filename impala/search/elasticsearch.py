@@ -0,0 +1,197 @@
+from datetime import datetime
+from itertools import islice
+from flask import json
+import requests
+from impala.search import SEARCH_FIELDS, SearchBackend, holding_document
+
+TEXT_FIELD = {
+    'type': 'text',
+    'fields': {
+        'trigram': {'type': 'text', 'analyzer': 'trigram'},
+        'keyword': {'type': 'keyword', 'normalizer': 'lowercase'},
+    },
+}
+
+INDEX_BODY = {
+    'settings': {
+        'analysis': {
+            'tokenizer': {
+                'trigram': {'type': 'ngram', 'min_gram': 3, 'max_gram': 3},
+            },
+            'analyzer': {
+                'trigram': {'type': 'custom', 'tokenizer': 'trigram',
+                            'filter': ['lowercase']},
+            },
+            'normalizer': {
+                'lowercase': {'type': 'custom', 'filter': ['lowercase']},
+            },
+        },
+    },
+    'mappings': {
+        'properties': {
+            'id': {'type': 'keyword'},
+            'holding_group_id': {'type': 'keyword'},
+            'album_artist': TEXT_FIELD,
+            'album_title': TEXT_FIELD,
+            'label': TEXT_FIELD,
+            'torrent_hash': {'type': 'keyword', 'normalizer': 'lowercase'},
+            'added_at': {'type': 'date'},
+        },
+    },
+}
+
+
+def contains_query(field, term):
+    # Terms shorter than a trigram produce no ngram tokens, so fall back to a
+    # wildcard over the lowercased keyword
+    if len(term) < 3:
+        return {'wildcard': {field + '.keyword': '*{}*'.format(
+            term.lower().replace('\\', '\\\\').replace('*', '\\*')
+            .replace('?', '\\?'))}}
+    return {'match': {field + '.trigram': {'query': term,
+                                           'operator': 'and'}}}
+
+
+class ElasticsearchBackend(SearchBackend):
+    """
+    Keeps holdings in an Elasticsearch index so that searches do not touch
+    the primary database. The index name is an alias; rebuilds load a fresh
+    index and swap the alias over once it is complete. Writes before the
+    first rebuild create an empty index behind the alias, since writing to
+    a missing name would make Elasticsearch create a plain index with the
+    alias's name.
+    """
+    external = True
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.url = app.config['ELASTICSEARCH_URL'].rstrip('/')
+        self.alias = app.config['ELASTICSEARCH_INDEX']
+        self.timeout = app.config['ELASTICSEARCH_TIMEOUT']
+        self.session = requests.Session()
+        self.index_exists = False
+
+    def _request(self, method, path, **kwargs):
+        r = self.session.request(method, self.url + path,
+                                 timeout=self.timeout, **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+    def _bulk(self, index, lines):
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n'
+        result = self._request('POST', '/{}/_bulk'.format(index), data=body,
+                               headers={'Content-Type': "application/x-ndjson"})
+        if result.get('errors'):
+            raise RuntimeError("Elasticsearch rejected part of a bulk request")
+
+    def search(self, args, page, per_page, count='exact'):
+        filters = []
+        if args.get('any'):
+            should = [contains_query(f, args['any']) for f in SEARCH_FIELDS]
+            should.append({'term': {'torrent_hash': args['any']}})
+            filters.append({'bool': {'should': should,
+                                     'minimum_should_match': 1}})
+        for field in SEARCH_FIELDS:
+            if args.get(field):
+                filters.append(contains_query(field, args[field]))
+        if args.get('torrent_hash'):
+            filters.append({'term': {'torrent_hash': args['torrent_hash']}})
+
+        query = {'bool': {'filter': filters}}
+        sort = [{'added_at': 'desc'}, {'id': 'asc'}]
+        if args.get('q'):
+            query['bool']['must'] = [{'multi_match': {
+                'query': args['q'], 'fields': list(SEARCH_FIELDS),
+                'operator': 'and'}}]
+            sort.insert(0, '_score')
+
+        body = {
+            'query': query,
+            'sort': sort,
+            'from': (page - 1) * per_page,
+            'size': per_page + 1,
+            '_source': False,
+            'track_total_hits': count != 'none',
+        }
+        if count == 'estimate':
+            # Count exactly up to Elasticsearch's default of 10,000 hits and
+            # report that as a lower bound beyond it
+            del body['track_total_hits']
+        result = self._request('POST', '/{}/_search'.format(self.alias),
+                               json=body)
+        hits = result['hits']
+        total = hits['total']['value'] if 'total' in hits else None
+        return [hit['_id'] for hit in hits['hits']], total
+
+    def _index_name(self, suffix):
+        return '{}-{}'.format(self.alias, suffix)
+
+    def _ensure_index(self):
+        if self.index_exists:
+            return
+        r = self.session.head('{}/{}'.format(self.url, self.alias),
+                              timeout=self.timeout)
+        if r.status_code == 404:
+            # Every worker picks the same name, so that the ones that lose
+            # the race find the index already there
+            r = self.session.put(
+                '{}/{}'.format(self.url, self._index_name('initial')),
+                json={**INDEX_BODY, 'aliases': {self.alias: {}}},
+                timeout=self.timeout)
+            if r.status_code != 400 or \
+                    'resource_already_exists' not in r.text:
+                r.raise_for_status()
+        else:
+            r.raise_for_status()
+        self.index_exists = True
+
+    def index_holdings(self, holdings):
+        lines = []
+        for holding in holdings:
+            lines.append({'index': {'_id': holding.id}})
+            lines.append(holding_document(holding))
+        if lines:
+            self._ensure_index()
+            self._bulk(self.alias, lines)
+
+    def remove_holdings(self, ids):
+        lines = [{'delete': {'_id': id}} for id in ids]
+        if lines:
+            self._ensure_index()
+            self._bulk(self.alias, lines)
+
+    def rebuild(self, holdings, batch_size=1000):
+        index = self._index_name(datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+        self._request('PUT', '/' + index, json=INDEX_BODY)
+
+        holdings = iter(holdings)
+        while True:
+            batch = list(islice(holdings, batch_size))
+            if not batch:
+                break
+            lines = []
+            for holding in batch:
+                lines.append({'index': {'_id': holding.id}})
+                lines.append(holding_document(holding))
+            self._bulk(index, lines)
+
+        self._request('POST', '/{}/_refresh'.format(index))
+
+        # The indexes the name resolves to: those behind the alias, or a
+        # plain index of that name left by writes from an older version
+        r = self.session.get('{}/{}/_alias'.format(self.url, self.alias),
+                             timeout=self.timeout)
+        old_indexes = list(r.json()) if r.status_code == 200 else []
+        actions = []
+        for old_index in old_indexes:
+            if old_index == self.alias:
+                actions.append({'remove_index': {'index': old_index}})
+            else:
+                actions.append({'remove': {'index': old_index,
+                                           'alias': self.alias}})
+        actions.append({'add': {'index': index, 'alias': self.alias}})
+        self._request('POST', '/_aliases', json={'actions': actions})
+        for old_index in old_indexes:
+            if old_index != self.alias:
+                self._request('DELETE', '/' + old_index)
+        self.index_exists = True
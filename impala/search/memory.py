@@ -0,0 +1,154 @@
+from collections import defaultdict
+import re
+import threading
+from impala.search import SEARCH_FIELDS, SearchBackend, holding_document, \
+    indexed_holdings
+
+# PostgreSQL's text search parser splits words at underscores as well
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def words(*texts):
+    return set(WORD_RE.findall(' '.join(t for t in texts if t).lower()))
+
+
+class MemorySearchBackend(SearchBackend):
+    """
+    In-process inverted index for tests and small single-process deployments.
+    Substring filters are answered from a per-field trigram index and then
+    verified against the stored document, which gives the same results as the
+    SQL backend's ILIKE filters. The index is loaded from the database on
+    first use; with several worker processes each one holds its own copy and
+    only sees the writes it handled itself.
+    """
+    external = True
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.documents = {}
+        self.trigram_index = defaultdict(set)
+        self.word_index = defaultdict(set)
+        self.hash_index = defaultdict(set)
+
+    def _keys(self, document):
+        for field in SEARCH_FIELDS:
+            value = (document[field] or '').lower()
+            for trigram in trigrams(value):
+                yield self.trigram_index, (field, trigram)
+        for word in document['group_words'] | document['label_words']:
+            yield self.word_index, word
+        if document['torrent_hash']:
+            yield self.hash_index, document['torrent_hash'].lower()
+
+    def _add(self, document):
+        document = dict(document)
+        document['group_words'] = words(document['album_artist'],
+                                        document['album_title'])
+        document['label_words'] = words(document['label'])
+        self._remove(document['id'])
+        self.documents[document['id']] = document
+        for index, key in self._keys(document):
+            index[key].add(document['id'])
+
+    def _remove(self, id):
+        document = self.documents.pop(id, None)
+        if document is None:
+            return
+        for index, key in self._keys(document):
+            index[key].discard(id)
+            if not index[key]:
+                del index[key]
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.rebuild(indexed_holdings().yield_per(1000))
+
+    def _contains(self, field, term):
+        term = term.lower()
+        grams = trigrams(term)
+        if grams:
+            candidates = set.intersection(
+                *(self.trigram_index.get((field, g), set()) for g in grams))
+        else:
+            candidates = self.documents.keys()
+        return {id for id in candidates
+                if term in (self.documents[id][field] or '').lower()}
+
+    def _any(self, term):
+        ids = set(self.hash_index.get(term.lower(), set()))
+        for field in SEARCH_FIELDS:
+            ids |= self._contains(field, term)
+        return ids
+
+    def _text(self, q):
+        tokens = words(q)
+        if not tokens:
+            return {}
+        candidates = set.intersection(
+            *(self.word_index.get(t, set()) for t in tokens))
+        ranks = {}
+        for id in candidates:
+            document = self.documents[id]
+            rank = int(tokens <= document['group_words']) + \
+                int(tokens <= document['label_words'])
+            if rank:
+                ranks[id] = rank
+        return ranks
+
+    def search(self, args, page, per_page, count='exact'):
+        with self.lock:
+            self._ensure_loaded()
+
+            matches = []
+            if args.get('any'):
+                matches.append(self._any(args['any']))
+            for field in SEARCH_FIELDS:
+                if args.get(field):
+                    matches.append(self._contains(field, args[field]))
+            if args.get('torrent_hash'):
+                matches.append(self.hash_index.get(
+                    args['torrent_hash'].lower(), set()))
+            ranks = {}
+            if args.get('q'):
+                ranks = self._text(args['q'])
+                matches.append(set(ranks))
+
+            if matches:
+                ids = sorted(set.intersection(*matches))
+            else:
+                ids = sorted(self.documents)
+            ids.sort(key=lambda id: self.documents[id]['added_at'],
+                     reverse=True)
+            ids.sort(key=lambda id: ranks.get(id, 0), reverse=True)
+
+        start = (page - 1) * per_page
+        return ids[start:start + per_page + 1], len(ids)
+
+    def index_holdings(self, holdings):
+        with self.lock:
+            if not self.loaded:
+                # The initial load will pick these up
+                return
+            for holding in holdings:
+                self._add(holding_document(holding))
+
+    def remove_holdings(self, ids):
+        with self.lock:
+            for id in ids:
+                self._remove(id)
+
+    def rebuild(self, holdings):
+        with self.lock:
+            self.documents.clear()
+            self.trigram_index.clear()
+            self.word_index.clear()
+            self.hash_index.clear()
+            for holding in holdings:
+                self._add(holding_document(holding))
+            self.loaded = True
@@ -0,0 +1,15 @@
+from impala.catalog.models import Holding
+from impala.catalog.search import search_holdings
+from impala.counting import count_total
+from impala.search import SearchBackend
+
+
+class SqlSearchBackend(SearchBackend):
+    """Searches the primary database directly using its trigram and
+    full-text indexes."""
+
+    def search(self, args, page, per_page, count='exact'):
+        query = search_holdings(args).with_entities(Holding.id)
+        ids = [id for id, in query.limit(per_page + 1)
+               .offset((page - 1) * per_page)]
+        return ids, count_total(query, count, page, per_page, len(ids))
@@ -0,0 +1,98 @@
+import os
+import weakref
+
+# Applications whose connection pools are replaced in forked children
+_apps = weakref.WeakSet()
+
+# Pools inherited from the parent. They are kept so that their connections
+# are never garbage collected, which would close them from the child.
+_inherited = []
+
+# The process whose pools _apps hold; they are replaced once in any other
+_pools_pid = os.getpid()
+
+
+def worker_threads():
+    """The number of threads in each uWSGI worker, or None outside uWSGI"""
+    try:
+        import uwsgi
+    except ImportError:
+        return None
+    try:
+        return int(uwsgi.opt.get('threads') or 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def pool_options(config):
+    """
+    Engine options for one worker process: DB_POOL_SIZE connections kept
+    open, or as many as the worker has threads under uWSGI. Sizes set in
+    SQLALCHEMY_ENGINE_OPTIONS win.
+    """
+    options = dict(config['SQLALCHEMY_ENGINE_OPTIONS'])
+    pool_size = config['DB_POOL_SIZE']
+    if pool_size is None:
+        pool_size = worker_threads()
+    if pool_size is not None:
+        options.setdefault('pool_size', pool_size)
+    if config['DB_MAX_OVERFLOW'] is not None:
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    return options
+
+
+def replace_pools(app):
+    """
+    Gives every engine of `app` a new, empty pool. The old pool's
+    connections belong to the parent process, which may still be using
+    them, so they are set aside without being closed.
+    """
+    from impala import db
+    binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+    for bind in binds:
+        engine = db.get_engine(app, bind=bind)
+        _inherited.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+
+
+def _after_fork():
+    global _pools_pid
+    if os.getpid() == _pools_pid:
+        return
+    _pools_pid = os.getpid()
+    for app in list(_apps):
+        replace_pools(app)
+
+
+def preload(app):
+    """
+    Does the work every worker would otherwise repeat on its first requests,
+    so that workers forked from this process share it: compiling the
+    templates and configuring the mappers.
+    """
+    from sqlalchemy import orm
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    orm.configure_mappers()
+
+
+def init_app(app):
+    """
+    Sizes the connection pools for one worker of a preforking server such
+    as uWSGI, and replaces them in each worker after it is forked so that
+    no connection is shared between processes.
+    """
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_options(app.config)
+    _apps.add(app)
+
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass
+else:
+    # uWSGI forks its workers itself, and only runs the hooks registered
+    # with os.register_at_fork when started with --py-call-osafterfork
+    postfork(_after_fork)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,5 @@
+from impala import create_app, metrics, workers
+
+app = create_app(cli=False)
+metrics.clear_shared()
+workers.preload(app)
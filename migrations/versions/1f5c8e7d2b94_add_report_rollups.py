@@ -0,0 +1,61 @@
+"""add report rollups
+
+Revision ID: 1f5c8e7d2b94
+Revises: e47b1c9a3d25
+Create Date: 2026-10-18 21:04:12.661803
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '1f5c8e7d2b94'
+down_revision = 'e47b1c9a3d25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('holding_rollups',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('format_id', postgresql.UUID(), nullable=False),
+    sa.Column('stack_id', postgresql.UUID(), nullable=False),
+    sa.Column('holdings', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('month', 'format_id', 'stack_id')
+    )
+    op.create_table('tag_rollups',
+    sa.Column('tag', sa.String(), nullable=False),
+    sa.Column('holdings', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('tag')
+    )
+    op.create_table('rotation_rollups',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('bin', sa.String(), nullable=False),
+    sa.Column('releases', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('month', 'bin')
+    )
+    op.create_table('review_rollups',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('type', postgresql.ENUM('REVIEW', 'COMMENT', 'TRACK_WARNING', 'OTHER', name='holdingcommenttype', create_type=False), nullable=False),
+    sa.Column('comments', sa.Integer(), nullable=False),
+    sa.Column('ratings', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('month', 'type')
+    )
+    op.create_table('rollup_watermarks',
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('added_at', sa.DateTime(), nullable=False),
+    sa.Column('row_id', postgresql.UUID(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermarks')
+    op.drop_table('review_rollups')
+    op.drop_table('rotation_rollups')
+    op.drop_table('tag_rollups')
+    op.drop_table('holding_rollups')
@@ -0,0 +1,58 @@
+"""add foreign key and sort indexes
+
+Revision ID: 3a2f59e0d4ca
+Revises: 3c9d4b1f27a8
+Create Date: 2026-10-18 14:03:51.207114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a2f59e0d4ca'
+down_revision = '3c9d4b1f27a8'
+branch_labels = None
+depends_on = None
+
+TABLES = ['stacks', 'formats', 'holding_groups', 'holdings',
+          'rotation_releases', 'holding_tags', 'holding_comments', 'tracks',
+          'track_metadata']
+
+FOREIGN_KEYS = [
+    ('holding_groups', 'stack_id'),
+    ('holdings', 'holding_group_id'),
+    ('holdings', 'format_id'),
+    ('rotation_releases', 'holding_id'),
+    ('holding_tags', 'holding_id'),
+    ('holding_comments', 'holding_id'),
+    ('track_metadata', 'track_id'),
+]
+
+
+def upgrade():
+    # Every list endpoint sorts on added_at, and cursors page on
+    # (added_at, id)
+    for table in TABLES:
+        op.create_index('ix_{}_added_at_id'.format(table), table,
+                        ['added_at', 'id'])
+
+    for table, column in FOREIGN_KEYS:
+        op.create_index('ix_{}_{}'.format(table, column), table, [column])
+    op.create_index('ix_tracks_holding_id', 'tracks',
+                    ['holding_id', 'disc_num', 'track_num'])
+
+    # The catalog only lists holding groups that have an active holding
+    op.create_index('ix_holdings_active_holding_group_id', 'holdings',
+                    ['holding_group_id'], postgresql_where=sa.text('active'))
+
+
+def downgrade():
+    op.drop_index('ix_holdings_active_holding_group_id', table_name='holdings')
+
+    op.drop_index('ix_tracks_holding_id', table_name='tracks')
+    for table, column in reversed(FOREIGN_KEYS):
+        op.drop_index('ix_{}_{}'.format(table, column), table_name=table)
+
+    for table in reversed(TABLES):
+        op.drop_index('ix_{}_added_at_id'.format(table), table_name=table)
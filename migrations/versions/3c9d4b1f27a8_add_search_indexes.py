@@ -0,0 +1,53 @@
+"""add search indexes
+
+Revision ID: 3c9d4b1f27a8
+Revises: 50832f43b32a
+Create Date: 2026-10-18 10:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9d4b1f27a8'
+down_revision = '50832f43b32a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # Trigram indexes serve the '%term%' ILIKE filters
+    op.create_index('ix_holding_groups_album_artist_trgm', 'holding_groups',
+                    ['album_artist'], postgresql_using='gin',
+                    postgresql_ops={'album_artist': 'gin_trgm_ops'})
+    op.create_index('ix_holding_groups_album_title_trgm', 'holding_groups',
+                    ['album_title'], postgresql_using='gin',
+                    postgresql_ops={'album_title': 'gin_trgm_ops'})
+    op.create_index('ix_holdings_label_trgm', 'holdings', ['label'],
+                    postgresql_using='gin',
+                    postgresql_ops={'label': 'gin_trgm_ops'})
+    op.create_index('ix_holdings_torrent_hash_lower', 'holdings',
+                    [sa.text('lower(torrent_hash)')])
+
+    # Full-text indexes; the expressions must match impala.catalog.search
+    op.create_index('ix_holding_groups_fts', 'holding_groups',
+                    [sa.text("to_tsvector('simple', album_artist || ' ' || "
+                             "album_title)")],
+                    postgresql_using='gin')
+    op.create_index('ix_holdings_label_fts', 'holdings',
+                    [sa.text("to_tsvector('simple', coalesce(label, ''))")],
+                    postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_holdings_label_fts', table_name='holdings')
+    op.drop_index('ix_holding_groups_fts', table_name='holding_groups')
+    op.drop_index('ix_holdings_torrent_hash_lower', table_name='holdings')
+    op.drop_index('ix_holdings_label_trgm', table_name='holdings')
+    op.drop_index('ix_holding_groups_album_title_trgm',
+                  table_name='holding_groups')
+    op.drop_index('ix_holding_groups_album_artist_trgm',
+                  table_name='holding_groups')
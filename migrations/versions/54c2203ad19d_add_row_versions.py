@@ -0,0 +1,38 @@
+"""add row versions
+
+Revision ID: 54c2203ad19d
+Revises: 3a2f59e0d4ca
+Create Date: 2026-10-18 17:20:06.381925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '54c2203ad19d'
+down_revision = '3a2f59e0d4ca'
+branch_labels = None
+depends_on = None
+
+TABLES = ['stacks', 'formats', 'holding_groups', 'holdings',
+          'rotation_releases', 'holding_tags', 'holding_comments', 'tracks',
+          'track_metadata']
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       nullable=True))
+        op.add_column(table, sa.Column('version', sa.Integer(),
+                                       nullable=False, server_default='1'))
+        # Existing rows have not changed since they were added
+        op.execute('UPDATE {} SET updated_at = added_at'.format(table))
+        op.alter_column(table, 'updated_at', nullable=False,
+                        server_default=sa.func.now())
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_column(table, 'version')
+        op.drop_column(table, 'updated_at')
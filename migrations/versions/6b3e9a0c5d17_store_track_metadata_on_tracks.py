@@ -0,0 +1,136 @@
+"""store track metadata on tracks
+
+Revision ID: 6b3e9a0c5d17
+Revises: 1f5c8e7d2b94
+Create Date: 2026-10-18 22:15:48.204517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '6b3e9a0c5d17'
+down_revision = '1f5c8e7d2b94'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+# Must match impala.catalog.metadata.entry_id()
+ENTRY_ID = """
+CREATE FUNCTION track_metadata_id(track_id uuid, key text, value text)
+RETURNS uuid LANGUAGE sql IMMUTABLE STRICT AS $$
+    SELECT CAST(md5(CAST(track_id AS text) || '/' || length(key) || '/' ||
+                    key || value) AS uuid)
+$$
+"""
+
+ENTRY_IDS = """
+CREATE FUNCTION track_metadata_ids(track_id uuid, metadata jsonb)
+RETURNS uuid[] LANGUAGE sql IMMUTABLE STRICT AS $$
+    SELECT coalesce(array_agg(track_metadata_id(track_id, m.key, v.value)),
+                    '{}')
+    FROM jsonb_each(metadata) m, jsonb_array_elements_text(m.value) v(value)
+$$
+"""
+
+ENTRIES = """
+SELECT track_metadata_id(t.id, m.key, v.value) AS id, t.added_by,
+       t.added_at, t.updated_at, t.version, m.key, v.value, t.id AS track_id
+FROM tracks t, jsonb_each(t.metadata) m,
+     jsonb_array_elements_text(m.value) v(value)
+"""
+
+# Each key's values in the order they were added, without repeats
+FOLD = """
+UPDATE tracks SET metadata = d.document, version = version + 1
+FROM (
+    SELECT track_id, jsonb_object_agg(key, "values") AS document
+    FROM (
+        SELECT track_id, key, jsonb_agg(value ORDER BY added_at, value)
+               AS "values"
+        FROM (
+            SELECT track_id, key, value, min(added_at) AS added_at
+            FROM track_metadata
+            WHERE key <> '' AND track_id > CAST(:after AS uuid)
+              AND track_id <= CAST(:until AS uuid)
+            GROUP BY track_id, key, value
+        ) v
+        GROUP BY track_id, key
+    ) k
+    GROUP BY track_id
+) d
+WHERE tracks.id = d.track_id
+"""
+
+# The last track of the next batch; there is no max(uuid)
+NEXT_BATCH = """
+SELECT track_id FROM (
+    SELECT DISTINCT track_id FROM track_metadata
+    WHERE track_id > CAST(:after AS uuid)
+    ORDER BY track_id LIMIT :batch_size
+) b
+ORDER BY track_id DESC LIMIT 1
+"""
+
+
+def upgrade():
+    op.add_column('tracks', sa.Column(
+        'metadata', postgresql.JSONB(astext_type=sa.Text()), nullable=False,
+        server_default='{}'))
+    op.execute(ENTRY_ID)
+    op.execute(ENTRY_IDS)
+
+    # A batch of tracks at a time, so that no one statement has to
+    # aggregate every row of track_metadata
+    connection = op.get_bind()
+    after = '00000000-0000-0000-0000-000000000000'
+    while True:
+        until = connection.execute(sa.text(NEXT_BATCH), after=after,
+                                   batch_size=BATCH_SIZE).scalar()
+        if until is None:
+            break
+        connection.execute(sa.text(FOLD), after=after, until=until)
+        after = until
+
+    op.drop_table('track_metadata')
+    op.execute('CREATE VIEW track_metadata AS ' + ENTRIES)
+
+    op.create_index('ix_tracks_metadata', 'tracks', ['metadata'],
+                    postgresql_using='gin')
+    # Finds the track holding a value of the view by its id. The expression
+    # must match impala.catalog.metadata.entry_ids()
+    op.create_index('ix_tracks_metadata_ids', 'tracks',
+                    [sa.text('track_metadata_ids(id, metadata)')],
+                    postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_tracks_metadata_ids', table_name='tracks')
+    op.drop_index('ix_tracks_metadata', table_name='tracks')
+    op.execute('DROP VIEW track_metadata')
+
+    op.create_table('track_metadata',
+    sa.Column('id', postgresql.UUID(), nullable=False),
+    sa.Column('added_by', sa.String(), nullable=False),
+    sa.Column('added_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('value', sa.Text(), nullable=False),
+    sa.Column('track_id', postgresql.UUID(), nullable=False),
+    sa.ForeignKeyConstraint(['track_id'], ['tracks.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO track_metadata (id, added_by, added_at, '
+               'updated_at, version, key, value, track_id) ' + ENTRIES)
+    op.create_index('ix_track_metadata_added_at_id', 'track_metadata',
+                    ['added_at', 'id'])
+    op.create_index('ix_track_metadata_track_id', 'track_metadata',
+                    ['track_id'])
+
+    op.execute('DROP FUNCTION track_metadata_ids(uuid, jsonb)')
+    op.execute('DROP FUNCTION track_metadata_id(uuid, text, text)')
+    op.drop_column('tracks', 'metadata')
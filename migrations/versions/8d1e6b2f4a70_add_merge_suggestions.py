@@ -0,0 +1,78 @@
+"""add merge suggestions
+
+Revision ID: 8d1e6b2f4a70
+Revises: 54c2203ad19d
+Create Date: 2026-10-18 19:02:44.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1e6b2f4a70'
+down_revision = '54c2203ad19d'
+branch_labels = None
+depends_on = None
+
+# Shared by all three tables, so it is created once up front
+dedup_kind = postgresql.ENUM('HOLDING_GROUP', 'HOLDING', name='dedupkind',
+                             create_type=False)
+suggestion_status = postgresql.ENUM('PENDING', 'ACCEPTED', 'REJECTED',
+                                    name='mergesuggestionstatus',
+                                    create_type=False)
+
+
+def upgrade():
+    dedup_kind.create(op.get_bind(), checkfirst=True)
+    suggestion_status.create(op.get_bind(), checkfirst=True)
+
+    op.create_table('merge_suggestions',
+    sa.Column('id', postgresql.UUID(), nullable=False),
+    sa.Column('added_by', sa.String(), nullable=False),
+    sa.Column('added_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('kind', dedup_kind, nullable=False),
+    sa.Column('keep_id', postgresql.UUID(), nullable=False),
+    sa.Column('duplicate_id', postgresql.UUID(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('reasons', postgresql.ARRAY(sa.String()), nullable=False),
+    sa.Column('status', suggestion_status, nullable=False),
+    sa.Column('reviewed_by', sa.String(), nullable=True),
+    sa.Column('reviewed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'keep_id', 'duplicate_id')
+    )
+    op.create_index('ix_merge_suggestions_status_score', 'merge_suggestions',
+                    ['status', 'score'])
+    op.create_index('ix_merge_suggestions_added_at_id', 'merge_suggestions',
+                    ['added_at', 'id'])
+
+    op.create_table('dedup_keys',
+    sa.Column('kind', dedup_kind, nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('row_id', postgresql.UUID(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'key', 'row_id')
+    )
+
+    op.create_table('dedup_watermarks',
+    sa.Column('kind', dedup_kind, nullable=False),
+    sa.Column('added_at', sa.DateTime(), nullable=False),
+    sa.Column('row_id', postgresql.UUID(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('kind')
+    )
+
+
+def downgrade():
+    op.drop_table('dedup_watermarks')
+    op.drop_table('dedup_keys')
+    op.drop_index('ix_merge_suggestions_added_at_id',
+                  table_name='merge_suggestions')
+    op.drop_index('ix_merge_suggestions_status_score',
+                  table_name='merge_suggestions')
+    op.drop_table('merge_suggestions')
+    suggestion_status.drop(op.get_bind(), checkfirst=True)
+    dedup_kind.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,38 @@
+"""add rotation period index
+
+Revision ID: e47b1c9a3d25
+Revises: 8d1e6b2f4a70
+Create Date: 2026-10-18 20:11:37.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e47b1c9a3d25'
+down_revision = '8d1e6b2f4a70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # An inverted period was never in rotation; an empty one says the same
+    # thing and is a valid range
+    op.execute('UPDATE rotation_releases SET stop = start '
+               'WHERE stop < start')
+    op.create_check_constraint('ck_rotation_releases_period',
+                               'rotation_releases',
+                               'stop IS NULL OR stop >= start')
+
+    # The expression must match impala.catalog.rotation.period()
+    op.create_index('ix_rotation_releases_period', 'rotation_releases',
+                    [sa.text('tsrange(start, stop)')],
+                    postgresql_using='gist')
+
+
+def downgrade():
+    op.drop_index('ix_rotation_releases_period',
+                  table_name='rotation_releases')
+    op.drop_constraint('ck_rotation_releases_period', 'rotation_releases',
+                       type_='check')
@@ -0,0 +1,187 @@
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from impala import create_app, db
+from impala.catalog import models
+
+# Tests that need PostgreSQL run against the empty database named here,
+# which they migrate and truncate, and are skipped if it is not set
+DATABASE_URI = os.environ.get('TEST_DATABASE_URI')
+# A second database with the same schema that stands in for a read replica
+REPLICA_DATABASE_URI = os.environ.get('TEST_REPLICA_DATABASE_URI')
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          'migrations')
+
+TEST_CONFIG = {
+    'TESTING': True,
+    'SECRET_KEY': 'test',
+    'SQLALCHEMY_DATABASE_URI': DATABASE_URI,
+    'SEARCH_BACKEND': 'sql',
+    'SLOW_REQUEST_THRESHOLD': None,
+}
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', "config(**values): application config for the test")
+
+
+def migrate(uri):
+    from flask_migrate import upgrade
+    app = create_app({**TEST_CONFIG, 'SQLALCHEMY_DATABASE_URI': uri})
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+
+
+def truncate(engine):
+    tables = ', '.join(table.name for table in db.metadata.sorted_tables)
+    with engine.begin() as connection:
+        connection.execute('TRUNCATE {} CASCADE'.format(tables))
+
+
+@pytest.fixture(scope='session')
+def database():
+    if not DATABASE_URI:
+        pytest.skip("TEST_DATABASE_URI is not set")
+    migrate(DATABASE_URI)
+    return DATABASE_URI
+
+
+@pytest.fixture(scope='session')
+def replica_database(database):
+    if not REPLICA_DATABASE_URI:
+        pytest.skip("TEST_REPLICA_DATABASE_URI is not set")
+    migrate(REPLICA_DATABASE_URI)
+    return REPLICA_DATABASE_URI
+
+
+@pytest.fixture
+def make_app(database):
+    """Builds an application on the emptied test database"""
+    def make_app(**config):
+        app = create_app({**TEST_CONFIG, **config}, cli=False)
+        with app.app_context():
+            truncate(db.engine)
+        return app
+    return make_app
+
+
+@pytest.fixture
+def app(request, make_app):
+    marker = request.node.get_closest_marker('config')
+    # No application context is kept pushed, so that each request gets its
+    # own session as it would in production
+    return make_app(**(marker.kwargs if marker else {}))
+
+
+def login(client, access=('librarian',)):
+    with client.session_transaction() as session:
+        session['username'] = 'test'
+        session['access'] = list(access)
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return login(app.test_client())
+
+
+@pytest.fixture
+def http_server():
+    """
+    Serves requests with a http.server handler class on a local port in a
+    background thread, and returns the base URL
+    """
+    servers = []
+
+    def http_server(handler_class):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    yield http_server
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def before_cursor_execute(self, *args):
+        self.count += 1
+
+
+@pytest.fixture
+def count_queries():
+    """Counts the statements run on any engine inside the `with` block"""
+    @contextmanager
+    def count_queries():
+        counter = QueryCounter()
+        event.listen(Engine, 'before_cursor_execute',
+                     counter.before_cursor_execute)
+        try:
+            yield counter
+        finally:
+            event.remove(Engine, 'before_cursor_execute',
+                         counter.before_cursor_execute)
+    return count_queries
+
+
+def new_row(model, **values):
+    row = model(id=str(uuid.uuid4()), added_by='test',
+                added_at=values.pop('added_at', datetime.now()), **values)
+    db.session.add(row)
+    return row
+
+
+@pytest.fixture
+def catalog(app):
+    """
+    Adds `groups` holding groups to the database, newest last, each with
+    `holdings` holdings carrying `tags` tags and a current rotation release.
+    Returns the ids of the groups.
+    """
+    state = {}
+
+    def catalog(groups, holdings=1, tags=1, artist='Artist'):
+        with app.app_context():
+            return add_groups(groups, holdings, tags, artist)
+
+    def add_groups(groups, holdings, tags, artist):
+        if not state:
+            state['stack'] = new_row(models.Stack, name='Library').id
+            state['format'] = new_row(models.Format, name='FLAC',
+                                      physical=False).id
+            state['added_at'] = datetime.now() - timedelta(days=1)
+        result = []
+        for i in range(groups):
+            state['added_at'] += timedelta(seconds=1)
+            group = new_row(models.HoldingGroup,
+                            added_at=state['added_at'],
+                            album_title='Album {}'.format(i),
+                            album_artist='{} {}'.format(artist, i),
+                            stack_id=state['stack'])
+            for j in range(holdings):
+                holding = new_row(models.Holding, label='Label {}'.format(j),
+                                  holding_group_id=group.id,
+                                  format_id=state['format'])
+                for k in range(tags):
+                    new_row(models.HoldingTag, tag='tag {}'.format(k),
+                            holding_id=holding.id)
+                new_row(models.RotationRelease, bin='H',
+                        start=datetime.now() - timedelta(days=1),
+                        holding_id=holding.id)
+            result.append(group.id)
+        db.session.commit()
+        return result
+    return catalog
@@ -0,0 +1,52 @@
+from datetime import datetime
+import pytest
+from impala import db
+from impala.catalog import models
+from conftest import new_row
+
+
+@pytest.mark.config(FRAGMENT_CACHE_ENABLED=False)
+@pytest.mark.parametrize('path', [
+    '/holdings?count=exact',
+    '/search?album_artist=Artist&count=exact',
+])
+def test_page_query_count_does_not_grow_with_data(client, catalog,
+                                                  count_queries, path):
+    def page_queries():
+        # The first request fills the per-process caches, such as the
+        # current rotation; the second shows the steady state
+        assert client.get(path).status_code == 200
+        with count_queries() as counter:
+            assert client.get(path).status_code == 200
+        return counter.count
+
+    catalog(30, holdings=1, tags=1)
+    small = page_queries()
+    catalog(60, holdings=4, tags=5)
+    large = page_queries()
+    assert small == large
+
+
+def test_cards_follow_writes_made_elsewhere(app, client, catalog):
+    # Written straight to the database, as another worker or an import
+    # would, so that nothing in this process hears of the changes
+    [group_id] = catalog(1, tags=1)
+    assert b'tag 0' in client.get('/holdings').data
+
+    with app.app_context():
+        holding = models.Holding.query.filter_by(
+            holding_group_id=group_id).one()
+        tag = new_row(models.HoldingTag, tag='added elsewhere',
+                      holding_id=holding.id)
+        db.session.commit()
+        tag_id = tag.id
+    assert b'added elsewhere' in client.get('/holdings').data
+
+    with app.app_context():
+        models.Format.query.update({'name': 'Renamed format',
+                                    'updated_at': datetime.now()})
+        models.HoldingTag.query.filter_by(id=tag_id).delete()
+        db.session.commit()
+    page = client.get('/holdings').data
+    assert b'Renamed format' in page
+    assert b'added elsewhere' not in page
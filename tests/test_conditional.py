@@ -0,0 +1,80 @@
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from werkzeug.http import http_date, parse_date
+from impala import db
+from impala.catalog import models
+from conftest import new_row
+
+
+@pytest.fixture
+def stack_ids(app):
+    with app.app_context():
+        ids = [new_row(models.Stack, name='Stack {}'.format(i)).id
+               for i in range(3)]
+        db.session.commit()
+    return ids
+
+
+@pytest.fixture
+def local_time(monkeypatch):
+    """Runs the test five hours behind UTC"""
+    monkeypatch.setenv('TZ', 'EST+5')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_repeat_requests_are_not_modified(client, stack_ids):
+    for url in ['/api/v1/stacks/' + stack_ids[0], '/api/v1/stacks']:
+        etag = client.get(url).headers['ETag']
+        resp = client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+        assert resp.headers['ETag'] == etag
+
+
+def test_updates_change_the_etag(client, stack_ids):
+    url = '/api/v1/stacks/' + stack_ids[0]
+    etag = client.get(url).headers['ETag']
+    resp = client.patch(url, json={'name': 'Renamed'},
+                        headers={'If-Match': etag})
+    assert resp.status_code == 200
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
+    assert client.get(url).headers['ETag'] != etag
+
+    resp = client.patch(url, json={'name': 'Again'},
+                        headers={'If-Match': etag})
+    assert resp.status_code == 412
+    assert client.get(url).get_json()['name'] == 'Renamed'
+
+
+def test_list_etags_change_with_the_rows(app, client, stack_ids):
+    def etag():
+        return client.get('/api/v1/stacks').headers['ETag']
+
+    before = etag()
+    resp = client.put('/api/v1/stacks', json={'name': 'Another'})
+    assert resp.status_code == 201
+    inserted = etag()
+    assert inserted != before
+
+    with app.app_context():
+        models.Stack.query.filter_by(id=stack_ids[0]).delete()
+        db.session.commit()
+    assert etag() not in (before, inserted)
+
+
+def test_last_modified_is_in_utc(client, stack_ids, local_time):
+    url = '/api/v1/stacks/' + stack_ids[0]
+    client.patch(url, json={'name': 'Renamed'})
+    modified = parse_date(client.get(url).headers['Last-Modified'])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert abs(modified - now) < timedelta(minutes=1)
+
+    since = http_date(modified)
+    resp = client.get(url, headers={'If-Modified-Since': since})
+    assert resp.status_code == 304
+    since = http_date(modified - timedelta(minutes=1))
+    resp = client.get(url, headers={'If-Modified-Since': since})
+    assert resp.status_code == 200
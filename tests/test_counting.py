@@ -0,0 +1,83 @@
+import time
+import uuid
+from types import SimpleNamespace
+import pytest
+from impala import counting, db
+from impala.catalog import models
+from conftest import new_row
+
+
+@pytest.fixture
+def stacks(app):
+    with app.app_context():
+        for i in range(5):
+            new_row(models.Stack, name='Stack {}'.format(i))
+        db.session.commit()
+        db.session.execute('ANALYZE stacks')
+        db.session.commit()
+
+
+def page(client, count, page=1, limit=2, url='/api/v1/stacks'):
+    resp = client.get('{}?page={}&limit={}&count={}'.format(url, page, limit,
+                                                            count))
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_exact_and_none(client, stacks):
+    body = page(client, 'exact')
+    assert (body['total'], body['pages'], body['has_more']) == (5, 3, True)
+    body = page(client, 'none')
+    assert (body['total'], body['pages'], body['has_more']) == \
+        (None, None, True)
+    assert body['count'] == 'none'
+
+
+def test_cached_totals_are_reused(app, client, stacks, monkeypatch):
+    clock = SimpleNamespace(now=time.monotonic())
+    monkeypatch.setattr(counting, 'time',
+                        SimpleNamespace(monotonic=lambda: clock.now))
+    assert page(client, 'cached')['total'] == 5
+    with app.app_context():
+        new_row(models.Stack, name='Another')
+        db.session.commit()
+    assert page(client, 'cached')['total'] == 5
+    assert page(client, 'exact')['total'] == 6
+    # Another page of the same query shares its total
+    assert page(client, 'cached', page=2)['total'] == 5
+
+    clock.now += app.config['COUNT_CACHE_TTL']
+    assert page(client, 'cached')['total'] == 6
+
+
+def test_estimate(client, stacks):
+    assert page(client, 'estimate')['total'] == 5
+
+
+def test_estimate_of_a_filtered_query(app, client):
+    # The status filter is an Enum, which the driver cannot take as is
+    with app.app_context():
+        for score in (0.9, 0.95, 1.0):
+            new_row(models.MergeSuggestion,
+                    kind=models.DedupKind.HOLDING_GROUP,
+                    keep_id=str(uuid.uuid4()), duplicate_id=str(uuid.uuid4()),
+                    score=score, reasons=[],
+                    status=models.MergeSuggestionStatus.PENDING)
+        db.session.commit()
+    body = page(client, 'estimate', limit=1,
+                url='/api/v1/merge_suggestions')
+    assert body['total'] >= 2
+    assert body['has_more'] is True
+
+
+def test_last_page_is_not_counted(client, stacks, count_queries):
+    # Reading one row past the page tells whether it is the last one
+    body = page(client, 'none', page=3)
+    assert (body['total'], body['pages'], body['has_more']) == (5, 3, False)
+    assert page(client, 'none', limit=10)['total'] == 5
+
+    with count_queries() as middle:
+        page(client, 'exact', page=2)
+    with count_queries() as last:
+        page(client, 'exact', page=3)
+    assert last.count == middle.count - 1
@@ -0,0 +1,130 @@
+import json
+import os
+from http.server import BaseHTTPRequestHandler
+import pytest
+from impala.catalog.coverart import CoverArtCache, CoverArtError, \
+    CoverArtMissing
+
+IMAGE = b'\x89PNG not really'
+
+
+class Archive:
+    """Serves Cover Art Archive listings and images from `listings`"""
+    def __init__(self):
+        self.listings = {}
+        self.requests = []
+
+    def handler(self):
+        archive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                archive.requests.append(self.path)
+                if self.path.startswith('/image/'):
+                    self.respond(200, IMAGE, 'image/png')
+                elif self.path in archive.listings:
+                    self.respond(200, archive.listings[self.path],
+                                 'application/json')
+                else:
+                    self.respond(404, b'', 'text/plain')
+
+            def respond(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def add(self, mbid, listing, base_url):
+        if not isinstance(listing, bytes):
+            listing = json.dumps(listing).replace(
+                '{base_url}', base_url).encode()
+        self.listings['/release/{}/'.format(mbid)] = listing
+
+
+def listing(name):
+    return {'images': [{
+        'front': True,
+        'image': '{base_url}/image/' + name,
+        'thumbnails': {'small': '{base_url}/image/' + name + '-250',
+                       'large': '{base_url}/image/' + name + '-500'},
+    }]}
+
+
+@pytest.fixture
+def archive(http_server, tmp_path):
+    archive = Archive()
+    base_url = http_server(archive.handler())
+
+    def add(mbid, listing):
+        archive.add(mbid, listing, base_url)
+
+    cache = CoverArtCache(str(tmp_path), max_bytes=10 * len(IMAGE),
+                          negative_ttl=60, timeout=5, base_url=base_url)
+    return archive, add, cache
+
+
+def test_images_are_fetched_once(archive):
+    archive, add, cache = archive
+    add('a', listing('a'))
+    for _ in range(2):
+        f, meta = cache.get('release', 'a', 250)
+        with f:
+            assert f.read() == IMAGE
+        assert meta['content_type'] == 'image/png'
+    assert archive.requests == ['/release/a/', '/image/a-250']
+
+
+def test_missing_images_are_remembered(archive):
+    archive, add, cache = archive
+    for _ in range(2):
+        with pytest.raises(CoverArtMissing):
+            cache.get('release', 'b', 250)
+    assert archive.requests == ['/release/b/']
+
+
+@pytest.mark.parametrize('body', [
+    b'<html>Service Unavailable</html>',
+    json.dumps({'images': [{'front': True}]}).encode(),
+    json.dumps(['not', 'a', 'listing']).encode(),
+])
+def test_malformed_listings_are_errors_and_not_remembered(archive, body):
+    archive, add, cache = archive
+    add('c', body)
+    with pytest.raises(CoverArtError):
+        cache.get('release', 'c', 250)
+    add('c', listing('c'))
+    f, meta = cache.get('release', 'c', 250)
+    f.close()
+
+
+def test_malformed_listing_is_a_bad_gateway(http_server, make_app, tmp_path):
+    archive = Archive()
+    base_url = http_server(archive.handler())
+    archive.add('d', b'not json', base_url)
+    app = make_app(COVERART_BASE_URL=base_url,
+                   COVERART_CACHE_DIR=str(tmp_path))
+    resp = app.test_client().get('/coverartarchive/release/d/250')
+    assert resp.status_code == 502
+
+
+def test_eviction_leaves_lock_files(archive, tmp_path):
+    archive, add, cache = archive
+    for i in range(20):
+        mbid = 'e{}'.format(i)
+        add(mbid, listing(mbid))
+        cache.get('release', mbid, 250)[0].close()
+    cache.evict()
+
+    # Leaving out evict.lock at the top of the directory
+    names = [name for _, _, files in os.walk(str(tmp_path))
+             for name in files if name != 'evict.lock']
+    images = [name for name in names if '.' not in name]
+    locks = [name for name in names if name.endswith('.lock')]
+    assert len(images) * len(IMAGE) <= cache.max_bytes
+    assert len(locks) == 20
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+import pytest
+from impala import db, dedup
+from impala.catalog import models
+from conftest import new_row
+
+GROUP = models.DedupKind.HOLDING_GROUP
+
+
+@pytest.fixture
+def add_groups(app):
+    """Adds holding groups named by (artist, title) pairs, oldest first"""
+    state = {'added_at': datetime.now() - timedelta(days=1)}
+
+    def add_groups(*names):
+        with app.app_context():
+            if 'stack' not in state:
+                state['stack'] = new_row(models.Stack, name='Library').id
+            ids = []
+            for artist, title in names:
+                state['added_at'] += timedelta(seconds=1)
+                ids.append(new_row(models.HoldingGroup,
+                                   added_at=state['added_at'],
+                                   album_artist=artist, album_title=title,
+                                   stack_id=state['stack']).id)
+            db.session.commit()
+            return ids
+    return add_groups
+
+
+def run(app):
+    with app.app_context():
+        return dedup.run([GROUP])[GROUP]
+
+
+def suggested_pairs(app):
+    with app.app_context():
+        return {(row.keep_id, row.duplicate_id)
+                for row in models.MergeSuggestion.query}
+
+
+def test_near_duplicates_are_suggested(app, add_groups):
+    ids = add_groups(('Radiohead', 'OK Computer'),
+                     ('Slint', 'Spiderland'),
+                     ('The Beatles', 'Abbey Road'),
+                     ('Radiohed', 'OK Computer'),
+                     ('Slint', 'Tweez'),
+                     ('Beatles', 'Abbey Road (Remastered Edition)'),
+                     ('Neu', 'Neu 75'),
+                     ('Neu', 'Neu 2'))
+    assert run(app) == (8, 2)
+    # Tweez shares a MinHash band with Spiderland but scores too low, and
+    # differently numbered titles are never the same album
+    assert suggested_pairs(app) == {(ids[0], ids[3]), (ids[2], ids[5])}
+
+
+@pytest.mark.parametrize('min_score, suggested', [(0.85, 0), (0.8, 1)])
+def test_pairs_below_the_minimum_score_are_not_suggested(
+        app, add_groups, min_score, suggested):
+    # These score 0.84
+    add_groups(('Radiohead', 'OK Computer'),
+               ('Radiohead', 'OK Computer OKNOTOK'))
+    with app.app_context():
+        deduplicator = dedup.Deduplicator(GROUP, batch_size=10,
+                                          min_score=min_score, max_bucket=50)
+        assert deduplicator.run() == (2, suggested)
+
+
+@pytest.mark.config(DEDUP_BATCH_SIZE=2)
+def test_runs_resume_from_the_watermark(app, add_groups):
+    ids = add_groups(('Television', 'Marquee Moon'),
+                     ('Television', 'Marquee Moon'),
+                     ('Can', 'Tago Mago'))
+    assert run(app) == (3, 1)
+    assert run(app) == (0, 0)
+
+    # A new row is only compared with the rows before it once
+    ids += add_groups(('Can', 'Tago Mago'))
+    assert run(app) == (1, 1)
+    assert suggested_pairs(app) == {(ids[0], ids[1]), (ids[2], ids[3])}
+
+    # and starting over does not repeat the suggestions already made
+    with app.app_context():
+        assert dedup.run([GROUP], rebuild=True)[GROUP] == (4, 0)
+    assert len(suggested_pairs(app)) == 2
+
+
+def test_suggestions_are_reviewed(client, add_groups):
+    add_groups(('Television', 'Marquee Moon'),
+               ('Television', 'Marquee Moon'))
+    run(client.application)
+    id = client.get('/api/v1/merge_suggestions').get_json()['results'][0][
+        'id']
+    url = '/api/v1/merge_suggestions/' + id
+
+    resp = client.get(url)
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    resp = client.patch(url, json={'status': 'bogus'},
+                        headers={'If-Match': etag})
+    assert resp.status_code == 400
+    resp = client.patch(url, json={'status': 'rejected'},
+                        headers={'If-Match': etag})
+    assert resp.status_code == 200
+    # The review changed the suggestion, so the old ETag no longer matches
+    resp = client.patch(url, json={'status': 'accepted'},
+                        headers={'If-Match': etag})
+    assert resp.status_code == 412
+
+    resp = client.get(url)
+    assert resp.headers['ETag'] != etag
+    body = resp.get_json()
+    assert body['status'] == 'REJECTED'
+    assert body['version'] == 2
+    assert body['reviewed_by'] == 'test'
@@ -0,0 +1,105 @@
+import uuid
+import pytest
+from impala import db
+from impala.catalog import models
+from conftest import new_row
+
+
+@pytest.fixture
+def refs(app):
+    """Returns the ids of a stack and a format for albums to refer to"""
+    with app.app_context():
+        refs = {'stack_id': new_row(models.Stack, name='Library').id,
+                'format_id': new_row(models.Format, name='FLAC',
+                                     physical=False).id}
+        db.session.commit()
+    return refs
+
+
+def album(refs, tracks=2, **holding):
+    return {
+        'album_title': 'Spiderland', 'album_artist': 'Slint',
+        'stack_id': refs['stack_id'],
+        'holdings': [{
+            'format_id': refs['format_id'], 'label': 'Touch and Go',
+            'tracks': [{'title': 'Track {}'.format(i), 'artist': 'Slint',
+                        'track_num': i + 1,
+                        'track_metadata': [{'key': 'genre',
+                                            'value': 'Post-rock'}]}
+                       for i in range(tracks)],
+            'holding_tags': [{'tag': 'post-rock'}],
+            'holding_comments': [{'reviewer_fullname': 'DJ', 'rating': 5,
+                                  'type': 'REVIEW'}],
+            'rotation_releases': [{'start': '2026-01-01T00:00:00',
+                                   'bin': 'H'}],
+            **holding,
+        }],
+    }
+
+
+def counts(app):
+    with app.app_context():
+        return {model.__tablename__: model.query.count() for model in [
+            models.HoldingGroup, models.Holding, models.Track,
+            models.HoldingTag, models.HoldingComment,
+            models.RotationRelease]}
+
+
+def test_album_is_added_with_its_children(app, client, refs):
+    resp = client.put('/api/v1/albums', json=album(refs))
+    assert resp.status_code == 201
+    body = resp.get_json()
+    assert counts(app) == {'holding_groups': 1, 'holdings': 1, 'tracks': 2,
+                           'holding_tags': 1, 'holding_comments': 1,
+                           'rotation_releases': 1}
+    ids = body['ids']
+    assert ids['holding_groups'] == [body['id']]
+    assert len(ids['track_metadata']) == 2
+
+    with app.app_context():
+        holding = models.Holding.query.get(ids['holdings'][0])
+        assert holding.holding_group_id == body['id']
+        assert holding.added_by == 'test'
+        track = models.Track.query.get(ids['tracks'][1])
+        assert track.holding_id == holding.id
+        assert track.metadata_ == {'genre': ['Post-rock']}
+    resp = client.get('/api/v1/track_metadata/' + ids['track_metadata'][1])
+    assert resp.get_json()['value'] == 'Post-rock'
+
+
+def test_every_invalid_record_is_reported(app, client, refs):
+    document = album(refs, tracks=3, holding_tags='post-rock')
+    tracks = document['holdings'][0]['tracks']
+    tracks[0]['track_num'] = 'one'
+    del tracks[2]['title']
+    tracks[2]['track_metadata'].append({'key': 'mood'})
+    document['holdings'].append('not a holding')
+
+    resp = client.put('/api/v1/albums', json=document)
+    assert resp.status_code == 400
+    path = 'holding_group.holdings[0].'
+    assert set(resp.get_json()['errors']) == {
+        path + 'tracks[0].track_num',
+        path + 'tracks[2].title',
+        path + 'tracks[2].track_metadata[1].value',
+        path + 'holding_tags',
+        'holding_group.holdings[1]',
+    }
+    assert set(counts(app).values()) == {0}
+
+
+def test_conflict_rolls_back_the_whole_album(app, client, refs):
+    resp = client.put('/api/v1/albums', json=album(refs))
+    track_id = resp.get_json()['ids']['tracks'][0]
+    before = counts(app)
+
+    # Tracks are inserted after the group and holding they belong to
+    document = album(refs)
+    document['holdings'][0]['tracks'][1]['id'] = track_id
+    resp = client.put('/api/v1/albums', json=document)
+    assert resp.status_code == 409
+    assert resp.get_json()['table'] == 'tracks'
+    assert counts(app) == before
+
+    document['holdings'][0]['tracks'][1]['id'] = str(uuid.uuid4())
+    assert client.put('/api/v1/albums', json=document).status_code == 201
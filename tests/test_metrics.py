@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+# Run in processes of their own, as prometheus_client chooses where to keep
+# the metrics when it is first imported
+WORKER = """
+from impala import create_app
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///unused'},
+                 cli=False)
+client = app.test_client()
+for _ in range(int(sys.argv[1])):
+    client.get('/nowhere')
+sys.stdout.write(client.get('/metrics').data.decode())
+"""
+
+REQUESTS = 'impala_http_requests_total{endpoint="unmatched",method="GET",' \
+    'status="404"}'
+
+
+def test_metrics_are_only_served_to_allowed_networks(client):
+    resp = client.get('/metrics',
+                      environ_base={'REMOTE_ADDR': '203.0.113.7'})
+    assert resp.status_code == 403
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert b'impala_http_request_duration_seconds_bucket' in resp.data
+
+
+def test_metrics_add_up_across_processes(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path),
+               PYTHONPATH=os.pathsep.join(sys.path))
+
+    def worker(requests):
+        return subprocess.run(
+            [sys.executable, '-c', 'import sys\n' + WORKER, str(requests)],
+            env=env, check=True, stdout=subprocess.PIPE,
+            universal_newlines=True).stdout
+
+    worker(2)
+    worker(3)
+    lines = worker(0).splitlines()
+    assert REQUESTS + ' 5.0' in lines
@@ -0,0 +1,182 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+import jwt
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from impala import create_app
+from impala.api.v1 import oidc
+
+CLIENT_ID = 'impala'
+
+
+def new_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                    backend=default_backend())
+
+
+class Issuer:
+    """Serves a discovery document and JWKS for the keys in `keys`"""
+    def __init__(self):
+        self.keys = {}
+        self.requests = []
+        self.status = 200
+        self.delay = 0
+
+    def handler(self):
+        issuer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                issuer.requests.append(self.path)
+                time.sleep(issuer.delay)
+                if issuer.status != 200:
+                    self.respond(issuer.status, {})
+                elif self.path == '/.well-known/openid-configuration':
+                    self.respond(200, {'issuer': issuer.url,
+                                       'jwks_uri': issuer.url + '/jwks'})
+                elif self.path == '/jwks':
+                    self.respond(200, {'keys': [
+                        dict(json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(
+                            key.public_key())), kid=kid)
+                        for kid, key in issuer.keys.items()]})
+                else:
+                    self.respond(404, {})
+
+            def respond(self, status, document):
+                body = json.dumps(document).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def token(self, kid, **claims):
+        claims = {'iss': self.url, 'aud': CLIENT_ID, 'sub': 'dj',
+                  'exp': int(time.time()) + 60, **claims}
+        return jwt.encode(claims, self.keys[kid], algorithm='RS256',
+                          headers={'kid': kid}).decode('ascii')
+
+
+@pytest.fixture
+def issuer(http_server):
+    issuer = Issuer()
+    issuer.keys['k1'] = new_key()
+    issuer.url = http_server(issuer.handler())
+    return issuer
+
+
+@pytest.fixture
+def oidc_app(issuer):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'postgresql:///unused',
+        'ENABLE_OIDC': True,
+        'OIDC_ISSUER': issuer.url,
+        'OIDC_CLIENT_ID': CLIENT_ID,
+        'OIDC_LIBRARIAN_GROUPS': ['librarians'],
+        'OIDC_DISCOVERY_TTL': 1000,
+        'OIDC_JWKS_TTL': 100,
+        'OIDC_JWKS_REFRESH_INTERVAL': 30,
+        'OIDC_HTTP_TIMEOUT': 0.5,
+    }, cli=False)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The time as the key cache sees it, moved on with clock.now += ..."""
+    clock = SimpleNamespace(now=time.time())
+    monkeypatch.setattr(oidc, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+DISCOVERY = '/.well-known/openid-configuration'
+
+
+def test_documents_are_reused_within_their_ttl(oidc_app, issuer, clock):
+    cache = oidc.get_key_cache()
+    for _ in range(3):
+        assert cache.get_key('k1') is not None
+    assert issuer.requests == [DISCOVERY, '/jwks']
+
+    clock.now += 101
+    cache.get_key('k1')
+    assert issuer.requests == [DISCOVERY, '/jwks', '/jwks']
+
+    clock.now += 1000
+    cache.get_key('k1')
+    assert issuer.requests == [DISCOVERY, '/jwks', '/jwks', DISCOVERY,
+                               '/jwks']
+
+
+def test_unknown_kid_refreshes_once_per_interval(oidc_app, issuer, clock):
+    cache = oidc.get_key_cache()
+    cache.get_key('k1')
+    del issuer.requests[:]
+
+    clock.now += 31
+    assert cache.get_key('k2') is None
+    assert issuer.requests == ['/jwks']
+    # Bogus key ids do not reach the issuer again until the interval is up
+    issuer.keys['k2'] = new_key()
+    clock.now += 29
+    assert cache.get_key('k2') is None
+    assert cache.get_key('k3') is None
+    assert issuer.requests == ['/jwks']
+
+    clock.now += 1
+    assert cache.get_key('k2') is not None
+    assert issuer.requests == ['/jwks', '/jwks']
+
+
+@pytest.mark.parametrize('failure', [{'status': 503}, {'delay': 1}])
+def test_stale_key_set_is_used_while_the_issuer_fails(oidc_app, issuer, clock,
+                                                      failure):
+    cache = oidc.get_key_cache()
+    key = cache.get_key('k1')
+    for name, value in failure.items():
+        setattr(issuer, name, value)
+
+    clock.now += 1001
+    assert cache.get_key('k1') is key
+    assert issuer.requests == [DISCOVERY, '/jwks', DISCOVERY, '/jwks']
+    # and is not asked again for each login
+    assert cache.get_key('k1') is key
+    assert len(issuer.requests) == 4
+
+
+def login(app, token):
+    return app.test_client().post('/api/v1/login', data={'token': token},
+                                  headers={'X-Requested-With': 'test'})
+
+
+def test_login_with_issuer_token(oidc_app, issuer):
+    client = oidc_app.test_client()
+    resp = client.post('/api/v1/login', headers={'X-Requested-With': 'test'},
+                       data={'token': issuer.token('k1',
+                                                   groups=['librarians'])})
+    assert resp.status_code == 200
+    with client.session_transaction() as session:
+        assert session['username'] == 'dj'
+        assert session['access'] == ['librarian']
+
+    resp = login(oidc_app, issuer.token('k1', aud='another-client'))
+    assert resp.status_code == 401
+
+
+def test_login_without_key_set_is_unavailable(oidc_app, issuer):
+    issuer.status = 500
+    resp = login(oidc_app, issuer.token('k1'))
+    assert resp.status_code == 503
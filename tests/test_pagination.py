@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import datetime, timedelta
+import pytest
+from impala import db
+from impala.catalog import models
+from conftest import new_row
+
+
+@pytest.fixture
+def holding_ids(app):
+    """
+    Adds seven holdings, added at three moments so that most of them tie
+    on added_at, and returns their ids in (added_at, id) order
+    """
+    with app.app_context():
+        stack = new_row(models.Stack, name='Library')
+        format = new_row(models.Format, name='FLAC', physical=False)
+        group = new_row(models.HoldingGroup, album_title='Album',
+                        album_artist='Artist', stack_id=stack.id)
+        now = datetime.now()
+        rows = [new_row(models.Holding, added_at=now + timedelta(seconds=i),
+                        holding_group_id=group.id, format_id=format.id)
+                for i in [0, 0, 0, 1, 2, 2, 2]]
+        db.session.commit()
+        return [row.id for row in sorted(rows, key=lambda row: (row.added_at,
+                                                                row.id))]
+
+
+def cursor(values):
+    raw = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def test_pages_visit_tied_rows_once_in_order(client, holding_ids):
+    for limit in (1, 2, 3):
+        seen = []
+        after = ''
+        while after is not None:
+            resp = client.get('/api/v1/holdings?after={}&limit={}'.format(
+                after, limit))
+            assert resp.status_code == 200
+            body = resp.get_json()
+            assert len(body['results']) <= limit
+            seen.extend(item['id'] for item in body['results'])
+            after = body['next']
+        assert seen == holding_ids
+
+
+@pytest.mark.parametrize('after', [
+    'not a cursor!',
+    cursor(['2026-01-01T00:00:00']),
+    cursor({'added_at': '2026-01-01T00:00:00'}),
+    cursor(['yesterday', '6b1f1f5e-2a0b-4f39-9d16-5b0c6d2b9b11']),
+    cursor(['2026-01-01T00:00:00', 'not-a-uuid']),
+    cursor(['2026-01-01T00:00:00', None]),
+])
+def test_invalid_cursors_are_rejected(client, holding_ids, after):
+    resp = client.get('/api/v1/holdings?after=' + after)
+    assert resp.status_code == 400
+    assert resp.get_json()['message'] == "Invalid cursor"
@@ -0,0 +1,52 @@
+from urllib.parse import parse_qs, urlsplit
+from benchmarks.generate import Generator
+from impala import db
+from impala.plancheck import capture_statements, explain, is_count, \
+    large_tables, sample_requests, seq_scans
+
+
+def seed(tracks):
+    """Loads a generated catalog of about `tracks` tracks and analyzes it"""
+    generator = Generator(1, tracks)
+    generator.generate()
+    connection = db.engine.raw_connection()
+    try:
+        generator.load(connection)
+        connection.cursor().execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def test_search_terms_are_encoded(app, catalog):
+    catalog(1, artist='Simon & Garfunkel #1?')
+    with app.app_context():
+        paths = sample_requests()
+    searches = [path for path in paths if 'album_artist=' in path]
+    assert searches
+    for path in searches:
+        query = parse_qs(urlsplit(path).query)
+        assert query == {'album_artist': ['Simon & Garfunkel #1? 0']}
+
+
+def test_no_request_scans_a_large_table(app):
+    with app.app_context():
+        seed(10000)
+        tables = large_tables(500)
+        assert {'holding_groups', 'holdings', 'tracks'} <= tables
+        paths = sample_requests()
+        db.session.remove()
+
+        scans = []
+        for path, statement, parameters in capture_statements(
+                paths, 'test', ['librarian']):
+            # Numbered pages count every matching row; see check-plans
+            if is_count(statement):
+                continue
+            # Without sequential scans unless no index will do, the plans
+            # of this small catalog are those of a large one
+            scanned = set(seq_scans(explain(statement, parameters,
+                                            seqscan=False))) & tables
+            if scanned:
+                scans.append((path, sorted(scanned)))
+    assert scans == []
@@ -0,0 +1,92 @@
+import uuid
+from datetime import datetime
+import pytest
+from impala import db, replicas, workers
+from impala.catalog.models import Stack
+from conftest import login, truncate
+
+UNREACHABLE_URI = 'postgresql://impala@localhost:1/impala?connect_timeout=1'
+
+
+@pytest.fixture
+def make_replica_app(make_app, replica_database):
+    """Builds an application reading from the emptied replica database"""
+    def make_replica_app(uri=replica_database):
+        app = make_app(SQLALCHEMY_BINDS={'replica': uri},
+                       REPLICA_BINDS=['replica'])
+        if uri == replica_database:
+            with app.app_context():
+                truncate(db.get_engine(app, bind='replica'))
+        return app
+    return make_replica_app
+
+
+def add_stack(app, bind=None, **values):
+    """Inserts a stack into the primary, or only into the bind named"""
+    values = {'id': str(uuid.uuid4()), 'added_by': 'test',
+              'added_at': datetime.now(), 'name': 'Library', **values}
+    with app.app_context():
+        with db.get_engine(app, bind=bind).begin() as connection:
+            connection.execute(Stack.__table__.insert(), values)
+    return values['id']
+
+
+def stack_names(client):
+    resp = client.get('/api/v1/stacks')
+    assert resp.status_code == 200
+    return [stack['name'] for stack in resp.get_json()['results']]
+
+
+def test_reads_go_to_the_replica(make_replica_app):
+    app = make_replica_app()
+    add_stack(app, name='Primary')
+    add_stack(app, bind='replica', name='Replica')
+    assert stack_names(login(app.test_client())) == ['Replica']
+
+
+def test_sessions_read_their_writes_from_the_primary(make_replica_app):
+    app = make_replica_app()
+    id = add_stack(app, name='Stack')
+    add_stack(app, bind='replica', id=id, name='Stack')
+    client = login(app.test_client())
+
+    resp = client.patch('/api/v1/stacks/' + id, json={'name': 'Renamed'})
+    assert resp.status_code == 200
+    assert stack_names(client) == ['Renamed']
+
+    # Once the replica has had time to catch up, reads go back to it; this
+    # one never does, which shows where the read went
+    with client.session_transaction() as session:
+        session['primary_until'] = 0
+    assert stack_names(client) == ['Stack']
+    # Other sessions were never sent to the primary
+    assert stack_names(login(app.test_client())) == ['Stack']
+
+
+def test_unreachable_replica_falls_back_to_the_primary(make_replica_app):
+    app = make_replica_app(UNREACHABLE_URI)
+    add_stack(app, name='Primary')
+    client = login(app.test_client())
+    assert stack_names(client) == ['Primary']
+    # Marked down, so that the next request does not try it again
+    with app.app_context():
+        assert not replicas.get_replicas()[0].available
+    assert stack_names(client) == ['Primary']
+
+
+def test_lagging_replica_falls_back_to_the_primary(make_replica_app,
+                                                   monkeypatch):
+    monkeypatch.setattr(replicas, 'LAG', 'SELECT 30')
+    app = make_replica_app()
+    add_stack(app, name='Primary')
+    add_stack(app, bind='replica', name='Replica')
+    assert stack_names(login(app.test_client())) == ['Primary']
+
+
+def test_replica_engines_work_outside_requests(make_replica_app):
+    # Unreachable, so that the first use of the replica's engine is by a
+    # request rather than by the fixture truncating it
+    app = make_replica_app(UNREACHABLE_URI)
+    assert stack_names(login(app.test_client())) == []
+    # As in a worker just forked, with no application context
+    workers.replace_pools(app)
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+import pytest
+from impala import db, rollups
+from impala.catalog import models
+from conftest import new_row
+
+TAGS = rollups.ROLLUPS['tags']
+REVIEWS = rollups.ROLLUPS['reviews']
+
+
+@pytest.fixture
+def add(app, catalog):
+    """Adds tags or comments to one holding, `age` seconds ago"""
+    catalog(1)
+    with app.app_context():
+        holding_id = models.Holding.query.one().id
+
+    def add(model, age, *values):
+        with app.app_context():
+            ids = [new_row(model, holding_id=holding_id,
+                           added_at=datetime.now() - timedelta(seconds=age),
+                           **value).id
+                   for value in values]
+            db.session.commit()
+            return ids
+    return add
+
+
+def refresh(app, rollup, settle=60, rebuild=False):
+    with app.app_context():
+        return rollups.refresh(rollup, settle, rebuild)
+
+
+def totals(app, rollup):
+    with app.app_context():
+        model = rollup.model
+        return {tuple(getattr(row, name) for name in rollup.dimensions):
+                tuple(getattr(row, name) for name in rollup.measures)
+                for row in model.query}
+
+
+def tag_counts(app):
+    with app.app_context():
+        return {(tag,): (count,) for tag, count in db.session.query(
+            models.HoldingTag.tag, db.func.count()).group_by(
+            models.HoldingTag.tag)}
+
+
+def review_counts(app):
+    with app.app_context():
+        comment = models.HoldingComment
+        month = db.func.date_trunc('month', comment.added_at)
+        return {(added_at.date(), type): (comments, ratings, rating_sum)
+                for added_at, type, comments, ratings, rating_sum in
+                db.session.query(
+                    month, comment.type, db.func.count(),
+                    db.func.count(comment.rating),
+                    db.func.coalesce(db.func.sum(comment.rating), 0))
+                .group_by(month, comment.type)}
+
+
+def test_refreshes_only_add_new_rows(app, add):
+    # The catalog tags its holding "tag 0" as it is added
+    add(models.HoldingTag, 3600, {'tag': 'jazz'}, {'tag': 'rock'})
+    assert refresh(app, TAGS, settle=0) is not None
+    assert totals(app, TAGS) == tag_counts(app)
+
+    assert refresh(app, TAGS, settle=0) is None
+    add(models.HoldingTag, 0, {'tag': 'jazz'}, {'tag': 'noise'})
+    refresh(app, TAGS, settle=0)
+    assert totals(app, TAGS) == tag_counts(app)
+    assert totals(app, TAGS)[('jazz',)] == (2,)
+
+
+def test_recent_rows_wait_for_the_settle_window(app, add):
+    add(models.HoldingTag, 3600, {'tag': 'jazz'})
+    add(models.HoldingTag, 10, {'tag': 'jazz'}, {'tag': 'rock'})
+    refresh(app, TAGS, settle=60)
+    # Only the hour-old tag; the catalog's own is as recent as the others
+    assert totals(app, TAGS) == {('jazz',): (1,)}
+
+    refresh(app, TAGS, settle=0)
+    assert totals(app, TAGS) == tag_counts(app)
+
+
+def test_rebuild_matches_a_full_aggregate(app, add):
+    reviews = [{'reviewer_fullname': 'DJ', 'rating': rating, 'type': type}
+               for rating, type in [
+                   (5, models.HoldingCommentType.REVIEW),
+                   (3, models.HoldingCommentType.REVIEW),
+                   (None, models.HoldingCommentType.COMMENT)]]
+    add(models.HoldingComment, 40 * 86400, *reviews)
+    stale = add(models.HoldingComment, 3600, *reviews)
+    refresh(app, REVIEWS)
+    assert totals(app, REVIEWS) == review_counts(app)
+
+    # Refreshes only see new rows, so deletions wait for a rebuild
+    with app.app_context():
+        models.HoldingComment.query.filter_by(id=stale[0]).delete()
+        db.session.commit()
+    assert totals(app, REVIEWS) != review_counts(app)
+    refresh(app, REVIEWS, rebuild=True)
+    assert totals(app, REVIEWS) == review_counts(app)
+
+    add(models.HoldingComment, 120, *reviews)
+    refresh(app, REVIEWS)
+    assert totals(app, REVIEWS) == review_counts(app)
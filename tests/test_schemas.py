@@ -0,0 +1,86 @@
+import pytest
+from impala import db
+from impala.catalog import models
+from conftest import new_row
+
+
+@pytest.fixture
+def holding_id(app):
+    with app.app_context():
+        stack = new_row(models.Stack, name='Library')
+        format = new_row(models.Format, name='FLAC', physical=False)
+        group = new_row(models.HoldingGroup, album_title='Album',
+                        album_artist='Artist', stack_id=stack.id)
+        holding = new_row(models.Holding, holding_group_id=group.id,
+                          format_id=format.id)
+        db.session.commit()
+        return holding.id
+
+
+def track(holding_id, **values):
+    return {'title': 'Track', 'artist': 'Artist', 'track_num': 1,
+            'holding_id': holding_id, **values}
+
+
+def test_zero_and_false_are_kept(client, holding_id):
+    resp = client.put('/api/v1/formats', json={'name': 'CD',
+                                               'physical': False})
+    assert resp.status_code == 201
+    url = '/api/v1/formats/' + resp.get_json()['id']
+    assert client.get(url).get_json()['physical'] is False
+
+    resp = client.put('/api/v1/tracks', json=track(holding_id, track_num=0))
+    assert resp.status_code == 201
+    url = '/api/v1/tracks/' + resp.get_json()['id']
+    assert client.get(url).get_json()['track_num'] == 0
+
+    resp = client.patch(url, json={'track_num': 7, 'disc_num': 0})
+    assert resp.status_code == 200
+    resp = client.patch('/api/v1/holdings/' + holding_id,
+                        json={'active': 'false'})
+    assert resp.status_code == 200
+    assert client.get(url).get_json()['disc_num'] == 0
+    resp = client.get('/api/v1/holdings/' + holding_id)
+    assert resp.get_json()['active'] is False
+
+
+def test_coercion_errors_are_reported(client, holding_id):
+    resp = client.put('/api/v1/tracks', json=track(
+        'not-a-uuid', has_fcc='Maybe', track_num=1.5, title=''))
+    assert resp.status_code == 400
+    errors = resp.get_json()['message']
+    assert set(errors) == {'holding_id', 'has_fcc', 'track_num', 'title'}
+    assert errors['has_fcc'] == "Expected one of YES, NO, UNKNOWN"
+    assert errors['title'] == "Missing required parameter"
+
+    # Values are accepted by name or by value
+    resp = client.put('/api/v1/tracks', json=track(holding_id,
+                                                   has_fcc='Unknown'))
+    assert resp.status_code == 201
+
+    resp = client.put('/api/v1/rotation_releases', json={
+        'holding_id': holding_id, 'start': 'last tuesday'})
+    assert resp.status_code == 400
+    assert set(resp.get_json()['message']) == {'start'}
+
+    # PATCH requires nothing but still checks what it is given
+    url = '/api/v1/holdings/' + holding_id
+    resp = client.patch(url, json={'release_mbid': 'abc', 'active': 'maybe'})
+    assert resp.status_code == 400
+    assert set(resp.get_json()['message']) == {'release_mbid', 'active'}
+
+
+def test_batch_errors_are_keyed_by_record(client, holding_id):
+    records = [track(holding_id), 'not a record', track(holding_id),
+               track(holding_id, track_num='one', artist=None)]
+    resp = client.post('/api/v1/tracks/validate', json={'records': records})
+    assert resp.status_code == 400
+    errors = resp.get_json()['errors']
+    assert set(errors) == {'1', '3'}
+    assert errors['1'] == "Expected an object"
+    assert set(errors['3']) == {'track_num', 'artist'}
+    assert errors['3']['artist'] == "Missing required parameter"
+
+    resp = client.post('/api/v1/tracks/validate', json={
+        'records': [{'track_num': 2}, {}], 'partial': True})
+    assert resp.get_json() == {'success': True, 'valid': 2}
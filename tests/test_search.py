@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+import pytest
+from impala import db
+from impala.catalog import models
+from impala.search import SearchBackend
+from impala.search.memory import MemorySearchBackend
+from impala.search.sql import SqlSearchBackend
+from conftest import new_row
+
+# (album artist, album title, [(label, torrent hash) of each holding])
+ALBUMS = [
+    ('The Beatles', 'Abbey Road', [('Apple', None), ('Apple', 'ABC123')]),
+    ('Beatles Tribute', 'Abbey_Road Live', [('100% Records', None)]),
+    ('Slint', 'Spiderland', [('Touch and Go', 'def456')]),
+    ('Touch', 'Road to Nowhere', [(None, None)]),
+    ('Neu!', 'Neu! 75', [('Brain', None), ('Grönland', None)]),
+]
+
+SEARCHES = [
+    {},
+    {'any': 'road'},
+    {'any': 'abc123'},
+    {'any': 'touch'},
+    {'any': '100%'},
+    {'any': 'abbey_'},
+    {'album_artist': 'beatles'},
+    {'album_title': 'road', 'label': 'apple'},
+    {'label': 'grön'},
+    {'torrent_hash': 'DEF456'},
+    {'album_artist': 'the', 'any': 'road'},
+    {'q': 'road'},
+    {'q': 'touch'},
+    {'q': 'beatles abbey'},
+    {'q': 'nothing matches'},
+]
+
+
+@pytest.fixture
+def backends(app):
+    with app.app_context():
+        stack = new_row(models.Stack, name='Library')
+        format = new_row(models.Format, name='FLAC', physical=False)
+        added_at = datetime.now()
+        for artist, title, holdings in ALBUMS:
+            added_at += timedelta(seconds=1)
+            group = new_row(models.HoldingGroup, added_at=added_at,
+                            album_artist=artist, album_title=title,
+                            stack_id=stack.id)
+            for label, torrent_hash in holdings:
+                new_row(models.Holding, holding_group_id=group.id,
+                        format_id=format.id, label=label,
+                        torrent_hash=torrent_hash)
+        db.session.commit()
+        yield SqlSearchBackend(app), MemorySearchBackend(app)
+
+
+@pytest.mark.parametrize('args', SEARCHES)
+def test_backends_agree(backends, args):
+    sql, memory = backends
+    for page, per_page in [(1, 20), (1, 2), (2, 2), (3, 2)]:
+        sql_ids, total = sql.search(args, page, per_page)
+        memory_ids, memory_total = memory.search(args, page, per_page)
+        assert memory_total == total
+        if not args.get('q'):
+            assert memory_ids == sql_ids
+        elif per_page >= total:
+            # Each backend ranks matches its own way, so only whole result
+            # sets can be compared
+            assert set(memory_ids) == set(sql_ids)
+    assert len(sql.search(args, 1, total + 1)[0]) == total
+
+
+def test_backends_must_search():
+    class Backend(SearchBackend):
+        pass
+    with pytest.raises(TypeError):
+        Backend(None)
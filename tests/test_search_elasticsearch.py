@@ -0,0 +1,160 @@
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+from impala.search.elasticsearch import ElasticsearchBackend
+
+ALIAS = 'impala-holdings'
+
+
+class FakeElasticsearch:
+    """
+    The parts of the index and alias API the backend uses, including
+    creating a plain index for a write to a name that does not exist
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.aliases = {}
+
+    def resolve(self, name):
+        if name in self.aliases:
+            return sorted(self.aliases[name])
+        if name in self.indexes:
+            return [name]
+        return []
+
+    def handle(self, method, path, body):
+        parts = path.strip('/').split('/')
+        name = parts[0]
+        if method == 'HEAD':
+            return (200 if self.resolve(name) else 404), {}
+        if method == 'PUT':
+            if self.resolve(name):
+                return 400, {'error': {
+                    'type': 'resource_already_exists_exception'}}
+            self.indexes[name] = {}
+            for alias in json.loads(body).get('aliases', {}):
+                self.aliases.setdefault(alias, set()).add(name)
+            return 200, {'acknowledged': True}
+        if method == 'DELETE':
+            del self.indexes[name]
+            for indexes in self.aliases.values():
+                indexes.discard(name)
+            return 200, {'acknowledged': True}
+        if name == '_aliases':
+            return self.update_aliases(json.loads(body)['actions'])
+        if parts[1:] == ['_alias']:
+            indexes = self.resolve(name)
+            if not indexes:
+                return 404, {}
+            return 200, {index: {'aliases': {}} for index in indexes}
+        if parts[1:] == ['_refresh']:
+            return 200, {}
+        if parts[1:] == ['_bulk']:
+            return self.bulk(name, body)
+        return 404, {}
+
+    def update_aliases(self, actions):
+        removed = {action['remove_index']['index'] for action in actions
+                   if 'remove_index' in action}
+        for action in actions:
+            alias = action.get('add', {}).get('alias')
+            if alias in self.indexes and alias not in removed:
+                return 400, {'error': {
+                    'type': 'invalid_alias_name_exception'}}
+        for action in actions:
+            if 'remove_index' in action:
+                del self.indexes[action['remove_index']['index']]
+            elif 'remove' in action:
+                self.aliases[action['remove']['alias']].discard(
+                    action['remove']['index'])
+        for action in actions:
+            if 'add' in action:
+                self.aliases.setdefault(action['add']['alias'], set()).add(
+                    action['add']['index'])
+        return 200, {'acknowledged': True}
+
+    def bulk(self, name, body):
+        indexes = self.resolve(name)
+        if not indexes:
+            self.indexes[name] = {}
+            indexes = [name]
+        docs = self.indexes[indexes[0]]
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        while lines:
+            action = lines.pop(0)
+            if 'index' in action:
+                docs[action['index']['_id']] = lines.pop(0)
+            else:
+                docs.pop(action['delete']['_id'], None)
+        return 200, {'errors': False}
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode()
+                with fake.lock:
+                    status, result = fake.handle(self.command, self.path,
+                                                 body)
+                data = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def elasticsearch(http_server):
+    fake = FakeElasticsearch()
+    app = Flask(__name__)
+    app.config.update(ELASTICSEARCH_URL=http_server(fake.handler()),
+                      ELASTICSEARCH_INDEX=ALIAS, ELASTICSEARCH_TIMEOUT=5)
+    return fake, lambda: ElasticsearchBackend(app)
+
+
+def holding(id):
+    group = SimpleNamespace(id='group-' + id, album_artist='Artist',
+                            album_title='Album', added_at=datetime.now())
+    return SimpleNamespace(id=id, holding_group=group, label='Label',
+                           torrent_hash=None)
+
+
+def test_writes_before_rebuild_go_to_an_index_behind_the_alias(
+        elasticsearch):
+    fake, backend = elasticsearch
+    backend().index_holdings([holding('a')])
+    # A second worker finds the index the first one created
+    backend().index_holdings([holding('b')])
+    assert ALIAS not in fake.indexes
+    assert fake.resolve(ALIAS) == [ALIAS + '-initial']
+    assert set(fake.indexes[ALIAS + '-initial']) == {'a', 'b'}
+
+    backend().rebuild([holding('c')])
+    [index] = fake.resolve(ALIAS)
+    assert list(fake.indexes) == [index]
+    assert set(fake.indexes[index]) == {'c'}
+
+
+def test_rebuild_replaces_a_plain_index_named_like_the_alias(elasticsearch):
+    fake, backend = elasticsearch
+    fake.indexes[ALIAS] = {'a': {}}
+    backend().rebuild([holding('b')])
+    [index] = fake.resolve(ALIAS)
+    assert index != ALIAS
+    assert list(fake.indexes) == [index]
@@ -0,0 +1,74 @@
+import json
+import uuid
+from datetime import datetime
+import pytest
+from impala import db
+from impala.catalog import metadata, models
+from conftest import new_row
+
+DOCUMENT = {'genre': ['Jazz', 'Rock'], 'mood': ['Calm']}
+MISSING = str(uuid.uuid4())
+
+
+@pytest.fixture
+def entries(app):
+    """
+    Adds tracks that were all added at the same moment, as an album import
+    adds them, and returns the ids of their values
+    """
+    with app.app_context():
+        stack = new_row(models.Stack, name='Library')
+        format = new_row(models.Format, name='FLAC', physical=False)
+        group = new_row(models.HoldingGroup, album_title='Album',
+                        album_artist='Artist', stack_id=stack.id)
+        holding = new_row(models.Holding, holding_group_id=group.id,
+                          format_id=format.id)
+        added_at = datetime.now()
+        ids = []
+        for i in range(4):
+            track = new_row(models.Track, added_at=added_at,
+                            title='Track {}'.format(i), artist='Artist',
+                            track_num=i + 1, holding_id=holding.id,
+                            metadata_=DOCUMENT)
+            ids.extend(metadata.entry_id(track.id, key, value)
+                       for key, values in DOCUMENT.items()
+                       for value in values)
+        db.session.commit()
+    return ids
+
+
+def result_ids(resp):
+    assert resp.status_code == 200
+    return [item['id'] for item in resp.get_json()['results']]
+
+
+def test_values_are_fetched_by_id(client, entries):
+    wanted = [entries[5], entries[0], MISSING, entries[11]]
+    resp = client.get('/api/v1/track_metadata?ids=' + ','.join(wanted))
+    assert result_ids(resp) == [entries[5], entries[0], entries[11]]
+    assert resp.get_json()['missing'] == [MISSING]
+
+    resp = client.post('/api/v1/track_metadata/batch_get',
+                       json={'ids': wanted, 'fields': ['key']})
+    assert result_ids(resp) == [entries[5], entries[0], entries[11]]
+    assert resp.get_json()['missing'] == [MISSING]
+
+
+@pytest.mark.parametrize('fields', ['', '&fields=key'])
+def test_cursor_pages_visit_every_value_once(client, entries, fields):
+    seen = []
+    after = ''
+    while after is not None:
+        resp = client.get('/api/v1/track_metadata?limit=5&after={}{}'.format(
+            after, fields))
+        seen.extend(result_ids(resp))
+        after = resp.get_json()['next']
+    assert sorted(seen) == sorted(entries)
+
+
+def test_export_is_in_cursor_order(client, entries):
+    resp = client.get('/api/v1/track_metadata/export')
+    assert resp.status_code == 200
+    exported = [json.loads(line)['id'] for line in resp.data.splitlines()]
+    assert exported == result_ids(
+        client.get('/api/v1/track_metadata?limit=100&after='))
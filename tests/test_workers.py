@@ -0,0 +1,34 @@
+import os
+from impala import create_app, db, workers
+
+
+def test_forked_children_get_their_own_pools():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///unused'},
+                     cli=False)
+    with app.app_context():
+        pool = db.engine.pool
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read)
+            with app.app_context():
+                replaced = db.engine.pool
+            # uWSGI's postfork hook as well, with --py-call-osafterfork
+            workers._after_fork()
+            with app.app_context():
+                result = (replaced is not pool, db.engine.pool is replaced)
+            os.write(write, repr(result).encode())
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write)
+    with os.fdopen(read) as f:
+        result = f.read()
+    assert os.waitpid(pid, 0)[1] == 0
+    assert result == repr((True, True))
+
+    with app.app_context():
+        assert db.engine.pool is pool